@@ -1,13 +1,27 @@
 import os
+from datetime import datetime
 
-from flask import Flask, render_template, request, flash, redirect, session, g
+import click
+from flask import (Flask, render_template, request, flash, redirect, session, g,
+                   jsonify, abort)
 from flask_debugtoolbar import DebugToolbarExtension
 from sqlalchemy.exc import IntegrityError
-from sqlalchemy import or_
+from passwords import PasswordHasherBusy
 from forms import UserAddForm, LoginForm, MessageForm, EditProfileForm
-from models import db, connect_db, User, Message
-import pytz
-from pytz import timezone
+from models import (db, connect_db, User, CurrentUser, AccountGone, Message,
+                    Timeline, Like,
+                    FollowersFollowee, Suggestion, follow_graph,
+                    reads_from_replica, note_follows_changed, adjust_counters,
+                    repair_counters)
+from pagination import paginate, paginate_by_id, Page
+from cache import LRUCache
+from localtime import localize
+from fragments import FragmentCache
+from assets import AssetManifest
+from conditional import conditional
+from search import get_user_search, get_message_search, create_search_indexes
+from jobs import enqueue, work
+import trending
 
 
 #Secrets
@@ -21,13 +35,62 @@ app.config['SQLALCHEMY_DATABASE_URI'] = (
     os.environ.get('DATABASE_URL', 'postgres:///warbler'))
 
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+
+# Connection pool and timeouts (see pool.py for what each one does)
+for key in ('DB_POOL_SIZE', 'DB_MAX_OVERFLOW', 'DB_POOL_TIMEOUT',
+            'DB_POOL_RECYCLE', 'DB_STATEMENT_TIMEOUT', 'DB_POOL_WAIT_WARNING'):
+    if key in os.environ:
+        app.config[key] = int(os.environ[key])
+for key in ('DB_POOL_PRE_PING', 'DB_PGBOUNCER'):
+    if key in os.environ:
+        app.config[key] = os.environ[key] == '1'
+# Comma-separated read replica URLs; see reads_from_replica in models.py.
+app.config['DATABASE_REPLICA_URLS'] = [
+    url for url in os.environ.get('DATABASE_REPLICA_URLS', '').split(',')
+    if url]
+app.config['REPLICA_STICKY_SECONDS'] = int(
+    os.environ.get('REPLICA_STICKY_SECONDS', 5))
 app.config['SQLALCHEMY_ECHO'] = False
+app.config['QUERY_STATS'] = os.environ.get('QUERY_STATS') == '1'
 app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', "it's a secret")
+app.config['ETAG_VERSION'] = os.environ.get('ETAG_VERSION', '')
+app.config['ASSETS_PRECOMPRESS'] = os.environ.get('ASSETS_PRECOMPRESS') != '0'
+app.config['BCRYPT_LOG_ROUNDS'] = int(os.environ.get('BCRYPT_LOG_ROUNDS', 12))
+# Sized to the gunicorn threads per process (see Procfile): hashing may tie
+# up at most a quarter of them, and waiting for it at most half, so the
+# rest keep serving feeds and a burst beyond that gets a 503.
+web_threads = int(os.environ.get('WEB_THREADS', 8))
+app.config['PASSWORD_HASH_WORKERS'] = int(
+    os.environ.get('PASSWORD_HASH_WORKERS', max(1, web_threads // 4)))
+app.config['PASSWORD_HASH_QUEUE'] = int(
+    os.environ.get('PASSWORD_HASH_QUEUE', max(1, web_threads // 2)))
 toolbar = DebugToolbarExtension(app)
 
 connect_db(app)
 CURR_USER_KEY = 'curr_user'
+USERS_PER_PAGE = 24
+AUTOCOMPLETE_LIMIT = 10
+
+# Logged-in users' profile snapshots, so most requests don't need to load
+# the User row at all (see CurrentUser). Entries are dropped when a profile
+# changes; the TTL bounds staleness across worker processes.
+user_cache = LRUCache(maxsize=int(os.environ.get('USER_CACHE_SIZE', 10000)),
+                      ttl=int(os.environ.get('USER_CACHE_TTL', 60)))
+
+# Rendered, viewer-independent feed message HTML (see fragments.py).
+fragment_cache = FragmentCache(
+    LRUCache(maxsize=int(os.environ.get('FRAGMENT_CACHE_SIZE', 10000))))
+app.jinja_env.globals['message_item'] = fragment_cache.render
+
+# Each user's followee ids, behind every "am I following?" check (see
+# followgraph.py). The TTL bounds staleness across worker processes.
+follow_graph.local = LRUCache(
+    maxsize=int(os.environ.get('FOLLOW_GRAPH_CACHE_SIZE', 10000)),
+    ttl=int(os.environ.get('FOLLOW_GRAPH_CACHE_TTL', 60)))
+
+# Content-hashed, long-cached static files (see assets.py).
+assets = AssetManifest(app)
 
 
 ##############################################################################
@@ -39,7 +102,11 @@ def add_user_to_g():
     """If we're logged in, add curr user to Flask global."""
 
     if CURR_USER_KEY in session:
-        g.user = User.query.get(session[CURR_USER_KEY])
+        g.user = CurrentUser.load(session[CURR_USER_KEY], user_cache)
+
+        # the account is gone
+        if g.user is None:
+            do_logout()
     else:
         g.user = None
 
@@ -84,6 +151,7 @@ def signup():
             user.bio = User.bio.default.arg
             db.session.add(user)
             db.session.commit()
+            get_user_search().add(user)
 
         except IntegrityError as e:
             flash("Username already taken", 'danger')
@@ -108,6 +176,7 @@ def login():
                                  form.password.data)
 
         if user:
+            db.session.commit()  # saves a re-hashed password, if any
             do_login(user)
             flash(f"Hello, {user.username}!", "success")
             return redirect("/")
@@ -130,81 +199,181 @@ def logout():
 # General user routes:
 
 @app.route('/users')
+@reads_from_replica
 def list_users():
     """Page with listing of users.
 
-    Can take a 'q' param in querystring to search by that username.
+    Can take a 'q' param in querystring to search usernames, bios and
+    locations (best matches first), and a 'page' param.
     """
 
     search = request.args.get('q')
+    page = max(request.args.get('page', 1, type=int), 1)
+    offset = (page - 1) * USERS_PER_PAGE
 
+    # fetch one extra row to tell whether there's a next page
     if not search:
-        users = User.query.all()
+        users = (User
+                 .query
+                 .filter(User.deleted_at.is_(None))
+                 .order_by(User.id)
+                 .offset(offset)
+                 .limit(USERS_PER_PAGE + 1)
+                 .all())
     else:
-        users = User.query.filter(User.username.like(f"%{search}%")).all()
+        users = get_user_search().search(search,
+                                         limit=USERS_PER_PAGE + 1,
+                                         offset=offset)
+
+    has_next = len(users) > USERS_PER_PAGE
+    users = users[:USERS_PER_PAGE]
+
+    if g.user:
+        g.user.lookup.prime(users=users)
 
-    return render_template('users/index.html', users=users)
+    return render_template('users/index.html',
+                           users=users,
+                           q=search,
+                           page=page,
+                           has_next=has_next)
+
+
+@app.route('/users/autocomplete')
+def autocomplete_users():
+    """JSON list of users whose username starts with the 'q' param."""
+
+    prefix = request.args.get('q', '')
+
+    users = (get_user_search().autocomplete(prefix, AUTOCOMPLETE_LIMIT)
+             if prefix else [])
+
+    return jsonify([{'id': user.id,
+                     'username': user.username,
+                     'image_url': user.image_url}
+                    for user in users])
 
 
 @app.route('/users/<int:user_id>')
+@reads_from_replica
 def users_show(user_id):
-    """Show user profile."""
-
-    user = User.query.get_or_404(user_id)
+    """Show user profile.
 
-    # snagging messages in order from the database;
-    # user.messages won't be in order by default
-    messages = (Message
-                .query
-                .filter(Message.user_id == user_id)
-                .order_by(Message.timestamp.desc())
-                .limit(100)
-                .all())
+    Answers 304 when the client's copy is current (see conditional.py).
+    """
 
-    list_of_time_msg_tuples = []
+    user = get_user_or_404(user_id)
 
-    for message in messages:
+    def render():
+        # snagging messages in order from the database;
+        # user.messages won't be in order by default
+        messages = paginate(Message
+                            .query
+                            .filter(Message.user_id == user_id)
+                            .options(db.joinedload(Message.user)),
+                            Message.timestamp,
+                            Message.id,
+                            before=request.args.get('before'),
+                            after=request.args.get('after'))
 
         if g.user:
-            aware_time = message.timestamp.replace(tzinfo=pytz.UTC)
-            print(f'########Before{aware_time}############')
-            new_time = aware_time.astimezone(timezone(g.user.time_zone))
-            print(f'########Converted{aware_time}############')
-            print(f'########Converted{new_time}############')
-        else:
-            new_time = message.timestamp
+            g.user.lookup.prime(messages=messages, users=[user])
 
-        list_of_time_msg_tuples.append((message, new_time))
+        return render_template("users/show.html",
+                               messages=localize(messages,
+                                                 g.user and g.user.time_zone),
+                               page=messages,
+                               current_user=g.user,
+                               user=user,
+                               return_url=f'/users/{user_id}')
 
-    return render_template("users/show.html",
-                           messages=list_of_time_msg_tuples,
-                           current_user=g.user,
-                           user=user,
-                           return_url=f'/users/{user_id}')
+    return conditional(render, [user, g.user])
 
 
 @app.route('/users/<int:user_id>/following')
+@reads_from_replica
 def show_following(user_id):
-    """Show list of people this user is following."""
+    """Show a page of the people this user is following."""
 
     if not g.user:
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    user = User.query.get_or_404(user_id)
-    return render_template('users/following.html', user=user)
+    user = get_user_or_404(user_id)
+
+    # follows.followee_id is the follower; see FollowersFollowee
+    following = follow_page(FollowersFollowee.follower_id,
+                            FollowersFollowee.followee_id == user_id)
+
+    def render():
+        g.user.lookup.prime(users=following.items + [user])
+        return render_template('users/following.html',
+                               user=user,
+                               users=following,
+                               page=following)
+
+    return conditional(render, [user, g.user],
+                       timestamps=[latest_profile_edit(following)])
 
 
 @app.route('/users/<int:user_id>/followers')
+@reads_from_replica
 def users_followers(user_id):
-    """Show list of followers of this user."""
+    """Show a page of this user's followers."""
 
     if not g.user:
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
+    user = get_user_or_404(user_id)
+
+    followers = follow_page(FollowersFollowee.followee_id,
+                            FollowersFollowee.follower_id == user_id)
+
+    def render():
+        g.user.lookup.prime(users=followers.items + [user])
+        return render_template('users/followers.html',
+                               user=user,
+                               users=followers,
+                               page=followers)
+
+    return conditional(render, [user, g.user],
+                       timestamps=[latest_profile_edit(followers)])
+
+
+def get_user_or_404(user_id):
+    """User `user_id`, or a 404 if there's none or the account is deleted."""
+
     user = User.query.get_or_404(user_id)
-    return render_template('users/followers.html', user=user)
+
+    if user.deleted_at is not None:
+        abort(404)
+
+    return user
+
+
+def follow_page(listed_col, criterion):
+    """One page of a follower / following list, newest accounts first.
+
+    `listed_col` is the follows column holding the listed users' ids and
+    `criterion` selects the list's rows; pages are keyset reads over the
+    follows indexes, with ?before= / ?after= cursors. Deleted accounts are
+    left out while their follows wait to be purged.
+    """
+
+    return paginate_by_id(User
+                          .query
+                          .join(FollowersFollowee, listed_col == User.id)
+                          .filter(criterion, User.deleted_at.is_(None)),
+                          listed_col,
+                          before=request.args.get('before'),
+                          after=request.args.get('after'),
+                          per_page=USERS_PER_PAGE)
+
+
+def latest_profile_edit(users):
+    """Newest `updated_at` among the listed `users`, if any."""
+
+    return max((user.updated_at for user in users), default=None)
 
 
 @app.route('/users/follow/<int:follow_id>', methods=['POST'])
@@ -215,9 +384,22 @@ def add_follow(follow_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    followee = User.query.get_or_404(follow_id)
-    g.user.following.append(followee)
-    db.session.commit()
+    followee = get_user_or_404(follow_id)
+
+    # check the table, not the (possibly stale) follow graph cache
+    if not FollowersFollowee.query.get((g.user.id, followee.id)):
+        # follows.followee_id is the follower; see FollowersFollowee
+        db.session.add(FollowersFollowee(followee_id=g.user.id,
+                                         follower_id=followee.id))
+        Timeline.backfill(g.user.id, followee.id)
+        Suggestion.discard(g.user.id, followee.id)
+        enqueue('suggest', user_id=g.user.id, followed_id=followee.id,
+                change=1)
+        adjust_counters(User, User.id == g.user.id, following_count=1)
+        adjust_counters(User, User.id == followee.id, follower_count=1)
+        db.session.commit()
+        follow_graph.invalidate(g.user.id)
+        note_follows_changed()
 
     return redirect(f"/users/{g.user.id}/following")
 
@@ -230,9 +412,22 @@ def stop_following(follow_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    followee = User.query.get(follow_id)
-    g.user.following.remove(followee)
-    db.session.commit()
+    # a deleted account's follows are being purged, and its counters
+    # already retracted, by the delete_account job
+    followee = get_user_or_404(follow_id)
+
+    follow = FollowersFollowee.query.get((g.user.id, followee.id))
+
+    if follow:
+        db.session.delete(follow)
+        Timeline.prune(g.user.id, followee.id)
+        enqueue('suggest', user_id=g.user.id, followed_id=followee.id,
+                change=-1)
+        adjust_counters(User, User.id == g.user.id, following_count=-1)
+        adjust_counters(User, User.id == followee.id, follower_count=-1)
+        db.session.commit()
+        follow_graph.invalidate(g.user.id)
+        note_follows_changed()
 
     return redirect(f"/users/{g.user.id}/following")
 
@@ -259,8 +454,11 @@ def edit_profile():
             user.location = form.location.data
             user.show_location = form.show_location.data
             user.time_zone = form.time_zone.data
+            user.updated_at = datetime.utcnow()
 
             db.session.commit()
+            user_cache.delete(user.id)
+            get_user_search().add(user)
             return redirect(f'/users/{user.id}')
         else:
             flash("Wrong password. Access unauthorized.", "danger")
@@ -279,9 +477,19 @@ def delete_user():
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    User.query.filter(User.id == g.user.id).delete()
-    # db.session.delete(g.user)
+    # The account's rows are removed by the job worker, a batch at a time;
+    # marking it deleted logs it out and hides it meanwhile.
+    now = datetime.utcnow()
+    (User.query
+        .filter(User.id == g.user.id)
+        .update({User.deleted_at: now, User.changed_at: now},
+                synchronize_session=False))
+    enqueue('delete_account', user_id=g.user.id)
     db.session.commit()
+    follow_graph.invalidate(g.user.id)
+    user_cache.delete(g.user.id)
+    get_user_search().remove(g.user.id)
+    get_message_search().remove_author(g.user.id)
 
     do_logout()
 
@@ -307,19 +515,100 @@ def messages_add():
     if form.validate_on_submit():
         msg = Message(text=form.text.data)
         g.user.messages.append(msg)
+        db.session.flush()
+        Timeline.post(msg)
+        enqueue('fan_out', message_id=msg.id)
+        adjust_counters(User, User.id == g.user.id, message_count=1)
         db.session.commit()
+        get_message_search().add(msg)
 
         return redirect(f"/users/{g.user.id}")
 
     return render_template('messages/new.html', form=form)
 
 
+@app.route('/messages/search')
+def messages_search():
+    """Search message text for the 'q' param; best matches first.
+
+    Further pages via ?before=<cursor>.
+    """
+
+    search = request.args.get('q', '').strip()
+
+    if search:
+        messages = get_message_search().search(
+            search, before=request.args.get('before'))
+    else:
+        messages = Page([])
+
+    if g.user:
+        g.user.lookup.prime(messages=messages)
+
+    return render_template('messages/search.html',
+                           messages=localize(messages,
+                                             g.user and g.user.time_zone),
+                           page=messages,
+                           q=search,
+                           current_user=g.user,
+                           return_url=request.full_path)
+
+
+@app.route('/trending')
+@reads_from_replica
+def messages_trending():
+    """Show the most-liked messages of the ?window= (1h, 24h or 7d)."""
+
+    window = request.args.get('window', trending.DEFAULT_WINDOW)
+    if window not in trending.WINDOWS:
+        abort(404)
+
+    if trending.claim_refresh():
+        enqueue('refresh_trending')
+    db.session.commit()
+
+    ranked = trending.top(window)
+    messages = [entry.message for entry in ranked]
+
+    if g.user:
+        g.user.lookup.prime(messages=messages)
+
+    return render_template('messages/trending.html',
+                           messages=localize(messages,
+                                             g.user and g.user.time_zone),
+                           likes=[entry.likes for entry in ranked],
+                           window=window,
+                           windows=trending.WINDOWS,
+                           current_user=g.user,
+                           return_url=request.full_path)
+
+
 @app.route('/messages/<int:message_id>', methods=["GET"])
+@reads_from_replica
 def messages_show(message_id):
     """Show a message."""
 
-    msg = Message.query.get(message_id)
-    return render_template('messages/show.html', message=msg)
+    msg = get_message_or_404(message_id)
+
+    def render():
+        if g.user:
+            g.user.lookup.prime(users=[msg.user])
+
+        return render_template('messages/show.html', message=msg)
+
+    return conditional(render, [msg.user, g.user], extra=[msg.id])
+
+
+def get_message_or_404(message_id):
+    """Message `message_id` with its author loaded, or a 404 if there's
+    none or the author's account is deleted."""
+
+    msg = Message.query.options(db.joinedload(Message.user)).get(message_id)
+
+    if msg is None or msg.user.deleted_at is not None:
+        abort(404)
+
+    return msg
 
 
 @app.route('/messages/<int:message_id>/delete', methods=["POST"])
@@ -332,8 +621,16 @@ def messages_destroy(message_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
+    likers = db.session.query(Like.user_id).filter(
+        Like.message_id == message.id)
+
+    fragment_cache.invalidate(message)
+    Timeline.remove_message(message.id)
+    adjust_counters(User, User.id == g.user.id, message_count=-1)
+    adjust_counters(User, User.id.in_(likers.subquery()), likes_count=-1)
     db.session.delete(message)
     db.session.commit()
+    get_message_search().remove(message_id)
 
     return redirect(f"/users/{g.user.id}")
 
@@ -343,83 +640,162 @@ def messages_destroy(message_id):
 
 
 @app.route('/')
+@reads_from_replica
 def homepage():
     """Show homepage:
 
     - anon users: no messages
-    - logged in: 100 most recent messages of followees
+    - logged in: a page of the 100 most recent messages of followees (older
+      pages via ?before=<cursor>), read from the user's precomputed timeline,
+      plus precomputed "who to follow" suggestions
     """
 
     if g.user:
 
-        follower_ids = [u.id for u in g.user.following]
-
-        messages = (Message
-                    .query
-                    .filter(or_(Message.user_id.in_(follower_ids), g.user.id == Message.user_id))
-                    .order_by(Message.timestamp.desc())
-                    .limit(100)
-                    .all())
+        messages = paginate(Timeline
+                            .feed_for(g.user.id)
+                            .options(db.contains_eager(Message.user)),
+                            Timeline.timestamp,
+                            Timeline.message_id,
+                            before=request.args.get('before'),
+                            after=request.args.get('after'))
 
-        list_of_time_msg_tuples = []
-
-        for message in messages:
-            aware_time = message.timestamp.replace(tzinfo=pytz.UTC)
-            new_time = aware_time.astimezone(timezone(g.user.time_zone))
-            list_of_time_msg_tuples.append((message, new_time))
+        g.user.lookup.prime(messages=messages)
 
         return render_template("home.html",
-                               messages=list_of_time_msg_tuples,
+                               messages=localize(messages, g.user.time_zone),
+                               suggestions=Suggestion.for_user(g.user.id),
+                               page=messages,
                                current_user=g.user,
                                return_url=f'/')
 
     else:
         return render_template('home-anon.html')
 
+
+@app.errorhandler(PasswordHasherBusy)
+def password_hasher_busy(e):
+    """Too many logins / signups in flight: ask the client to retry."""
+
+    return render_template('busy.html'), 503, {'Retry-After': '5'}
+
+
+@app.errorhandler(AccountGone)
+def account_gone(e):
+    """The account was deleted (e.g. via another worker) mid-session."""
+
+    db.session.rollback()
+    do_logout()
+    flash("That account no longer exists.", "danger")
+
+    return redirect("/login")
+
+
 ##############################################################################
 # like-unlike messages
 
+@app.route('/messages/<int:message_id>/like', methods=["POST"])
+def like_message(message_id):
+    """Like a message; liking it again changes nothing."""
+
+    return set_like(message_id, True)
+
+
+@app.route('/messages/<int:message_id>/unlike', methods=["POST"])
+def unlike_message(message_id):
+    """Stop liking a message; unliking it again changes nothing."""
+
+    return set_like(message_id, False)
+
+
 @app.route('/toggle_like_status', methods=["POST"])
 def toggle_likes():
-    ''' toggle like status of message, redirects back to page passed in from like button'''
+    ''' toggle like status of message, redirects back to page passed in from like button
+
+    Kept for pages rendered before the like/unlike routes; unlike those,
+    a repeated toggle undoes itself.'''
 
     if not g.user:
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    message_id = request.form['message_id']
-    return_url = request.form['return_url']
+    message_id = request.form.get('message_id', type=int)
+    if message_id is None:
+        abort(400)
 
-    found_message = Message.query.get(message_id)
+    return set_like(message_id, not g.user.lookup.likes(message_id))
 
-    if found_message in g.user.liked_messages:
-        g.user.liked_messages.remove(found_message)
-    else:
-        g.user.liked_messages.append(found_message)
 
-    db.session.commit()
+def set_like(message_id, liked):
+    """Make g.user like, or not like, a message (see Like.set).
+
+    Answers fetch() callers asking for JSON with the new state and count;
+    forms are redirected back to their return_url.
+    """
+
+    if not g.user:
+        if wants_json():
+            abort(401)
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+
+    get_message_or_404(message_id)
+
+    try:
+        change = Like.set(g.user.id, message_id, liked)
+        if change:
+            trending.record_like(message_id, change)
+        db.session.commit()
+    except IntegrityError:
+        # the message was deleted meanwhile
+        db.session.rollback()
+        abort(404)
+
+    if wants_json():
+        like_count = (db.session
+                      .query(Message.like_count)
+                      .filter(Message.id == message_id)
+                      .scalar())
+        if like_count is None:
+            abort(404)
+        return jsonify({'message_id': message_id,
+                        'liked': liked,
+                        'like_count': like_count})
+
+    return redirect(request.form.get('return_url', '/'))
+
+
+def wants_json():
+    """Did the client ask for JSON rather than a page?"""
+
+    return (request.accept_mimetypes.best_match(['text/html',
+                                                 'application/json'])
+            == 'application/json')
 
-    return redirect(return_url)
 
 @app.route('/users/<int:user_id>/liked')
 def show_liked_messages(user_id):
-    """shows all liked messages"""
+    """shows liked messages, a page at a time"""
 
     if not g.user or user_id != g.user.id:
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    messages = g.user.liked_messages
-
-    list_of_time_msg_tuples = []
-
-    for message in messages:
-        aware_time = message.timestamp.replace(tzinfo=pytz.UTC)
-        new_time = aware_time.astimezone(timezone(g.user.time_zone))
-        list_of_time_msg_tuples.append((message, new_time))
+    messages = paginate(Message
+                        .query
+                        .join(Like, Like.message_id == Message.id)
+                        .join(User, User.id == Message.user_id)
+                        .filter(Like.user_id == user_id,
+                                User.deleted_at.is_(None))
+                        .options(db.contains_eager(Message.user)),
+                        Message.timestamp,
+                        Message.id,
+                        before=request.args.get('before'),
+                        after=request.args.get('after'))
 
     return render_template("users/liked_messages.html",
-                           messages=list_of_time_msg_tuples,
+                           messages=localize(messages, g.user.time_zone),
+                           page=messages,
                            user=g.user,
                            return_url=f'/users/{user_id}/liked')
 
@@ -450,18 +826,70 @@ def show_liked_messages(user_id):
 
 
 ##############################################################################
-# Turn off all caching in Flask
-#   (useful for dev; in production, this kind of stuff is typically
-#   handled elsewhere)
+# Response caching
 #
-# https://stackoverflow.com/questions/34066804/disabling-caching-in-flask
+# Fingerprinted /assets/ responses carry their own year-long Cache-Control
+# (see assets.py). HTML is always revalidated, and pages rendered for a
+# logged-in user are never stored, since they show that user's data --
+# unless they have an ETag (see conditional.py), in which case the browser
+# may keep a private copy to revalidate.
 
 @app.after_request
-def add_header(req):
-    """Add non-caching headers on every request."""
-
-    req.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
-    req.headers["Pragma"] = "no-cache"
-    req.headers["Expires"] = "0"
-    req.headers['Cache-Control'] = 'public, max-age=0'
-    return req
+def add_header(resp):
+    """Set Cache-Control on HTML responses."""
+
+    if resp.mimetype == 'text/html':
+        if g.get('user'):
+            resp.headers['Cache-Control'] = ('private, no-cache'
+                                             if resp.get_etag()[0]
+                                             else 'private, no-store')
+        else:
+            resp.headers['Cache-Control'] = 'no-cache'
+
+    return resp
+
+
+##############################################################################
+# Maintenance commands
+
+
+@app.cli.command('create-search-indexes')
+def create_search_indexes_command():
+    """Create the full-text and pg_trgm indexes behind search."""
+
+    create_search_indexes()
+    db.session.commit()
+
+
+@app.cli.command('repair-counters')
+def repair_counters_command():
+    """Recompute denormalized message/follow/like counters in bulk."""
+
+    repair_counters()
+    db.session.commit()
+
+
+@app.cli.command('rebuild-suggestions')
+def rebuild_suggestions_command():
+    """Recompute every user's "who to follow" suggestions in bulk."""
+
+    Suggestion.rebuild()
+    db.session.commit()
+
+
+@app.cli.command('refresh-trending')
+def refresh_trending_command():
+    """Recompute the trending pages' rankings (see trending.py)."""
+
+    trending.refresh()
+    db.session.commit()
+
+
+@app.cli.command('run-jobs')
+@click.option('--burst', is_flag=True,
+              help="Exit once no jobs are due, instead of polling.")
+def run_jobs_command(burst):
+    """Run queued background jobs (see jobs.py)."""
+
+    count = work(burst=burst)
+    click.echo(f"ran {count} jobs")
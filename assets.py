@@ -0,0 +1,155 @@
+"""Fingerprinted static assets.
+
+At startup every file under static/ is read and given a content-hashed
+name (stylesheets/style.css -> stylesheets/style.1a2b3c4d5e6f.css), served
+from /assets/ with a year-long `immutable` Cache-Control: a changed file
+gets a new URL, so browsers never need to revalidate the old one.
+
+Templates link assets with `static_url('stylesheets/style.css')`. url()
+references to /static/ inside CSS are rewritten to hashed URLs too, so a
+stylesheet's hash changes when an image it uses does.
+
+With ASSETS_PRECOMPRESS (the default), compressible files are also gzipped
+-- and brotli-compressed, if the brotli package is installed -- once at
+startup and served to clients that accept it.
+"""
+
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+
+from flask import Response, abort, request, url_for
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+ASSET_MAX_AGE = 365 * 24 * 60 * 60
+IMMUTABLE = f"public, max-age={ASSET_MAX_AGE}, immutable"
+
+COMPRESSIBLE = {'text/css', 'text/javascript', 'application/javascript',
+                'image/svg+xml', 'image/vnd.microsoft.icon', 'image/x-icon'}
+
+# Don't bother compressing tiny files.
+MIN_COMPRESS_SIZE = 256
+
+_CSS_URL = re.compile(r"""url\(\s*(["']?)/static/([^"')\s]+)\1\s*\)""")
+
+
+class Asset:
+    """One fingerprinted file, ready to serve."""
+
+    def __init__(self, body, mimetype):
+        self.body = body
+        self.mimetype = mimetype
+        self.encodings = {}
+
+    def compress(self):
+        if (self.mimetype not in COMPRESSIBLE
+                or len(self.body) < MIN_COMPRESS_SIZE):
+            return
+
+        self.encodings['gzip'] = gzip.compress(self.body, mtime=0)
+        if brotli is not None:
+            self.encodings['br'] = brotli.compress(self.body)
+
+
+class AssetManifest:
+    """Hashed names for the files in an app's static folder."""
+
+    def __init__(self, app=None):
+        self.urls = {}
+        self.assets = {}
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Fingerprint `app.static_folder` and serve it from /assets/."""
+
+        app.config.setdefault('ASSETS_PRECOMPRESS', True)
+
+        self.build(app.static_folder, app.config['ASSETS_PRECOMPRESS'])
+
+        app.add_url_rule('/assets/<path:filename>', 'asset', self.serve)
+        app.jinja_env.globals['static_url'] = self.static_url
+
+    def build(self, folder, precompress=True):
+        """Read and hash every file under `folder`."""
+
+        files = {}
+        for root, _, names in os.walk(folder):
+            for name in names:
+                path = os.path.join(root, name)
+                filename = os.path.relpath(path, folder).replace(os.sep, '/')
+                with open(path, 'rb') as f:
+                    files[filename] = f.read()
+
+        urls, assets = {}, {}
+
+        # Stylesheets last, so their url()s can point at hashed files.
+        for filename in sorted(files, key=lambda f: f.endswith('.css')):
+            body = files[filename]
+            if filename.endswith('.css'):
+                body = self._rewrite_css(body, urls)
+
+            hashed = self.hashed_name(filename, body)
+            mimetype = (mimetypes.guess_type(filename)[0]
+                        or 'application/octet-stream')
+
+            asset = Asset(body, mimetype)
+            if precompress:
+                asset.compress()
+
+            urls[filename] = hashed
+            assets[hashed] = asset
+
+        self.urls, self.assets = urls, assets
+
+    @staticmethod
+    def hashed_name(filename, body):
+        digest = hashlib.sha256(body).hexdigest()[:12]
+        stem, ext = os.path.splitext(filename)
+        return f"{stem}.{digest}{ext}"
+
+    @staticmethod
+    def _rewrite_css(body, urls):
+        def hashed(match):
+            quote, filename = match.groups()
+            if filename not in urls:
+                return match.group(0)
+            return f"url({quote}/assets/{urls[filename]}{quote})"
+
+        return _CSS_URL.sub(hashed, body.decode('utf-8')).encode('utf-8')
+
+    def static_url(self, filename):
+        """Hashed URL for static `filename`, or its plain /static/ URL."""
+
+        if filename in self.urls:
+            return url_for('asset', filename=self.urls[filename])
+        return url_for('static', filename=filename)
+
+    def serve(self, filename):
+        """View serving a fingerprinted asset, compressed if accepted."""
+
+        asset = self.assets.get(filename)
+        if asset is None:
+            abort(404)
+
+        body, encoding = asset.body, None
+        for name in ('br', 'gzip'):
+            if name in asset.encodings and name in request.accept_encodings:
+                body, encoding = asset.encodings[name], name
+                break
+
+        resp = Response(body, mimetype=asset.mimetype)
+        resp.headers['Cache-Control'] = IMMUTABLE
+        if asset.encodings:
+            resp.vary.add('Accept-Encoding')
+        if encoding:
+            resp.headers['Content-Encoding'] = encoding
+
+        return resp
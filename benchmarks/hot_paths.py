@@ -0,0 +1,351 @@
+"""Benchmark Warbler's hot paths end to end.
+
+Seeds a synthetic dataset (generator/generate.py + seed.py) into a scratch
+database, then times the homepage feed, a profile, user search, liking,
+posting and logging in through the Flask test client, reporting latency
+percentiles, throughput and SQL statements per request:
+
+    createdb warbler-bench
+    python benchmarks/hot_paths.py --users 20000 --output before.json
+    ... change things ...
+    python benchmarks/hot_paths.py --skip-seed --compare before.json
+
+--skip-seed reuses the dataset already in the database. With --http, the
+same requests are instead sent to a running server by --concurrency
+threads (throughput then reflects the server, not one process):
+
+    python benchmarks/hot_paths.py --skip-seed --http http://localhost:5000
+
+Results are written as JSON (--output) with the commit they were run at, so
+runs can be compared across commits.
+"""
+
+import argparse
+import http.cookiejar
+import json
+import os
+import platform
+import random
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'generator'))
+
+BENCH_PASSWORD = 'benchmark'
+SAMPLE_USERS = 50
+SEARCH_WORDS = ['bird', 'river', 'sun', 'garden', 'music', 'sea']
+
+_CSRF = re.compile(r'name="csrf_token"[^>]*value="([^"]+)"')
+
+
+def percentile(timings, p):
+    """`p`th percentile (0-100) of sorted `timings`."""
+
+    index = min(len(timings) - 1, int(len(timings) * p / 100))
+    return timings[index]
+
+
+def summarize(samples, elapsed):
+    """Stats for one endpoint from [(ms, status, query count or None)]."""
+
+    timings = sorted(ms for ms, _, _ in samples)
+    queries = [n for _, _, n in samples if n is not None]
+
+    return {
+        'requests': len(samples),
+        'errors': sum(1 for _, status, _ in samples if status >= 400),
+        'throughput_rps': round(len(samples) / elapsed, 1),
+        'mean_ms': round(statistics.mean(timings), 2),
+        'p50_ms': round(percentile(timings, 50), 2),
+        'p90_ms': round(percentile(timings, 90), 2),
+        'p99_ms': round(percentile(timings, 99), 2),
+        'max_ms': round(timings[-1], 2),
+        'mean_queries': (round(statistics.mean(queries), 1)
+                         if queries else None),
+        'max_queries': max(queries) if queries else None,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+                              cwd=ROOT, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+##############################################################################
+# Dataset
+
+
+def seed_dataset(args):
+    from generate import Generator
+    from seed import seed
+
+    generator = Generator(args.users, seed=args.seed)
+
+    with tempfile.TemporaryDirectory() as directory:
+        start = time.perf_counter()
+        generator.write_shard(directory)
+        print(f"generated {args.users:,} users "
+              f"in {time.perf_counter() - start:.1f}s")
+        seed(directory)
+
+
+def prepare_users(count, rand):
+    """Ids of `count` sample users, given the benchmark password."""
+
+    from models import db, User, passwords
+
+    max_id = db.session.query(db.func.max(User.id)).scalar()
+    if not max_id:
+        sys.exit("no users in the database; run without --skip-seed")
+
+    ids = sorted(rand.sample(range(1, max_id + 1), min(count, max_id)))
+    users = User.query.filter(User.id.in_(ids)).all()
+
+    hashed = passwords.hash(BENCH_PASSWORD)
+    for user in users:
+        user.password = hashed
+    db.session.commit()
+
+    return [(user.id, user.username) for user in users]
+
+
+def sample_message_ids(count, rand):
+    from models import db, Message
+
+    max_id = db.session.query(db.func.max(Message.id)).scalar() or 0
+    return [rand.randint(1, max_id) for _ in range(count)] if max_id else []
+
+
+##############################################################################
+# Scenarios
+#
+# Each scenario makes one request through a client with get(url) and
+# post(url, data) methods returning (status, query count or None).
+
+
+def scenarios(users, message_ids, rand):
+    def homepage(client, user):
+        return client.get('/')
+
+    def users_show(client, user):
+        return client.get(f'/users/{rand.choice(users)[0]}')
+
+    def list_users(client, user):
+        return client.get(f'/users?q={rand.choice(SEARCH_WORDS)}')
+
+    def toggle_likes(client, user):
+        return client.post('/toggle_like_status',
+                           {'message_id': rand.choice(message_ids),
+                            'return_url': '/'})
+
+    def messages_add(client, user):
+        return client.post('/messages/new',
+                           {'text': f"benchmark warble {rand.random()}"},
+                           csrf_from='/messages/new')
+
+    def login(client, user):
+        return client.post('/login', {'username': user[1],
+                                      'password': BENCH_PASSWORD},
+                           csrf_from='/login')
+
+    return [homepage, users_show, list_users, toggle_likes, messages_add,
+            login]
+
+
+class TestClientDriver:
+    """Runs scenarios in-process through Flask's test client."""
+
+    def __init__(self, app, user):
+        from app import CURR_USER_KEY
+
+        self.client = app.test_client()
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user[0]
+
+    @staticmethod
+    def _result(resp):
+        count = resp.headers.get('X-Query-Count')
+        return resp.status_code, int(count) if count else None
+
+    def get(self, url):
+        return self._result(self.client.get(url))
+
+    def post(self, url, data, csrf_from=None):
+        return self._result(self.client.post(url, data=data))
+
+
+class HTTPDriver:
+    """Runs scenarios against a live server, with its own cookie session."""
+
+    def __init__(self, base_url, user):
+        self.base_url = base_url.rstrip('/')
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+        self.csrf_token = None
+        self.post('/login', {'username': user[1],
+                             'password': BENCH_PASSWORD},
+                  csrf_from='/login')
+
+    def _open(self, url, data=None):
+        try:
+            resp = self.opener.open(self.base_url + url, data)
+        except urllib.error.HTTPError as error:
+            resp = error
+        body = resp.read().decode('utf-8', 'replace')
+        count = resp.headers.get('X-Query-Count')
+        return resp.status, int(count) if count else None, body
+
+    def get(self, url):
+        return self._open(url)[:2]
+
+    def post(self, url, data, csrf_from=None):
+        # CSRF tokens last for the session, so fetch one just once
+        if csrf_from and self.csrf_token is None:
+            match = _CSRF.search(self._open(csrf_from)[2])
+            self.csrf_token = match.group(1) if match else ''
+        if csrf_from:
+            data = dict(data, csrf_token=self.csrf_token)
+        return self._open(url, urllib.parse.urlencode(data).encode())[:2]
+
+
+def run(scenario, drivers, requests, concurrency):
+    """Time `requests` runs of `scenario` spread over `concurrency` threads."""
+
+    samples = []
+    lock = threading.Lock()
+
+    def worker(driver, user, n):
+        mine = []
+        for _ in range(n):
+            start = time.perf_counter()
+            status, queries = scenario(driver, user)
+            mine.append(((time.perf_counter() - start) * 1000,
+                         status, queries))
+        with lock:
+            samples.extend(mine)
+
+    share = [requests // concurrency + (i < requests % concurrency)
+             for i in range(concurrency)]
+    threads = [threading.Thread(target=worker,
+                                args=(*drivers[i % len(drivers)], share[i]))
+               for i in range(concurrency)]
+
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return summarize(samples, time.perf_counter() - start)
+
+
+##############################################################################
+# Reporting
+
+
+def print_results(results, baseline=None):
+    print(f"{'endpoint':<14}{'req/s':>9}{'p50 ms':>9}{'p90 ms':>9}"
+          f"{'p99 ms':>9}{'queries':>9}{'errors':>8}")
+
+    for name, r in results.items():
+        line = (f"{name:<14}{r['throughput_rps']:>9}{r['p50_ms']:>9}"
+                f"{r['p90_ms']:>9}{r['p99_ms']:>9}"
+                f"{r['mean_queries'] if r['mean_queries'] is not None else '-':>9}"
+                f"{r['errors']:>8}")
+
+        old = (baseline or {}).get(name)
+        if old:
+            change = (r['p50_ms'] - old['p50_ms']) / old['p50_ms'] * 100
+            line += f"   p50 {change:+.0f}% vs baseline"
+
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database', default='postgresql:///warbler-bench')
+    parser.add_argument('--users', type=int, default=5000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--skip-seed', action='store_true')
+    parser.add_argument('--requests', type=int, default=200,
+                        help="requests per endpoint")
+    parser.add_argument('--warmup', type=int, default=20)
+    parser.add_argument('--concurrency', type=int, default=1)
+    parser.add_argument('--http', metavar='URL',
+                        help="drive a running server instead of the test "
+                             "client")
+    parser.add_argument('--only', nargs='*', help="endpoints to run")
+    parser.add_argument('--output', help="write JSON results here")
+    parser.add_argument('--compare', help="JSON results to compare against")
+    args = parser.parse_args()
+
+    os.environ['DATABASE_URL'] = args.database
+    os.environ.setdefault('QUERY_STATS', '1')
+
+    from app import app
+
+    app.config['WTF_CSRF_ENABLED'] = False
+    app.config['DEBUG_TB_ENABLED'] = False
+    app.logger.setLevel('WARNING')
+
+    rand = random.Random(args.seed)
+
+    with app.app_context():
+        if not args.skip_seed:
+            seed_dataset(args)
+        users = prepare_users(SAMPLE_USERS, rand)
+        message_ids = sample_message_ids(args.requests * 2, rand)
+
+    if args.http:
+        drivers = [(HTTPDriver(args.http, user), user)
+                   for user in users[:args.concurrency]]
+    else:
+        drivers = [(TestClientDriver(app, user), user)
+                   for user in users[:args.concurrency]]
+
+    results = {}
+    for scenario in scenarios(users, message_ids, rand):
+        if args.only and scenario.__name__ not in args.only:
+            continue
+
+        run(scenario, drivers, args.warmup, args.concurrency)
+        results[scenario.__name__] = run(scenario, drivers, args.requests,
+                                         args.concurrency)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+
+    print_results(results, baseline)
+
+    if args.output:
+        report = {
+            'commit': git_commit(),
+            'timestamp': datetime.utcnow().isoformat(),
+            'python': platform.python_version(),
+            'options': {key: value for key, value in vars(args).items()
+                        if key not in ('output', 'compare')},
+            'results': results,
+        }
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
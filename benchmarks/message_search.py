@@ -0,0 +1,163 @@
+"""Benchmark message search query latency.
+
+By default builds the pure-Python InvertedMessageSearch over synthetic
+messages (no database needed) and times ranked first pages:
+
+    python benchmarks/message_search.py --messages 1000000
+
+With --postgres, times TsvectorMessageSearch against the messages already
+in DATABASE_URL instead (load them first, and run
+`flask create-search-indexes` so the GIN index exists). Queries are then
+drawn from the words of a random sample of the stored messages, so they
+match whatever dataset is loaded.
+
+Both modes report how many results each query's first page returned, so a
+fast run of queries that match nothing is easy to spot.
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+from collections import Counter, namedtuple
+from itertools import accumulate
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from search import (InvertedMessageSearch, TsvectorMessageSearch,  # noqa: E402
+                    tokenize)
+
+VOCABULARY_SIZE = 20000
+WORDS_PER_MESSAGE = 20
+SAMPLE_MESSAGES = 5000
+
+SyntheticMessage = namedtuple('SyntheticMessage', ['id', 'text'])
+
+
+def make_vocabulary(size):
+    return [f"w{i}" for i in range(size)]
+
+
+def stored_vocabulary(sample):
+    """Words of `sample` random stored messages, most frequent first."""
+
+    from models import db, Message
+
+    texts = (db.session
+             .query(Message.text)
+             .order_by(db.func.random())
+             .limit(sample))
+    counts = Counter(word for (text,) in texts for word in tokenize(text))
+
+    return [word for word, _ in counts.most_common()]
+
+
+def synthetic_messages(count, vocabulary, rng):
+    """Messages whose words follow a rough Zipf distribution, like text."""
+
+    cum_weights = list(accumulate(1 / rank
+                                  for rank in range(1, len(vocabulary) + 1)))
+
+    for id in range(1, count + 1):
+        words = rng.choices(vocabulary, cum_weights=cum_weights,
+                            k=WORDS_PER_MESSAGE)
+        yield SyntheticMessage(id, ' '.join(words))
+
+
+def sample_queries(vocabulary, count, rng):
+    """One- and two-word queries spread across common and rare words.
+
+    `vocabulary` is ordered most frequent first.
+    """
+
+    common = vocabulary[:2000]
+    queries = []
+    for _ in range(count):
+        words = rng.sample(common, min(len(common), rng.choice([1, 2])))
+        queries.append(' '.join(words))
+    return queries
+
+
+def time_queries(run, queries):
+    """(timings in ms, first-page hit counts) of `run` over `queries`."""
+
+    timings, hits = [], []
+    for query in queries:
+        start = time.perf_counter()
+        found = run(query)
+        timings.append((time.perf_counter() - start) * 1000)
+        hits.append(len(found))
+    return timings, hits
+
+
+def report(label, results):
+    timings, hits = results
+    timings.sort()
+    pick = lambda p: timings[min(len(timings) - 1, int(len(timings) * p))]
+
+    print(f"{label}: {len(timings)} queries, "
+          f"mean {statistics.mean(timings):.2f}ms, "
+          f"p50 {pick(0.50):.2f}ms, p95 {pick(0.95):.2f}ms, "
+          f"p99 {pick(0.99):.2f}ms, max {timings[-1]:.2f}ms")
+    print(f"  hits per query (first page): "
+          f"mean {statistics.mean(hits):.1f}, "
+          f"median {statistics.median(hits):g}, "
+          f"none for {hits.count(0)} of {len(hits)}")
+
+
+def bench_inverted(args, vocabulary, queries, rng):
+    search = InvertedMessageSearch()
+
+    start = time.perf_counter()
+    search.build(synthetic_messages(args.messages, vocabulary, rng))
+    print(f"indexed {args.messages} messages "
+          f"in {time.perf_counter() - start:.1f}s")
+
+    report("inverted index",
+           time_queries(
+               lambda q: search.ranked_page(q, per_page=args.per_page)[0],
+               queries))
+
+
+def bench_postgres(args, rng):
+    from app import app
+    from models import Message
+
+    search = TsvectorMessageSearch()
+
+    with app.app_context():
+        vocabulary = stored_vocabulary(SAMPLE_MESSAGES)
+        if not vocabulary:
+            sys.exit("no messages in DATABASE_URL to search")
+        queries = sample_queries(vocabulary, args.queries, rng)
+
+        print(f"searching {Message.query.count()} messages in Postgres")
+        report("tsvector",
+               time_queries(lambda q: search.search(q, per_page=args.per_page),
+                            queries))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--messages', type=int, default=1000000)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--per-page', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--postgres', action='store_true',
+                        help="query DATABASE_URL with tsvector search")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+
+    if args.postgres:
+        bench_postgres(args, rng)
+    else:
+        vocabulary = make_vocabulary(VOCABULARY_SIZE)
+        queries = sample_queries(vocabulary, args.queries, rng)
+        bench_inverted(args, vocabulary, queries, rng)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,237 @@
+"""Streaming bulk import of Warbler CSVs.
+
+CSV rows are read and written a chunk at a time, so memory use doesn't grow
+with the file. On PostgreSQL each chunk goes in with `COPY ... FROM STDIN`;
+elsewhere (SQLite) with one executemany INSERT per chunk. While loading,
+secondary indexes -- and on PostgreSQL, foreign keys -- are dropped, then
+rebuilt once at the end, which is far cheaper than maintaining them row by
+row. Afterwards id sequences are moved past the loaded ids, and the tables
+are ANALYZEd.
+
+Columns missing from a CSV get their model default (e.g. a user's
+time_zone) if they have a constant one, else the database's.
+
+Used by seed.py:
+
+    python seed.py --dir generator --chunk-size 50000
+"""
+
+import csv
+import io
+import os
+import time
+from datetime import datetime
+from glob import glob
+
+from models import db, User, Message, FollowersFollowee, Like
+
+DEFAULT_CHUNK_SIZE = 50000
+
+# Load order respects foreign keys (users first). Each table is loaded from
+# <name>.csv, or from sharded <name>.<shard>.csv files (generator/generate.py).
+TABLES = [
+    ('users', User),
+    ('messages', Message),
+    ('follows', FollowersFollowee),
+    ('likes', Like),
+]
+
+
+def _parse_bool(value):
+    return value.strip().lower() in ('1', 't', 'true', 'y', 'yes')
+
+
+def _converter(column):
+    """Turn a CSV string into a value for `column` (executemany path)."""
+
+    python_type = column.type.python_type
+
+    if python_type is datetime:
+        return datetime.fromisoformat
+    if python_type is bool:
+        return _parse_bool
+    if python_type is int:
+        return int
+    return str
+
+
+def _chunks(rows, size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class BulkLoader:
+    """Loads CSVs into tables over one connection, reporting progress."""
+
+    def __init__(self, connection, chunk_size=DEFAULT_CHUNK_SIZE,
+                 report=print):
+        self.connection = connection
+        self.chunk_size = chunk_size
+        self.report = report
+        self.postgres = connection.dialect.name == 'postgresql'
+
+    def load(self, table, lines):
+        """Stream CSV `lines` (with a header row) into `table`.
+
+        Returns the number of rows loaded.
+        """
+
+        reader = csv.reader(lines)
+        header = next(reader)
+
+        # constant model defaults for columns the CSV leaves out
+        fill = {column.name: column.default.arg
+                for column in table.columns
+                if column.name not in header
+                and column.default is not None
+                and column.default.is_scalar
+                and column.server_default is None}
+        columns = header + list(fill)
+        extra = list(fill.values())
+
+        start = time.perf_counter()
+        total = 0
+
+        for chunk in _chunks(reader, self.chunk_size):
+            if self.postgres:
+                self._copy(table, columns, chunk, extra)
+            else:
+                self._insert(table, columns, chunk, extra)
+
+            total += len(chunk)
+            elapsed = time.perf_counter() - start
+            self.report(f"{table.name}: {total:,} rows, "
+                        f"{total / elapsed:,.0f} rows/sec")
+
+        return total
+
+    def _copy(self, table, columns, chunk, extra):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for row in chunk:
+            writer.writerow(row + extra)
+        buffer.seek(0)
+
+        cursor = self.connection.connection.cursor()
+        cursor.copy_expert(
+            f"COPY {table.name} ({', '.join(columns)}) "
+            "FROM STDIN WITH (FORMAT csv)", buffer)
+
+    def _insert(self, table, columns, chunk, extra):
+        # the filled-in defaults are already Python values
+        header = columns[:len(columns) - len(extra)]
+        convert = [_converter(table.columns[name]) for name in header]
+
+        rows = []
+        for row in chunk:
+            values = [fn(value) if value != '' else None
+                      for fn, value in zip(convert, row)]
+            rows.append(dict(zip(columns, values + extra)))
+
+        self.connection.execute(table.insert(), rows)
+
+    def defer_indexes(self, tables):
+        """Drop secondary indexes (and PostgreSQL foreign keys).
+
+        Returns a function that rebuilds them.
+        """
+
+        indexes = [index for table in tables for index in table.indexes]
+        foreign_keys = []
+
+        if self.postgres:
+            for table in tables:
+                foreign_keys.extend(
+                    (table.name, name, definition)
+                    for name, definition in self.connection.execute(
+                        "SELECT conname, pg_get_constraintdef(oid) "
+                        "FROM pg_constraint "
+                        "WHERE conrelid = %s::regclass AND contype = 'f'",
+                        table.name))
+
+        for table_name, name, _ in foreign_keys:
+            self.connection.execute(
+                f"ALTER TABLE {table_name} DROP CONSTRAINT {name}")
+        for index in indexes:
+            index.drop(self.connection)
+
+        def restore():
+            for index in indexes:
+                start = time.perf_counter()
+                index.create(self.connection)
+                self.report(f"created {index.name} "
+                            f"in {time.perf_counter() - start:.1f}s")
+            for table_name, name, definition in foreign_keys:
+                start = time.perf_counter()
+                self.connection.execute(
+                    f"ALTER TABLE {table_name} "
+                    f"ADD CONSTRAINT {name} {definition}")
+                self.report(f"added {name} "
+                            f"in {time.perf_counter() - start:.1f}s")
+
+        return restore
+
+    def reset_sequences(self, tables):
+        """Move PostgreSQL id sequences past the highest loaded ids."""
+
+        if not self.postgres:
+            return
+
+        for table in tables:
+            if 'id' not in table.columns:
+                continue
+
+            # a no-op (setval(NULL)) for tables without a serial id
+            self.connection.execute(
+                f"SELECT setval(pg_get_serial_sequence('{table.name}', 'id'), "
+                f"coalesce(max(id), 1), max(id) IS NOT NULL) "
+                f"FROM {table.name}")
+
+    def analyze(self, tables):
+        if self.postgres:
+            for table in tables:
+                self.connection.execute(f"ANALYZE {table.name}")
+
+
+def load_all(directory, chunk_size=DEFAULT_CHUNK_SIZE, report=print):
+    """Load every Warbler CSV present in `directory` into empty tables.
+
+    Runs on the session's connection; the caller commits.
+    """
+
+    connection = db.session.connection()
+    loader = BulkLoader(connection, chunk_size, report)
+
+    present = []
+    for name, model in TABLES:
+        paths = sorted(glob(os.path.join(directory, f"{name}.csv"))
+                       + glob(os.path.join(directory, f"{name}.*.csv")))
+        if not paths:
+            report(f"{name}.csv: not found, skipping")
+        present.extend((path, model.__table__) for path in paths)
+
+    tables = list({table: None for _, table in present})
+    restore = loader.defer_indexes(tables)
+
+    start = time.perf_counter()
+    total = 0
+
+    for path, table in present:
+        with open(path, newline='') as lines:
+            total += loader.load(table, lines)
+
+    restore()
+    loader.reset_sequences(tables)
+    loader.analyze(tables)
+
+    elapsed = time.perf_counter() - start
+    report(f"loaded {total:,} rows in {elapsed:.1f}s "
+           f"({total / elapsed:,.0f} rows/sec)")
+
+    return total
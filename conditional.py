@@ -0,0 +1,61 @@
+"""Conditional GET for pages versioned by the users they show.
+
+A profile, follower list or message page only changes when one of a few
+users changes: their profile (`updated_at`) or their messages, follows and
+likes (`changed_at`, bumped by adjust_counters). So a view can build an
+ETag and Last-Modified from those timestamps -- one or two indexed reads --
+and answer a matching If-None-Match / If-Modified-Since with a 304 before
+running the page's queries or template.
+
+ETAG_VERSION (e.g. the deployed release) is mixed into every ETag so that
+template changes invalidate clients' copies.
+"""
+
+from datetime import timezone
+from hashlib import sha1
+
+from flask import current_app, request, session
+
+
+def version_tag(parts):
+    """ETag value for a page built from `parts`."""
+
+    parts = (current_app.config['ETAG_VERSION'], *parts)
+    return sha1(repr(parts).encode('utf-8')).hexdigest()[:20]
+
+
+def conditional(render, users, extra=(), timestamps=()):
+    """Response for `render()`, or a 304 if the client's copy is current.
+
+    `users` are the users (None for nobody) whose `updated_at` and
+    `changed_at` determine the page; `timestamps` are any other change
+    times it depends on, and `extra` anything else identifying its content.
+    """
+
+    users = [user for user in users if user]
+    stamps = [stamp
+              for user in users
+              for stamp in (user.updated_at, user.changed_at)]
+    stamps.extend(stamp for stamp in timestamps if stamp is not None)
+
+    etag = version_tag([user.id for user in users] + stamps + list(extra))
+    last_modified = max(stamps).replace(tzinfo=timezone.utc, microsecond=0)
+
+    # A pending flash message will show on this page only once.
+    if session.get('_flashes'):
+        return render()
+
+    if request.if_none_match:
+        fresh = request.if_none_match.contains(etag)
+    else:
+        fresh = (request.if_modified_since is not None
+                 and last_modified <= request.if_modified_since)
+
+    if fresh:
+        resp = current_app.response_class(status=304)
+    else:
+        resp = current_app.make_response(render())
+
+    resp.set_etag(etag)
+    resp.last_modified = last_modified
+    return resp
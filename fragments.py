@@ -0,0 +1,73 @@
+"""Cache of rendered feed-message HTML.
+
+Most of a feed `<li>` (author avatar and name, message text) is the same
+for every viewer, so it's rendered once from messages/item.html and reused.
+The viewer-specific parts -- local time and the like button -- are left as
+placeholders and filled in per request by `render()`.
+
+Entries are keyed by message id plus the author's `updated_at`, so a
+profile edit moves every one of the author's messages to a fresh key; the
+old entries just age out of the LRU.
+"""
+
+from flask import render_template
+from markupsafe import Markup, escape
+
+from cache import LRUCache
+
+TIME_SLOT = '<!--time-->'
+LIKE_SLOT = '<!--like-->'
+
+
+class FragmentCache:
+    """Rendered message fragments in an in-process LRU, optionally backed by
+    a shared cache.
+
+    `shared` is anything with get(key), set(key, value) and delete(key)
+    (e.g. a thin wrapper around a memcached or Redis client), so workers
+    can reuse each other's renders. The local LRU is always checked first.
+    """
+
+    def __init__(self, local=None, shared=None):
+        self.local = local if local is not None else LRUCache(maxsize=10000)
+        self.shared = shared
+
+    @staticmethod
+    def key(msg):
+        return f"message:{msg.id}:{msg.user.updated_at.isoformat()}"
+
+    def fragment(self, msg):
+        """Viewer-independent HTML for `msg`, rendering it on a miss."""
+
+        key = self.key(msg)
+        html = self.local.get(key)
+
+        if html is None and self.shared is not None:
+            html = self.shared.get(key)
+            if html is not None:
+                self.local.set(key, html)
+
+        if html is None:
+            html = render_template('messages/item.html', msg=msg,
+                                   time_slot=Markup(TIME_SLOT),
+                                   like_slot=Markup(LIKE_SLOT))
+            self.local.set(key, html)
+            if self.shared is not None:
+                self.shared.set(key, html)
+
+        return html
+
+    def render(self, msg, time, like_form=''):
+        """Full `<li>` for `msg` with this viewer's time and like button."""
+
+        return Markup(self.fragment(msg)
+                      .replace(TIME_SLOT, str(escape(time)))
+                      .replace(LIKE_SLOT, str(like_form)))
+
+    def invalidate(self, msg):
+        """Forget the cached HTML for `msg` (e.g. once it's deleted)."""
+
+        key = self.key(msg)
+        self.local.delete(key)
+        if self.shared is not None:
+            self.shared.delete(key)
@@ -0,0 +1,335 @@
+"""Generate large synthetic Warbler datasets for load testing.
+
+Unlike create_csvs.py this streams rows straight to disk (nothing quadratic,
+nothing held in memory per user beyond a small set), never touches the
+network, and is deterministic: the same --seed gives the same files, however
+the work is sharded.
+
+    python generator/generate.py --users 1000000 --out data/
+    python generator/generate.py --users 10000000 --shards 16 --processes 8
+    python generator/generate.py --users 10000000 --shards 16 --shard 3
+
+Follows have a power-law (Pareto) out-degree, and targets are drawn from a
+Zipf-like popularity distribution, so a few users have huge follower counts
+and most have few -- like a real social graph. Message counts per user and
+liked messages are skewed the same way.
+
+Every row carries explicit ids, so shards can be generated independently
+(on separate machines, even) and loaded together:
+
+    python seed.py --dir data/
+
+With more than one shard, files are named users.<shard>.csv and so on.
+"""
+
+import argparse
+import csv
+import math
+import os
+import random
+from datetime import datetime, timedelta
+from multiprocessing import Pool
+
+MAX_WARBLER_LENGTH = 140
+
+# Caps on one user's follows / likes / messages, and on how many random
+# draws are spent finding that many distinct popular targets (with a steep
+# popularity curve, the last few distinct ones can take a while).
+MAX_FOLLOWS = 5000
+MAX_LIKES = 5000
+MAX_MESSAGES = 10000
+MAX_DRAWS = 20
+
+# The bcrypt hash create_csvs.py gives every sample user.
+PASSWORD_HASH = '$2b$12$Q1PUFjhN/AWRQ21LbGYvjeLpZZB6lfZ1BPwifHALGO6oIbyC3CmJe'
+
+WORDS = """
+    able about above across act add after again against age ago air all
+    almost alone along already also always among and animal another answer
+    any appear area arm around art ask away baby back bad bag ball bank bar
+    base beat beautiful bed before begin behind believe best better between
+    big bird black blue board boat body book both box boy bring brother build
+    call camera capital car card care carry case cat catch cause center chair
+    chance change city class clear close cloud coast cold color come common
+    country course cover create cup cut dark day deal deep dinner dog door
+    down draw dream drive drop early earth east easy eat edge egg end enjoy
+    enough even evening event ever every eye face fact fall family far farm
+    fast father feel field fight fill film find fine fire first fish five
+    floor flower fly follow food foot forest forget form four free friend
+    front fruit full fun game garden girl give glass go gold good great green
+    ground group grow guess hair half hand happy hard head hear heart heavy
+    help here high hill history hold home hope horse hot hour house idea
+    island job join jump just keep key kid kind king know lake land large
+    last late laugh learn leave left letter life light line list listen
+    little live long look love low machine main make man many map market
+    matter may meet memory middle might mile milk mind minute miss moment
+    money month moon morning mother mountain move music name nature near need
+    never new news next nice night north note nothing now number ocean off
+    offer often old open order other outside page paint paper park party pass
+    past people perhaps person picture piece place plan plant play point poor
+    possible power present pretty problem pull push question quick quiet rain
+    reach read ready real red remember rest rich ride right river road rock
+    room round run sail same sand save say school sea season seat second see
+    sell send sense serve set seven shape share ship shoe short show side sign
+    simple sing sister sit six size sky sleep slow small smile snow soft song
+    soon sound south space speak special spring square stand star start stay
+    step still stone stop store story street strong study summer sun sure
+    table take talk tall teach team tell ten test thing think three time today
+    together town tree trip true try turn two under until up use valley very
+    visit voice wait walk wall want warm watch water wave way weather week
+    well west wheel white whole wide wild win wind window winter wish wonder
+    wood word work world write yard year yellow young
+""".split()
+
+LOCATIONS = """
+    Oakland Berkeley Portland Seattle Denver Austin Boston Chicago Atlanta
+    Phoenix Miami Detroit Houston Dallas Memphis Nashville Omaha Tucson
+    Fresno Sacramento Raleigh Richmond Madison Boise Spokane Tampa Albany
+    Anchorage Honolulu Buffalo
+""".split()
+
+IMAGE_URLS = [
+    f"https://randomuser.me/api/portraits/{kind}/{i}.jpg"
+    for kind, count in [("lego", 10), ("men", 100), ("women", 100)]
+    for i in range(count)
+]
+
+USERS_HEADERS = ['id', 'email', 'username', 'image_url', 'password', 'bio',
+                 'header_image_url', 'location']
+MESSAGES_HEADERS = ['id', 'text', 'timestamp', 'user_id']
+FOLLOWS_HEADERS = ['followee_id', 'follower_id']
+LIKES_HEADERS = ['user_id', 'message_id']
+
+# Independent random streams, so e.g. changing the number of likes doesn't
+# change which messages are generated.
+USERS, MESSAGE_COUNTS, MESSAGES, FOLLOWS, LIKES = range(5)
+
+
+def rng(seed, stream, user_id):
+    """Random generator for one user's rows of one kind."""
+
+    return random.Random((seed * 16 + stream) << 40 | user_id)
+
+
+def zipf_rank(rand, n, exponent):
+    """Random rank in 1..n, where rank r has weight about r**-exponent.
+
+    Inverse-CDF sampling of a bounded power law: O(1) time and memory.
+    """
+
+    u = rand.random()
+    if exponent == 1:
+        rank = n ** u
+    else:
+        a = 1 - exponent
+        rank = ((n ** a - 1) * u + 1) ** (1 / a)
+    return min(n, int(rank))
+
+
+def scatter(rank, n):
+    """Map rank 1..n onto ids 1..n so popular ids aren't all small ones."""
+
+    # 2654435761 is prime, hence coprime to n unless n is a multiple of it.
+    step = 2654435761 if n % 2654435761 else 1
+    return (rank - 1) * step % n + 1
+
+
+def skewed_count(rand, mean, limit, shape=1.5):
+    """Pareto-distributed count with roughly the given mean, capped."""
+
+    if mean <= 0:
+        return 0
+    scale = mean * (shape - 1) / shape
+    return min(limit, int(scale * rand.paretovariate(shape)))
+
+
+class Generator:
+    """Deterministic dataset of `users` users, generated one user at a time."""
+
+    def __init__(self, users, messages_per_user=20, follows_per_user=50,
+                 likes_per_user=30, popularity_exponent=1.1, seed=0,
+                 end=datetime(2019, 1, 1), days=365):
+        self.users = users
+        self.messages_per_user = messages_per_user
+        self.follows_per_user = follows_per_user
+        self.likes_per_user = likes_per_user
+        self.popularity_exponent = popularity_exponent
+        self.seed = seed
+        self.end = end
+        self.span = days * 24 * 60 * 60
+
+    def message_count(self, user_id):
+        rand = rng(self.seed, MESSAGE_COUNTS, user_id)
+        return skewed_count(rand, self.messages_per_user, MAX_MESSAGES)
+
+    def first_message_ids(self, start):
+        """(id of user `start`'s first message, total number of messages).
+
+        Message ids are handed out in user order; one cheap pass over the
+        per-user counts lets any shard find its offset on its own.
+        """
+
+        before = total = 0
+        for user_id in range(1, self.users + 1):
+            if user_id == start:
+                before = total
+            total += self.message_count(user_id)
+        return before + 1, total
+
+    def user(self, user_id):
+        rand = rng(self.seed, USERS, user_id)
+        username = f"{rand.choice(WORDS)}{rand.choice(WORDS)}{user_id}"
+
+        return [user_id,
+                f"{username}@example.com",
+                username,
+                rand.choice(IMAGE_URLS),
+                PASSWORD_HASH,
+                self.sentence(rand, 8).capitalize() + '.',
+                '/static/images/warbler-hero.jpg',
+                rand.choice(LOCATIONS)]
+
+    def messages(self, user_id, first_id):
+        rand = rng(self.seed, MESSAGES, user_id)
+
+        for i in range(self.message_count(user_id)):
+            seconds = rand.uniform(0, self.span)
+            timestamp = self.end - timedelta(seconds=seconds)
+            text = self.sentence(rand, rand.randint(3, 25))
+            yield [first_id + i, text[:MAX_WARBLER_LENGTH].capitalize(),
+                   timestamp.isoformat(sep=' '), user_id]
+
+    def follows(self, user_id):
+        """Users `user_id` follows, as (followee_id, follower_id) rows."""
+
+        rand = rng(self.seed, FOLLOWS, user_id)
+        wanted = skewed_count(rand, self.follows_per_user,
+                              min(self.users - 1, MAX_FOLLOWS))
+
+        followed = set()
+        for _ in range(wanted * MAX_DRAWS):
+            if len(followed) == wanted:
+                break
+            target = scatter(zipf_rank(rand, self.users,
+                                       self.popularity_exponent),
+                             self.users)
+            if target != user_id:
+                followed.add(target)
+
+        for target in sorted(followed):
+            yield [user_id, target]
+
+    def likes(self, user_id, total_messages):
+        if not total_messages:
+            return
+
+        rand = rng(self.seed, LIKES, user_id)
+        wanted = skewed_count(rand, self.likes_per_user,
+                              min(total_messages, MAX_LIKES))
+
+        liked = set()
+        for _ in range(wanted * MAX_DRAWS):
+            if len(liked) == wanted:
+                break
+            liked.add(scatter(zipf_rank(rand, total_messages,
+                                        self.popularity_exponent),
+                              total_messages))
+
+        for message_id in sorted(liked):
+            yield [user_id, message_id]
+
+    @staticmethod
+    def sentence(rand, words):
+        return ' '.join(rand.choice(WORDS) for _ in range(words))
+
+    def shard_range(self, shard, shards):
+        """User ids [start, stop) belonging to `shard` of `shards`."""
+
+        size = math.ceil(self.users / shards)
+        start = shard * size + 1
+        return start, min(self.users + 1, start + size)
+
+    def write_shard(self, out, shard=0, shards=1):
+        """Write one shard's CSVs to directory `out`; returns row counts."""
+
+        start, stop = self.shard_range(shard, shards)
+        next_message_id, total_messages = self.first_message_ids(start)
+        suffix = f".{shard:03d}" if shards > 1 else ''
+
+        os.makedirs(out, exist_ok=True)
+        files = {name: open(os.path.join(out, f"{name}{suffix}.csv"), 'w',
+                            newline='')
+                 for name in ('users', 'messages', 'follows', 'likes')}
+        counts = dict.fromkeys(files, 0)
+
+        try:
+            writers = {name: csv.writer(f) for name, f in files.items()}
+            writers['users'].writerow(USERS_HEADERS)
+            writers['messages'].writerow(MESSAGES_HEADERS)
+            writers['follows'].writerow(FOLLOWS_HEADERS)
+            writers['likes'].writerow(LIKES_HEADERS)
+
+            for user_id in range(start, stop):
+                rows = {
+                    'users': [self.user(user_id)],
+                    'messages': self.messages(user_id, next_message_id),
+                    'follows': self.follows(user_id),
+                    'likes': self.likes(user_id, total_messages),
+                }
+                for name, user_rows in rows.items():
+                    for row in user_rows:
+                        writers[name].writerow(row)
+                        counts[name] += 1
+
+                next_message_id += self.message_count(user_id)
+        finally:
+            for f in files.values():
+                f.close()
+
+        return counts
+
+
+def _write_shard(args):
+    generator, out, shard, shards = args
+    counts = generator.write_shard(out, shard, shards)
+    print(f"shard {shard}: " + ', '.join(f"{n:,} {name}"
+                                         for name, n in counts.items()))
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--messages-per-user', type=float, default=20)
+    parser.add_argument('--follows-per-user', type=float, default=50)
+    parser.add_argument('--likes-per-user', type=float, default=30)
+    parser.add_argument('--popularity-exponent', type=float, default=1.1,
+                        help="Zipf exponent for who gets followed / liked")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', default='generator/data')
+    parser.add_argument('--shards', type=int, default=1)
+    parser.add_argument('--shard', type=int,
+                        help="only write this shard (default: all of them)")
+    parser.add_argument('--processes', type=int, default=1)
+    args = parser.parse_args()
+
+    generator = Generator(args.users,
+                          messages_per_user=args.messages_per_user,
+                          follows_per_user=args.follows_per_user,
+                          likes_per_user=args.likes_per_user,
+                          popularity_exponent=args.popularity_exponent,
+                          seed=args.seed)
+
+    shards = [args.shard] if args.shard is not None else range(args.shards)
+    jobs = [(generator, args.out, shard, args.shards) for shard in shards]
+
+    if args.processes > 1 and len(jobs) > 1:
+        with Pool(args.processes) as pool:
+            pool.map(_write_shard, jobs)
+    else:
+        for job in jobs:
+            _write_shard(job)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,255 @@
+"""Background jobs, queued in the database.
+
+Views queue slow side effects with `enqueue(kind, **payload)` in their own
+transaction, so a job exists exactly when the change that needs it was
+committed. A worker process then runs them:
+
+    flask run-jobs
+
+Each job runs in one transaction, together with deleting its row, so it
+either happens completely or not at all. Jobs are claimed with SELECT ...
+FOR UPDATE SKIP LOCKED, so several workers can share the queue, and a
+worker that dies simply releases its job. A job that raises is retried
+with exponential backoff (JOB_BACKOFF seconds, doubling) and marked
+'failed', with its last error, after JOB_MAX_ATTEMPTS tries.
+
+Handlers do a bounded amount of work per run -- JOB_BATCH_SIZE rows -- and
+queue a follow-up job for the rest, so no one transaction holds locks on
+a huge account's rows for long.
+"""
+
+import random
+import time
+import traceback
+from datetime import datetime, timedelta
+
+from flask import current_app
+
+from models import (db, Job, User, Message, FollowersFollowee, Like, Timeline,
+                    Suggestion, retract_counters)
+import trending
+
+BATCH_SIZE = 1000
+MAX_ATTEMPTS = 5
+BACKOFF = 10
+MAX_BACKOFF = 3600
+POLL_INTERVAL = 1.0
+
+HANDLERS = {}
+
+
+def handler(kind):
+    """Register the decorated function to run jobs of `kind`."""
+
+    def register(fn):
+        HANDLERS[kind] = fn
+        return fn
+
+    return register
+
+
+def enqueue(kind, delay=0, **payload):
+    """Queue a job in the current transaction; the caller commits."""
+
+    if kind not in HANDLERS:
+        raise ValueError(f"no handler for {kind!r} jobs")
+
+    job = Job(kind=kind,
+              payload=payload,
+              run_at=datetime.utcnow() + timedelta(seconds=delay))
+    db.session.add(job)
+    return job
+
+
+def batch_size():
+    return current_app.config.get('JOB_BATCH_SIZE', BATCH_SIZE)
+
+
+def backoff(attempts):
+    """Seconds to wait before retrying a job that has failed `attempts` times."""
+
+    base = current_app.config.get('JOB_BACKOFF', BACKOFF)
+    delay = min(MAX_BACKOFF, base * 2 ** (attempts - 1))
+    # jitter, so jobs that failed together don't all retry together
+    return delay * random.uniform(0.5, 1)
+
+
+def run_next():
+    """Claim and run the next due job. Returns the job, or None if idle."""
+
+    job = (Job
+           .query
+           .filter(Job.status == 'queued', Job.run_at <= datetime.utcnow())
+           .order_by(Job.run_at, Job.id)
+           .with_for_update(skip_locked=True)
+           .first())
+
+    if job is None:
+        db.session.rollback()
+        return None
+
+    job_id, kind, payload = job.id, job.kind, dict(job.payload)
+
+    try:
+        HANDLERS[kind](**payload)
+        db.session.delete(job)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        record_failure(job_id, traceback.format_exc())
+
+    return job
+
+
+def record_failure(job_id, error):
+    """Schedule a retry of a job that raised, or give up on it."""
+
+    job = Job.query.get(job_id)
+    job.attempts += 1
+    job.last_error = error
+
+    if job.attempts >= current_app.config.get('JOB_MAX_ATTEMPTS',
+                                              MAX_ATTEMPTS):
+        job.status = 'failed'
+        current_app.logger.error("job %s failed for good: %s", job, error)
+    else:
+        job.run_at = datetime.utcnow() + timedelta(
+            seconds=backoff(job.attempts))
+        current_app.logger.warning("job %s failed, will retry: %s",
+                                   job, error)
+
+    db.session.commit()
+
+
+def work(burst=False, poll_interval=POLL_INTERVAL):
+    """Run jobs as they come due. With `burst`, stop once none are due.
+
+    Returns the number of jobs run.
+    """
+
+    count = 0
+
+    while True:
+        if run_next() is not None:
+            count += 1
+        elif burst:
+            return count
+        else:
+            time.sleep(poll_interval)
+
+
+##############################################################################
+# Handlers
+
+
+@handler('fan_out')
+def fan_out(message_id, after=0):
+    """Put a new message on its followers' timelines, a batch at a time."""
+
+    message = Message.query.get(message_id)
+
+    # deleted before it was fanned out
+    if message is None:
+        return
+
+    last = Timeline.fan_out(message, after=after, limit=batch_size())
+
+    if last is not None:
+        enqueue('fan_out', message_id=message_id, after=last)
+
+
+@handler('suggest')
+def suggest(user_id, followed_id, change):
+    """Recompute one user's "who to follow" after they (un)followed
+    `followed_id` (`change` 1 or -1).
+
+    Their followers' friends of friends changed too; those are adjusted by
+    a follow-up job, a batch at a time.
+    """
+
+    Suggestion.refresh(user_id)
+    enqueue('suggest_followers', user_id=user_id, followed_id=followed_id,
+            change=change)
+
+
+@handler('suggest_followers')
+def suggest_followers(user_id, followed_id, change, after=0):
+    """Adjust "who to follow" for a batch of `user_id`'s followers."""
+
+    last = Suggestion.adjust_followers(user_id, followed_id, change,
+                                       after=after, limit=batch_size())
+
+    if last is not None:
+        enqueue('suggest_followers', user_id=user_id, followed_id=followed_id,
+                change=change, after=last)
+
+
+@handler('refresh_trending')
+def refresh_trending():
+    """Recompute the trending pages' rankings."""
+
+    trending.refresh()
+
+
+def _delete_batch(model, criterion, key, limit):
+    """Delete up to `limit` rows of `model` matching `criterion`.
+
+    `key` is a column, or tuple of columns, that with `criterion`
+    identifies single rows. Returns the number deleted.
+    """
+
+    keys = key if isinstance(key, tuple) else (key,)
+
+    batch = (db.session
+             .query(*keys)
+             .filter(criterion)
+             .limit(limit)
+             .subquery())
+
+    return (model
+            .query
+            .filter(criterion, db.tuple_(*keys).in_(db.select([batch])))
+            .delete(synchronize_session=False))
+
+
+@handler('delete_account')
+def delete_account(user_id, retracted=False):
+    """Remove a deleted account's rows, a batch at a time, then the user.
+
+    Counters on other rows are corrected first, once. The account's
+    messages come off followers' timelines in batches of their own before
+    the messages go, so deleting a batch of messages only cascades to
+    their likes, not to every timeline they were fanned out to.
+    """
+
+    user = User.query.get(user_id)
+
+    if user is None:
+        return
+
+    if not retracted:
+        retract_counters(user_id)
+        enqueue('delete_account', user_id=user_id, retracted=True)
+        return
+
+    limit = batch_size()
+    batches = [
+        (Timeline, Timeline.user_id == user_id, Timeline.message_id),
+        (Timeline, Timeline.author_id == user_id,
+         (Timeline.user_id, Timeline.message_id)),
+        (Like, Like.user_id == user_id, Like.message_id),
+        (FollowersFollowee, FollowersFollowee.followee_id == user_id,
+         FollowersFollowee.follower_id),
+        (FollowersFollowee, FollowersFollowee.follower_id == user_id,
+         FollowersFollowee.followee_id),
+        (Suggestion, Suggestion.suggested_id == user_id, Suggestion.user_id),
+        (Suggestion, Suggestion.user_id == user_id, Suggestion.suggested_id),
+        (Message, Message.user_id == user_id, Message.id),
+    ]
+
+    for model, criterion, key in batches:
+        if _delete_batch(model, criterion, key, limit):
+            enqueue('delete_account', user_id=user_id, retracted=True)
+            return
+
+    User.query.filter(User.id == user_id).delete()
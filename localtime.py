@@ -0,0 +1,46 @@
+"""Show pages of UTC message timestamps in a viewer's time zone."""
+
+from datetime import datetime
+from functools import lru_cache
+
+import pytz
+
+TIMESTAMP_FORMAT = '%d %B %Y %I:%M %p'
+
+
+@lru_cache(maxsize=64)
+def get_zone(name):
+    """Return (tzinfo, fixed utc offset or None) for a time zone name.
+
+    Unknown names fall back to UTC. Zones without DST (all the Etc/GMT±N
+    choices in EditProfileForm) have a fixed offset, so converting to them
+    is a single addition.
+    """
+
+    try:
+        tz = pytz.timezone(name)
+    except pytz.UnknownTimeZoneError:
+        tz = pytz.UTC
+
+    if tz is pytz.UTC or isinstance(tz, pytz.tzinfo.StaticTzInfo):
+        return tz, tz.utcoffset(datetime.utcnow())
+
+    return tz, None
+
+
+def localize(messages, zone_name=None):
+    """Pair each message with its timestamp formatted for `zone_name`.
+
+    Message timestamps are naive UTC. With no zone, they're shown as UTC.
+    """
+
+    tz, offset = get_zone(zone_name) if zone_name else (pytz.UTC, None)
+
+    if offset is not None:
+        return [(msg, (msg.timestamp + offset).strftime(TIMESTAMP_FORMAT))
+                for msg in messages]
+
+    return [(msg, pytz.UTC.localize(msg.timestamp)
+                          .astimezone(tz)
+                          .strftime(TIMESTAMP_FORMAT))
+            for msg in messages]
@@ -1,16 +1,64 @@
 """SQLAlchemy models for Warbler."""
 
+import random
+import time
+from collections import namedtuple
 from datetime import datetime
+from functools import wraps
 
-from flask_bcrypt import Bcrypt
-from flask_sqlalchemy import SQLAlchemy
+import flask
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import inspect
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.sql.expression import SelectBase
 
-bcrypt = Bcrypt()
-db = SQLAlchemy()
+from followgraph import FollowGraph, contains
+from passwords import PasswordHasher
+from pool import PoolStats, engine_options, init_pool, watch_statement_timeout
+from querystats import init_query_stats, watch_queries
+
+# Session key: until this time, the browser's reads go to the primary.
+PRIMARY_UNTIL_KEY = 'primary_until'
+FOLLOWS_CHANGED_KEY = 'follows_changed'
+
+
+class RoutingSession(SignallingSession):
+    """Session that can send reads to a replica.
+
+    While `replica` is set (see `reads_from_replica`), plain SELECTs run on
+    that engine; flushes, UPDATE / DELETE / INSERT statements and raw
+    connections still go to the primary.
+    """
+
+    replica = None
+
+    def get_bind(self, mapper=None, clause=None):
+        if (self.replica is not None
+                and not self._flushing
+                and isinstance(clause, SelectBase)):
+            return self.replica
+
+        return super().get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    """Flask-SQLAlchemy with RoutingSession sessions."""
+
+    def create_session(self, options):
+        return sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+passwords = PasswordHasher()
+db = RoutingSQLAlchemy()
 
 
 class FollowersFollowee(db.Model):
-    """Connection of a follower <-> followee."""
+    """Connection of a follower <-> followee.
+
+    Note the column naming: `followee_id` is the user doing the following
+    and `follower_id` is the user being followed (see `User.following`).
+    """
 
     __tablename__ = 'follows'
 
@@ -26,6 +74,85 @@ class FollowersFollowee(db.Model):
         primary_key=True,
     )
 
+    # The primary key leads with followee_id, covering "who does X follow";
+    # this covers "who follows X" (follower lists, fan-out, counters).
+    __table_args__ = (
+        db.Index('ix_follows_follower_followee', 'follower_id', 'followee_id'),
+    )
+
+
+def followed_ids(user_id):
+    """Ids of the users `user_id` follows, ascending (a primary key scan)."""
+
+    # follows.followee_id is the follower; see FollowersFollowee
+    return [id for (id,) in (db.session
+                             .query(FollowersFollowee.follower_id)
+                             .filter(FollowersFollowee.followee_id == user_id)
+                             .order_by(FollowersFollowee.follower_id))]
+
+
+follow_graph = FollowGraph(followed_ids)
+
+
+class ViewerLookup:
+    """Batched "do I like / follow / get followed by" answers for one user.
+
+    Views call `prime()` with the messages about to be rendered, which loads
+    the likes for all of them as an id set in one indexed query. Follow
+    answers come from the shared follow graph (see followgraph.py). Anything
+    not primed is looked up (and remembered) on first use, so templates stay
+    correct either way.
+
+    Other processes' cached copies of the viewer's followees may be stale
+    for up to the cache's TTL after the viewer follows or unfollows someone,
+    so for that long the viewer's own followees are reloaded from the table
+    once per request (see `follows_changed_recently`).
+    """
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.liked_ids = set()
+        self._checked_messages = set()
+        self._following = None
+
+    def prime(self, messages=(), users=()):
+        """Load like / following answers for these messages and users."""
+
+        self._load_liked({msg.id for msg in messages})
+        if users:
+            self.following()
+
+    def likes(self, message_id):
+        self._load_liked({message_id})
+        return message_id in self.liked_ids
+
+    def following(self):
+        """Sorted array of the ids the viewer follows."""
+
+        if self._following is None:
+            self._following = (follow_graph.reload(self.user_id)
+                               if follows_changed_recently()
+                               else follow_graph.following(self.user_id))
+
+        return self._following
+
+    def is_following(self, user_id):
+        return contains(self.following(), user_id)
+
+    def is_followed_by(self, user_id):
+        return follow_graph.is_following(user_id, self.user_id)
+
+    def _load_liked(self, message_ids):
+        message_ids -= self._checked_messages
+
+        if message_ids:
+            liked = (db.session
+                     .query(Like.message_id)
+                     .filter(Like.user_id == self.user_id,
+                             Like.message_id.in_(message_ids)))
+            self.liked_ids.update(id for (id,) in liked)
+            self._checked_messages |= message_ids
+
 
 class User(db.Model):
     """User in the system."""
@@ -85,6 +212,61 @@ class User(db.Model):
         nullable=False,
     )
 
+    # Set when the account is deleted; its rows are then removed in the
+    # background (see jobs.py) and it can no longer log in or be viewed.
+    deleted_at = db.Column(
+        db.DateTime,
+    )
+
+    # Bumped by profile edits; versions cached renders of this user's data.
+    updated_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.utcnow,
+        server_default=db.func.now(),
+    )
+
+    # Bumped with the counters below whenever this user's messages, follows
+    # or likes change; with updated_at, versions pages showing the user
+    # (see conditional.py).
+    changed_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.utcnow,
+        server_default=db.func.now(),
+    )
+
+    # Denormalized counters, kept in step by the views (see
+    # adjust_counters) and recomputable with repair_counters().
+
+    message_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    following_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    follower_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    likes_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
     messages = db.relationship('Message', backref='user')
 
     liked_messages = db.relationship('Message',
@@ -101,24 +283,48 @@ class User(db.Model):
     def __repr__(self):
         return f"<User #{self.id}: {self.username}, {self.email}>"
 
+    @property
+    def lookup(self):
+        """This user's ViewerLookup, created on first use.
+
+        It lives as long as the instance, i.e. for one request's session.
+        """
+
+        try:
+            return self._lookup
+        except AttributeError:
+            self._lookup = ViewerLookup(self.id)
+            return self._lookup
+
+    def _loaded(self, relationship):
+        """Is `relationship` already in memory (loaded, or built up unsaved)?"""
+
+        return relationship not in inspect(self).unloaded
+
     def is_followed_by(self, other_user):
         """Is this user followed by `other_user`?"""
 
-        found_user_list = [user for user in self.followers if user == other_user]
-        return len(found_user_list) == 1
+        # by id: `other_user` may be a CurrentUser rather than a User
+        if self._loaded('followers'):
+            return any(user.id == other_user.id for user in self.followers)
+
+        return self.lookup.is_followed_by(other_user.id)
 
     def is_following(self, other_user):
         """Is this user following `other_use`?"""
 
-        found_user_list = [user for user in self.following if user == other_user]
-        return len(found_user_list) == 1
+        if self._loaded('following'):
+            return any(user.id == other_user.id for user in self.following)
+
+        return self.lookup.is_following(other_user.id)
 
     def likes_msg(self, msg):
-        """"""
-        # FIXME: we should ...
-        # TODO:
-        return self in msg.liked_by
+        """Has this user liked `msg`?"""
 
+        if self._loaded('liked_messages'):
+            return msg in self.liked_messages
+
+        return self.lookup.likes(msg.id)
 
     @classmethod
     def signup(cls, username, email, password, image_url):
@@ -127,7 +333,7 @@ class User(db.Model):
         Hashes password and adds user to system.
         """
 
-        hashed_pwd = bcrypt.generate_password_hash(password).decode('UTF-8')
+        hashed_pwd = passwords.hash(password)
 
         user = User(
             username=username,
@@ -147,18 +353,120 @@ class User(db.Model):
         and, if it finds such a user, returns that user object.
 
         If can't find matching user (or if password is wrong), returns False.
+
+        A password hashed at an outdated cost is re-hashed at the current
+        one; the caller's next commit saves it.
         """
 
-        user = cls.query.filter_by(username=username).first()
+        user = cls.query.filter_by(username=username, deleted_at=None).first()
 
         if user:
-            is_auth = bcrypt.check_password_hash(user.password, password)
+            is_auth = passwords.verify(user.password, password)
             if is_auth:
+                if passwords.needs_rehash(user.password):
+                    user.password = passwords.hash(password)
                 return user
 
         return False
 
 
+UserProfile = namedtuple('UserProfile', [
+    'id', 'username', 'image_url', 'header_image_url', 'time_zone'])
+
+
+class AccountGone(Exception):
+    """The logged-in user's account was deleted mid-session."""
+
+
+class CurrentUser:
+    """The logged-in user for one request.
+
+    Starts from a compact, read-only UserProfile (cached across requests by
+    id, see `load`) and only loads the full User row when something beyond
+    the profile is needed: relationships, counters, or changes to save.
+    Attribute access falls through to that row transparently.
+    """
+
+    def __init__(self, profile, user=None, cache=None):
+        self._profile = profile
+        self._user = user
+        self._cache = cache
+        self.lookup = user.lookup if user else ViewerLookup(profile.id)
+
+    @classmethod
+    def load(cls, user_id, cache):
+        """Current user for `user_id`, or None if there is no such user."""
+
+        profile = cache.get(user_id)
+
+        if profile is not None:
+            return cls(profile, cache=cache)
+
+        user = User.query.get(user_id)
+
+        if user is None or user.deleted_at is not None:
+            return None
+
+        profile = UserProfile(*(getattr(user, field)
+                                for field in UserProfile._fields))
+        cache.set(user_id, profile)
+
+        return cls(profile, user, cache)
+
+    @property
+    def user(self):
+        """The full User row, loaded on first use.
+
+        None if the account was deleted since its profile was cached; the
+        cached profile is dropped, so later requests log them out.
+        """
+
+        if self._user is None:
+            user = User.query.get(self._profile.id)
+
+            if user is None or user.deleted_at is not None:
+                if self._cache is not None:
+                    self._cache.delete(self._profile.id)
+                return None
+
+            self._user = user
+            self._user._lookup = self.lookup
+
+        return self._user
+
+    def __getattr__(self, name):
+        if name in UserProfile._fields:
+            return getattr(self._profile, name)
+
+        user = self.user
+
+        if user is None:
+            raise AccountGone(self._profile.id)
+
+        return getattr(user, name)
+
+    def __repr__(self):
+        return f"<CurrentUser #{self.id}: {self.username}>"
+
+    def is_following(self, other_user):
+        if self._user is not None:
+            return self._user.is_following(other_user)
+
+        return self.lookup.is_following(other_user.id)
+
+    def is_followed_by(self, other_user):
+        if self._user is not None:
+            return self._user.is_followed_by(other_user)
+
+        return self.lookup.is_followed_by(other_user.id)
+
+    def likes_msg(self, msg):
+        if self._user is not None:
+            return self._user.likes_msg(msg)
+
+        return self.lookup.likes(msg.id)
+
+
 class Message(db.Model):
     """An individual message ("warble")."""
 
@@ -186,6 +494,421 @@ class Message(db.Model):
         nullable=False,
     )
 
+    like_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    __table_args__ = (
+        db.Index('ix_messages_user_timestamp', 'user_id', 'timestamp', 'id'),
+    )
+
+
+class Timeline(db.Model):
+    """Precomputed home timeline: `message_id` appears on `user_id`'s homepage.
+
+    Rows are fanned out when a message is posted and backfilled / pruned when
+    follows change, so the homepage is a single range read over
+    (user_id, timestamp, message_id) instead of an IN (...) over followees.
+
+    Following someone (and `rebuild`) copies only their newest BACKFILL
+    messages, so a follow costs the same however prolific they've been.
+    """
+
+    __tablename__ = 'timelines'
+
+    BACKFILL = 1000
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete="cascade"),
+        primary_key=True,
+    )
+
+    message_id = db.Column(
+        db.Integer,
+        db.ForeignKey('messages.id', ondelete="cascade"),
+        primary_key=True,
+        index=True,
+    )
+
+    author_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete="cascade"),
+        nullable=False,
+    )
+
+    timestamp = db.Column(
+        db.DateTime,
+        nullable=False,
+    )
+
+    __table_args__ = (
+        db.Index('ix_timelines_user_timestamp',
+                 'user_id', 'timestamp', 'message_id'),
+        db.Index('ix_timelines_user_author', 'user_id', 'author_id'),
+        # purging a deleted account's messages from followers' timelines
+        db.Index('ix_timelines_author', 'author_id'),
+    )
+
+    COLUMNS = ['user_id', 'message_id', 'author_id', 'timestamp']
+
+    @classmethod
+    def feed_for(cls, user_id):
+        """Query of messages on `user_id`'s timeline, newest first."""
+
+        return (Message
+                .query
+                .join(cls, cls.message_id == Message.id)
+                .join(User, User.id == Message.user_id)
+                .filter(cls.user_id == user_id, User.deleted_at.is_(None))
+                .order_by(cls.timestamp.desc(), cls.message_id.desc()))
+
+    @classmethod
+    def post(cls, message):
+        """Put a (flushed) message on its author's own timeline.
+
+        Followers' timelines are filled by `fan_out`, in the background.
+        """
+
+        db.session.add(cls(user_id=message.user_id,
+                           message_id=message.id,
+                           author_id=message.user_id,
+                           timestamp=message.timestamp))
+
+    @classmethod
+    def fan_out(cls, message, after=0, limit=None):
+        """Append a message to its author's followers' timelines.
+
+        Covers followers with ids above `after`, `limit` of them at most
+        (all by default), skipping any that already have it (e.g. from a
+        backfill). Returns the highest follower id covered, or None if there
+        were no more followers.
+        """
+
+        author_id = message.user_id
+
+        follower_ids = (db.session
+                        .query(FollowersFollowee.followee_id)
+                        .filter(FollowersFollowee.follower_id == author_id,
+                                FollowersFollowee.followee_id > after)
+                        .order_by(FollowersFollowee.followee_id)
+                        .limit(limit)
+                        .all())
+
+        if not follower_ids:
+            return None
+
+        last = follower_ids[-1][0]
+
+        has_it = (db.exists()
+                  .where(cls.user_id == FollowersFollowee.followee_id)
+                  .where(cls.message_id == message.id))
+
+        followers = (db.select([FollowersFollowee.followee_id,
+                                db.literal(message.id),
+                                db.literal(author_id),
+                                db.literal(message.timestamp)])
+                     .where(FollowersFollowee.follower_id == author_id)
+                     .where(FollowersFollowee.followee_id.between(after + 1,
+                                                                  last))
+                     .where(~has_it))
+
+        db.session.execute(
+            cls.__table__.insert().from_select(cls.COLUMNS, followers))
+
+        return last
+
+    @classmethod
+    def backfill(cls, user_id, followee_id):
+        """Copy `followee_id`'s newest BACKFILL messages onto `user_id`'s
+        timeline."""
+
+        messages = (db.select([db.literal(user_id),
+                               Message.id,
+                               Message.user_id,
+                               Message.timestamp])
+                    .where(Message.user_id == followee_id)
+                    .order_by(Message.timestamp.desc(), Message.id.desc())
+                    .limit(cls.BACKFILL))
+
+        db.session.execute(
+            cls.__table__.insert().from_select(cls.COLUMNS, messages))
+
+    @classmethod
+    def prune(cls, user_id, followee_id):
+        """Remove `followee_id`'s messages from `user_id`'s timeline."""
+
+        (cls.query
+            .filter(cls.user_id == user_id, cls.author_id == followee_id)
+            .delete(synchronize_session=False))
+
+    @classmethod
+    def remove_message(cls, message_id):
+        """Remove a message from every timeline it was fanned out to."""
+
+        (cls.query
+            .filter(cls.message_id == message_id)
+            .delete(synchronize_session=False))
+
+    @classmethod
+    def rebuild(cls):
+        """Recompute every timeline from `messages` and `follows`.
+
+        Used after bulk loads (see seed.py) that bypass the views.
+        """
+
+        own = db.select([
+            Message.user_id.label('user_id'),
+            Message.id,
+            Message.user_id.label('author_id'),
+            Message.timestamp,
+        ])
+
+        # each author's newest BACKFILL messages, as a follow would copy
+        rank = (db.func.row_number()
+                .over(partition_by=Message.user_id,
+                      order_by=(Message.timestamp.desc(), Message.id.desc()))
+                .label('rank'))
+        recent = db.select([Message.id, Message.user_id, Message.timestamp,
+                            rank]).alias()
+
+        followed = db.select([
+            FollowersFollowee.followee_id,
+            recent.c.id,
+            recent.c.user_id,
+            recent.c.timestamp,
+        ]).where(db.and_(FollowersFollowee.follower_id == recent.c.user_id,
+                         recent.c.rank <= cls.BACKFILL))
+
+        cls.query.delete(synchronize_session=False)
+        db.session.execute(
+            cls.__table__.insert().from_select(cls.COLUMNS, own))
+        db.session.execute(
+            cls.__table__.insert().from_select(cls.COLUMNS, followed))
+
+
+class Suggestion(db.Model):
+    """Precomputed "who to follow": `suggested_id` for `user_id`.
+
+    Candidates are friends of friends, ranked by `mutuals` -- how many of
+    the people `user_id` follows follow them. That is the follow adjacency
+    matrix squared, computed in the database as one self-join of `follows`
+    grouped by (user, candidate). `rebuild` does every user in one pass
+    (`flask rebuild-suggestions`). When a user's follows change, `refresh`
+    redoes theirs, and `adjust_followers` moves the one affected row of
+    each of their followers, a batch at a time. The homepage then reads a
+    user's top few rows off the primary key index.
+    """
+
+    __tablename__ = 'suggestions'
+
+    PER_USER = 10
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete="cascade"),
+        primary_key=True,
+    )
+
+    suggested_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete="cascade"),
+        primary_key=True,
+        index=True,
+    )
+
+    mutuals = db.Column(
+        db.Integer,
+        nullable=False,
+    )
+
+    __table_args__ = (
+        db.Index('ix_suggestions_user_mutuals',
+                 'user_id', 'mutuals', 'suggested_id'),
+    )
+
+    COLUMNS = ['user_id', 'suggested_id', 'mutuals']
+
+    @staticmethod
+    def _candidates(user_ids=None):
+        """Query of (user_id, suggested_id, mutuals) for friends of friends
+        not already followed, for every user or just `user_ids`."""
+
+        # follows.followee_id is the follower; see FollowersFollowee
+        mine = db.aliased(FollowersFollowee)
+        theirs = db.aliased(FollowersFollowee)
+        already = db.aliased(FollowersFollowee)
+
+        followed = (db.exists()
+                    .where(already.followee_id == mine.followee_id)
+                    .where(already.follower_id == theirs.follower_id))
+
+        query = (db.session
+                 .query(mine.followee_id.label('user_id'),
+                        theirs.follower_id.label('suggested_id'),
+                        db.func.count().label('mutuals'))
+                 .join(theirs, theirs.followee_id == mine.follower_id)
+                 .filter(theirs.follower_id != mine.followee_id, ~followed)
+                 .group_by(mine.followee_id, theirs.follower_id))
+
+        if user_ids is not None:
+            query = query.filter(mine.followee_id.in_(user_ids))
+
+        return query
+
+    @classmethod
+    def for_user(cls, user_id, limit=5):
+        """`user_id`'s best `limit` suggestions, as User rows."""
+
+        return (User
+                .query
+                .join(cls, cls.suggested_id == User.id)
+                .filter(cls.user_id == user_id, User.deleted_at.is_(None))
+                .order_by(cls.mutuals.desc(), cls.suggested_id)
+                .limit(limit)
+                .all())
+
+    @classmethod
+    def refresh(cls, user_id):
+        """Recompute `user_id`'s suggestions."""
+
+        best = (cls._candidates([user_id])
+                .order_by(db.desc('mutuals'), db.asc('suggested_id'))
+                .limit(cls.PER_USER))
+
+        cls.query.filter(cls.user_id == user_id).delete()
+        db.session.execute(
+            cls.__table__.insert().from_select(cls.COLUMNS, best.statement))
+
+    @classmethod
+    def rebuild(cls):
+        """Recompute every user's suggestions in one pass."""
+
+        candidates = cls._candidates().subquery()
+        rank = (db.func.row_number()
+                .over(partition_by=candidates.c.user_id,
+                      order_by=(candidates.c.mutuals.desc(),
+                                candidates.c.suggested_id))
+                .label('rank'))
+        ranked = db.select([candidates, rank]).alias()
+
+        best = (db.select([ranked.c.user_id,
+                           ranked.c.suggested_id,
+                           ranked.c.mutuals])
+                .where(ranked.c.rank <= cls.PER_USER))
+
+        cls.query.delete(synchronize_session=False)
+        db.session.execute(
+            cls.__table__.insert().from_select(cls.COLUMNS, best))
+
+    @classmethod
+    def adjust_followers(cls, user_id, followed_id, change, after=0,
+                         limit=None):
+        """Apply `user_id` (un)following `followed_id` to their followers'
+        suggestions.
+
+        Each follower F of `user_id` gains (`change` 1) or loses (-1) one
+        mutual towards `followed_id`, so only the (F, followed_id) row
+        moves: it's upserted, or dropped once it reaches 0, and F's list is
+        cut back to PER_USER. Like the counters on users, a row that was
+        cut earlier restarts from 1; `rebuild` puts exact counts back.
+
+        Covers followers with ids above `after`, `limit` of them at most
+        (all by default). Returns the highest follower id covered, or None
+        if there were no more followers.
+        """
+
+        # follows.followee_id is the follower; see FollowersFollowee
+        follower_ids = [id for (id,) in (db.session
+                        .query(FollowersFollowee.followee_id)
+                        .filter(FollowersFollowee.follower_id == user_id,
+                                FollowersFollowee.followee_id > after)
+                        .order_by(FollowersFollowee.followee_id)
+                        .limit(limit))]
+
+        if not follower_ids:
+            return None
+
+        this = (cls.query
+                .filter(cls.user_id.in_(follower_ids),
+                        cls.suggested_id == followed_id))
+
+        if change < 0:
+            this.update({cls.mutuals: cls.mutuals + change},
+                        synchronize_session=False)
+            this.filter(cls.mutuals <= 0).delete(synchronize_session=False)
+            return follower_ids[-1]
+
+        # nobody is suggested themselves, or someone they already follow
+        following = {id for (id,) in (db.session
+                     .query(FollowersFollowee.followee_id)
+                     .filter(FollowersFollowee.followee_id.in_(follower_ids),
+                             FollowersFollowee.follower_id == followed_id))}
+        gaining = [id for id in follower_ids
+                   if id != followed_id and id not in following]
+
+        if gaining:
+            cls._add_mutual(gaining, followed_id, change)
+            cls._trim(gaining)
+
+        return follower_ids[-1]
+
+    @classmethod
+    def _add_mutual(cls, user_ids, suggested_id, change):
+        """Add `change` to `suggested_id`'s mutuals for each of `user_ids`,
+        starting rows that don't exist yet."""
+
+        if db.engine.dialect.name == 'postgresql':
+            stmt = insert(cls.__table__).values(
+                [{'user_id': id, 'suggested_id': suggested_id,
+                  'mutuals': change}
+                 for id in user_ids])
+            db.session.execute(stmt.on_conflict_do_update(
+                index_elements=['user_id', 'suggested_id'],
+                set_={'mutuals': cls.__table__.c.mutuals
+                      + stmt.excluded.mutuals}))
+            return
+
+        existing = cls.query.filter(cls.user_id.in_(user_ids),
+                                    cls.suggested_id == suggested_id)
+        have = {row.user_id for row in existing}
+        existing.update({cls.mutuals: cls.mutuals + change},
+                        synchronize_session=False)
+        db.session.add_all(cls(user_id=id, suggested_id=suggested_id,
+                               mutuals=change)
+                           for id in user_ids if id not in have)
+
+    @classmethod
+    def _trim(cls, user_ids):
+        """Cut each of `user_ids`' lists back to their best PER_USER."""
+
+        rank = (db.func.row_number()
+                .over(partition_by=cls.user_id,
+                      order_by=(cls.mutuals.desc(), cls.suggested_id))
+                .label('rank'))
+        ranked = (db.session
+                  .query(cls.user_id, cls.suggested_id, rank)
+                  .filter(cls.user_id.in_(user_ids))
+                  .subquery())
+        excess = (db.session
+                  .query(ranked.c.user_id, ranked.c.suggested_id)
+                  .filter(ranked.c.rank > cls.PER_USER))
+
+        (cls.query
+            .filter(db.tuple_(cls.user_id, cls.suggested_id).in_(excess))
+            .delete(synchronize_session=False))
+
+    @classmethod
+    def discard(cls, user_id, suggested_id):
+        """Drop one suggestion (e.g. once it's been followed)."""
+
+        (cls.query
+            .filter(cls.user_id == user_id, cls.suggested_id == suggested_id)
+            .delete(synchronize_session=False))
+
 
 class Like(db.Model):
     ''' association table that keeps track of users and liked messages'''
@@ -204,12 +927,364 @@ class Like(db.Model):
         primary_key=True,
     )
 
+    @classmethod
+    def set(cls, user_id, message_id, liked):
+        """Make `user_id` like (or, with `liked` false, not like) a message.
+
+        A single INSERT ... ON CONFLICT DO NOTHING or DELETE on the primary
+        key, so it costs the same however many messages the user has liked,
+        and repeating it changes nothing. The like counters move only if
+        the row did. Returns the change: 1, -1 or 0. Raises IntegrityError
+        for a message that doesn't exist. Runs in the caller's transaction.
+        """
+
+        criterion = (cls.user_id == user_id) & (cls.message_id == message_id)
+
+        if not liked:
+            change = -cls.query.filter(criterion).delete(
+                synchronize_session=False)
+        elif db.engine.dialect.name == 'postgresql':
+            change = db.session.execute(
+                insert(cls.__table__)
+                .values(user_id=user_id, message_id=message_id)
+                .on_conflict_do_nothing()).rowcount
+        elif db.session.query(db.exists().where(criterion)).scalar():
+            change = 0
+        else:
+            db.session.add(cls(user_id=user_id, message_id=message_id))
+            db.session.flush()
+            change = 1
+
+        if change:
+            adjust_counters(User, User.id == user_id, likes_count=change)
+            adjust_counters(Message, Message.id == message_id,
+                            like_count=change)
+
+        return change
+
+
+class LikeBucket(db.Model):
+    """Net likes a message got during one hour (see trending.py)."""
+
+    __tablename__ = 'like_buckets'
+
+    message_id = db.Column(
+        db.Integer,
+        db.ForeignKey('messages.id', ondelete="cascade"),
+        primary_key=True,
+    )
+
+    # start of the hour, UTC
+    bucket = db.Column(
+        db.DateTime,
+        primary_key=True,
+        index=True,
+    )
+
+    count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+    )
+
+
+class TrendingMessage(db.Model):
+    """Precomputed top messages for one trending window (see trending.py)."""
+
+    __tablename__ = 'trending'
+
+    window = db.Column(
+        db.Text,
+        primary_key=True,
+    )
+
+    rank = db.Column(
+        db.Integer,
+        primary_key=True,
+    )
+
+    message_id = db.Column(
+        db.Integer,
+        db.ForeignKey('messages.id', ondelete="cascade"),
+        nullable=False,
+        index=True,
+    )
+
+    score = db.Column(
+        db.Float,
+        nullable=False,
+    )
+
+    likes = db.Column(
+        db.Integer,
+        nullable=False,
+    )
+
+    computed_at = db.Column(
+        db.DateTime,
+        nullable=False,
+    )
+
+    message = db.relationship('Message')
+
+
+class TrendingRefresh(db.Model):
+    """When the trending rankings are next due a refresh (one row; see
+    trending.py)."""
+
+    __tablename__ = 'trending_refresh'
+
+    id = db.Column(
+        db.Integer,
+        primary_key=True,
+    )
+
+    due_at = db.Column(
+        db.DateTime,
+        nullable=False,
+    )
+
+
+class Job(db.Model):
+    """A unit of background work, run by the worker in jobs.py."""
+
+    __tablename__ = 'jobs'
+
+    id = db.Column(
+        db.Integer,
+        primary_key=True,
+    )
+
+    kind = db.Column(
+        db.Text,
+        nullable=False,
+    )
+
+    payload = db.Column(
+        db.JSON,
+        nullable=False,
+        default=dict,
+    )
+
+    # queued until it succeeds (and is deleted) or runs out of attempts
+    status = db.Column(
+        db.Text,
+        nullable=False,
+        default='queued',
+    )
+
+    attempts = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+    )
+
+    run_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.utcnow,
+    )
+
+    last_error = db.Column(
+        db.Text,
+    )
+
+    created_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.utcnow,
+    )
+
+    __table_args__ = (
+        db.Index('ix_jobs_status_run_at', 'status', 'run_at'),
+    )
+
+    def __repr__(self):
+        return f"<Job #{self.id}: {self.kind} {self.payload} ({self.status})>"
+
+
+def adjust_counters(model, criterion, **deltas):
+    """Add `deltas` (column name -> amount) to counters of matching rows.
+
+    Runs as a single UPDATE ... SET col = col + n, so concurrent requests
+    can't lose increments. Amounts may be SQL expressions. Rows with a
+    `changed_at` column have it set to now as well.
+    """
+
+    values = {getattr(model, col): getattr(model, col) + amount
+              for col, amount in deltas.items()}
+
+    if hasattr(model, 'changed_at'):
+        values[model.changed_at] = datetime.utcnow()
+
+    (model.query
+        .filter(criterion)
+        .update(values, synchronize_session=False))
+
+
+def retract_counters(user_id):
+    """Undo `user_id`'s contributions to other rows' counters.
+
+    Call before deleting the account; the rows themselves go with the
+    cascades.
+    """
+
+    followed_ids = db.select([FollowersFollowee.follower_id]).where(
+        FollowersFollowee.followee_id == user_id)
+    follower_ids = db.select([FollowersFollowee.followee_id]).where(
+        FollowersFollowee.follower_id == user_id)
+    liked_ids = db.select([Like.message_id]).where(Like.user_id == user_id)
+
+    likes_of_my_messages = (db.select([db.func.count()])
+                            .select_from(Like.__table__.join(Message.__table__))
+                            .where(Like.user_id == User.id)
+                            .where(Message.user_id == user_id)
+                            .correlate(User.__table__)
+                            .as_scalar())
+    likers = (db.select([Like.user_id])
+              .select_from(Like.__table__.join(Message.__table__))
+              .where(Message.user_id == user_id))
+
+    adjust_counters(User, User.id.in_(followed_ids), follower_count=-1)
+    adjust_counters(User, User.id.in_(follower_ids), following_count=-1)
+    adjust_counters(Message, Message.id.in_(liked_ids), like_count=-1)
+    adjust_counters(User, User.id.in_(likers),
+                    likes_count=-likes_of_my_messages)
+
+
+def repair_counters():
+    """Recompute every denormalized counter from the underlying tables."""
+
+    def count(column, key):
+        return (db.select([db.func.count()])
+                .where(column == key)
+                .as_scalar())
+
+    User.query.update({
+        User.message_count: count(Message.user_id, User.id),
+        User.following_count: count(FollowersFollowee.followee_id, User.id),
+        User.follower_count: count(FollowersFollowee.follower_id, User.id),
+        User.likes_count: count(Like.user_id, User.id),
+        User.changed_at: datetime.utcnow(),
+    }, synchronize_session=False)
+
+    Message.query.update({
+        Message.like_count: count(Like.message_id, Message.id),
+    }, synchronize_session=False)
+
+
+def replica_binds(app):
+    """Bind keys of the configured read replicas."""
+
+    return [f'replica_{i}'
+            for i in range(len(app.config['DATABASE_REPLICA_URLS']))]
+
+
+def choose_replica():
+    """Engine of a random replica to read from, or None for the primary.
+
+    The primary is used for anything but GET / HEAD, when no replicas are
+    configured, and for a few seconds after the browser last sent a write,
+    so people see their own changes despite replication lag.
+    """
+
+    app = flask.current_app
+    binds = replica_binds(app)
+
+    if (not binds
+            or flask.request.method not in ('GET', 'HEAD')
+            or flask.session.get(PRIMARY_UNTIL_KEY, 0) > time.time()):
+        return None
+
+    return db.get_engine(app, bind=random.choice(binds))
+
+
+def reads_from_replica(view):
+    """Decorate a read-only view to run its queries on a read replica."""
+
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        replica = choose_replica()
+
+        if replica is None:
+            return view(*args, **kwargs)
+
+        db.session().replica = replica
+        try:
+            return view(*args, **kwargs)
+        finally:
+            db.session().replica = None
+
+    return wrapper
+
+
+def stick_to_primary(resp):
+    """After a write, read this browser's pages from the primary for a bit."""
+
+    app = flask.current_app
+
+    if (replica_binds(app)
+            and flask.request.method not in ('GET', 'HEAD', 'OPTIONS')):
+        flask.session[PRIMARY_UNTIL_KEY] = (
+            time.time() + app.config['REPLICA_STICKY_SECONDS'])
+
+    return resp
+
+
+def note_follows_changed():
+    """Record that this browser's user just followed or unfollowed someone."""
+
+    flask.session[FOLLOWS_CHANGED_KEY] = time.time()
+
+
+def follows_changed_recently():
+    """Did this browser's user change their follows within the follow
+    graph cache's TTL, so other processes may hold a stale copy?"""
+
+    if not flask.has_request_context():
+        return False
+
+    changed = flask.session.get(FOLLOWS_CHANGED_KEY)
+    ttl = follow_graph.local.ttl
+
+    return changed is not None and (ttl is None
+                                    or changed + ttl > time.time())
+
 
 def connect_db(app):
     """Connect this database to provided Flask app.
 
-    You should call this in your Flask app.
+    You should call this in your Flask app. This also sizes the connection
+    pool from config (see pool.py), binds any read replicas listed in
+    DATABASE_REPLICA_URLS (used by views decorated with
+    `reads_from_replica`), configures password hashing (see passwords.py)
+    and hooks in the opt-in per-request query statistics (see
+    querystats.py).
     """
 
+    stats = PoolStats()
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+        **engine_options(app.config, stats),
+        **app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {}),
+    }
+
+    app.config.setdefault('DATABASE_REPLICA_URLS', [])
+    app.config.setdefault('REPLICA_STICKY_SECONDS', 5)
+    app.config['SQLALCHEMY_BINDS'] = {
+        **(app.config.get('SQLALCHEMY_BINDS') or {}),
+        **dict(zip(replica_binds(app), app.config['DATABASE_REPLICA_URLS'])),
+    }
+
     db.app = app
     db.init_app(app)
+    passwords.init_app(app)
+    init_pool(app, db.get_engine(app), stats)
+
+    init_query_stats(app, db.get_engine(app))
+
+    for bind in replica_binds(app):
+        replica = db.get_engine(app, bind=bind)
+        watch_statement_timeout(app, replica)
+        watch_queries(replica)
+
+    app.after_request(stick_to_primary)
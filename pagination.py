@@ -0,0 +1,202 @@
+"""Keyset (cursor) pagination for message feeds.
+
+Feeds are ordered newest first on (timestamp, id). Instead of OFFSET, a page
+is requested relative to a cursor naming the last row already seen, so page
+fifty costs the same single index range read as page one.
+"""
+
+from datetime import datetime
+
+from flask import abort
+from sqlalchemy import tuple_
+
+PER_PAGE = 100
+CURSOR_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+
+class Page:
+    """One page of a feed.
+
+    `before` is the cursor for the next (older) page and `after` the cursor
+    for the previous (newer) page; either is None when there is no such page.
+    """
+
+    def __init__(self, items, before=None, after=None):
+        self.items = items
+        self.before = before
+        self.after = after
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+def encode_cursor(timestamp, id):
+    """Make a URL-safe cursor string from a (timestamp, id) key."""
+
+    return f"{timestamp.strftime(CURSOR_FORMAT)}_{id}"
+
+
+def decode_cursor(cursor):
+    """Turn a cursor string back into a (timestamp, id) key.
+
+    Raises ValueError if the cursor is malformed.
+    """
+
+    timestamp, _, id = cursor.rpartition('_')
+    return datetime.strptime(timestamp, CURSOR_FORMAT), int(id)
+
+
+def encode_rank_cursor(rank, id):
+    """Cursor for relevance-ranked results, keyed on (rank, id)."""
+
+    return f"{rank!r}_{id}"
+
+
+def decode_rank_cursor(cursor):
+    """Turn a ranked-results cursor back into a (rank, id) key.
+
+    Raises ValueError if the cursor is malformed.
+    """
+
+    rank, _, id = cursor.rpartition('_')
+    return float(rank), int(id)
+
+
+def message_key(message):
+    """Default cursor key for a Message row."""
+
+    return message.timestamp, message.id
+
+
+def paginate(query, timestamp_col, id_col, before=None, after=None,
+             per_page=PER_PAGE, key=message_key):
+    """Return a Page of `query` ordered newest first on (timestamp, id).
+
+    `timestamp_col` and `id_col` are the columns the query's index is
+    ordered by. Pass at most one of `before` (older than this cursor) or
+    `after` (newer than this cursor). Malformed cursors abort with a 400.
+    """
+
+    try:
+        before_key = before and decode_cursor(before)
+        after_key = after and decode_cursor(after)
+    except ValueError:
+        abort(400)
+
+    key_cols = tuple_(timestamp_col, id_col)
+    query = query.order_by(None)
+
+    if after_key:
+        items = (query
+                 .filter(key_cols > tuple_(*after_key))
+                 .order_by(timestamp_col.asc(), id_col.asc())
+                 .limit(per_page + 1)
+                 .all())
+
+        has_newer = len(items) > per_page
+        items = items[:per_page]
+        items.reverse()
+
+        return Page(items,
+                    before=encode_cursor(*key(items[-1])) if items else None,
+                    after=encode_cursor(*key(items[0])) if has_newer else None)
+
+    if before_key:
+        query = query.filter(key_cols < tuple_(*before_key))
+
+    items = (query
+             .order_by(timestamp_col.desc(), id_col.desc())
+             .limit(per_page + 1)
+             .all())
+
+    has_older = len(items) > per_page
+    items = items[:per_page]
+
+    has_newer = bool(before_key and items)
+
+    return Page(items,
+                before=encode_cursor(*key(items[-1])) if has_older else None,
+                after=encode_cursor(*key(items[0])) if has_newer else None)
+
+
+def paginate_ranked(query, rank, id_col, before=None, per_page=PER_PAGE):
+    """Return a Page of `query` ordered best first on (rank, id).
+
+    `rank` is the relevance expression to order by; it must be a double
+    (float8), since cursors carry it as a Python float and a float4 rank
+    wouldn't compare equal to its own cursor. Like paginate(), but only
+    "load more" (`before`) cursors are supported.
+    """
+
+    if before:
+        try:
+            before_key = decode_rank_cursor(before)
+        except ValueError:
+            abort(400)
+
+        query = query.filter(tuple_(rank, id_col) < tuple_(*before_key))
+
+    rows = (query
+            .add_columns(rank)
+            .order_by(rank.desc(), id_col.desc())
+            .limit(per_page + 1)
+            .all())
+
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+
+    return Page([item for item, _ in rows],
+                before=(encode_rank_cursor(rows[-1][1], rows[-1][0].id)
+                        if has_more else None))
+
+
+def paginate_by_id(query, id_col, before=None, after=None, per_page=PER_PAGE):
+    """Return a Page of `query` ordered by `id_col`, highest first.
+
+    For lists without a timestamp, like followers: cursors are plain ids
+    (each item's `id` must be its `id_col` value), so pages are index range
+    reads on `id_col`. Otherwise like paginate().
+    """
+
+    try:
+        before_id = before and int(before)
+        after_id = after and int(after)
+    except ValueError:
+        abort(400)
+
+    query = query.order_by(None)
+
+    if after_id:
+        items = (query
+                 .filter(id_col > after_id)
+                 .order_by(id_col.asc())
+                 .limit(per_page + 1)
+                 .all())
+
+        has_newer = len(items) > per_page
+        items = items[:per_page]
+        items.reverse()
+
+        return Page(items,
+                    before=str(items[-1].id) if items else None,
+                    after=str(items[0].id) if has_newer else None)
+
+    if before_id:
+        query = query.filter(id_col < before_id)
+
+    items = (query
+             .order_by(id_col.desc())
+             .limit(per_page + 1)
+             .all())
+
+    has_older = len(items) > per_page
+    items = items[:per_page]
+
+    has_newer = bool(before_id and items)
+
+    return Page(items,
+                before=str(items[-1].id) if has_older else None,
+                after=str(items[0].id) if has_newer else None)
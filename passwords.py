@@ -0,0 +1,134 @@
+"""bcrypt password hashing on a bounded worker pool.
+
+bcrypt is slow on purpose, so a burst of logins or signups hashed inline
+would pin every web worker on CPU and starve feed traffic. Instead, hashes
+run on a small thread pool (bcrypt releases the GIL while it works, so the
+threads really do run in parallel) and requests wait for their result.
+
+At most PASSWORD_HASH_WORKERS hashes run and PASSWORD_HASH_QUEUE more wait
+at once; beyond that, `hash` / `verify` raise PasswordHasherBusy straight
+away, which the app turns into a 503 so clients back off and retry.
+
+That back-pressure needs threaded web workers (gunicorn's gthread, as in
+the Procfile): with sync workers each process serves one request at a
+time, so the pool never has more than one caller and never fills. Keep
+workers + queue below the threads per process.
+
+The cost factor is BCRYPT_LOG_ROUNDS. Hashes made with a different cost
+still verify, and `needs_rehash` tells login to re-hash them at the new one.
+"""
+
+import re
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from threading import BoundedSemaphore, Lock
+
+from flask_bcrypt import Bcrypt
+
+DEFAULT_ROUNDS = 12
+DEFAULT_WORKERS = 2
+DEFAULT_QUEUE = 4
+DEFAULT_TIMEOUT = 30
+
+# "$2b$12$..." -> 12
+_COST = re.compile(r"^\$2[abxy]?\$(\d+)\$")
+
+
+class PasswordHasherBusy(Exception):
+    """Too many password hashes are already running or queued."""
+
+
+class PasswordHasher:
+    """bcrypt hashing and verification, run on a bounded thread pool."""
+
+    def __init__(self):
+        self.bcrypt = Bcrypt()
+        self._lock = Lock()
+        self._executor = None
+        self.rounds = DEFAULT_ROUNDS
+        self.workers = DEFAULT_WORKERS
+        self.queue = DEFAULT_QUEUE
+        self.timeout = DEFAULT_TIMEOUT
+        self.configure()
+
+    def init_app(self, app):
+        """Configure from `app.config`."""
+
+        app.config.setdefault('BCRYPT_LOG_ROUNDS', DEFAULT_ROUNDS)
+        app.config.setdefault('PASSWORD_HASH_WORKERS', DEFAULT_WORKERS)
+        app.config.setdefault('PASSWORD_HASH_QUEUE', DEFAULT_QUEUE)
+        app.config.setdefault('PASSWORD_HASH_TIMEOUT', DEFAULT_TIMEOUT)
+
+        self.bcrypt.init_app(app)
+        self.configure(rounds=app.config['BCRYPT_LOG_ROUNDS'],
+                       workers=app.config['PASSWORD_HASH_WORKERS'],
+                       queue=app.config['PASSWORD_HASH_QUEUE'],
+                       timeout=app.config['PASSWORD_HASH_TIMEOUT'])
+
+    def configure(self, rounds=None, workers=None, queue=None, timeout=None):
+        """Change the cost factor and/or pool limits; None keeps a setting.
+
+        The pool itself is started on first use, so each forked web worker
+        gets its own threads.
+        """
+
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+
+            if rounds is not None:
+                self.rounds = int(rounds)
+            if workers is not None:
+                self.workers = int(workers)
+            if queue is not None:
+                self.queue = int(queue)
+            if timeout is not None:
+                self.timeout = timeout
+
+            self._executor = None
+            self._slots = BoundedSemaphore(self.workers + self.queue)
+
+    def _run(self, fn, *args):
+        """Run `fn(*args)` on the pool and wait for its result."""
+
+        slots = self._slots
+
+        if not slots.acquire(blocking=False):
+            raise PasswordHasherBusy("password hashing pool is full")
+
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.workers,
+                    thread_name_prefix='password-hasher')
+            executor = self._executor
+
+        try:
+            future = executor.submit(fn, *args)
+        except BaseException:
+            slots.release()
+            raise
+
+        future.add_done_callback(lambda _: slots.release())
+
+        try:
+            return future.result(self.timeout)
+        except TimeoutError:
+            raise PasswordHasherBusy("password hashing timed out")
+
+    def hash(self, password):
+        """bcrypt hash of `password` at the configured cost, as text."""
+
+        hashed = self._run(self.bcrypt.generate_password_hash,
+                           password, self.rounds)
+        return hashed.decode('UTF-8')
+
+    def verify(self, hashed, password):
+        """Does `password` match the stored `hashed` password?"""
+
+        return self._run(self.bcrypt.check_password_hash, hashed, password)
+
+    def needs_rehash(self, hashed):
+        """Was `hashed` made with a different cost than the configured one?"""
+
+        match = _COST.match(hashed)
+        return match is None or int(match.group(1)) != self.rounds
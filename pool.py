@@ -0,0 +1,181 @@
+"""Database connection pool configuration and metrics.
+
+connect_db() builds the engine from these settings (app.py reads each from
+the environment variable of the same name):
+
+    DB_POOL_SIZE           connections kept open per process (5)
+    DB_MAX_OVERFLOW        extra connections allowed under load (10)
+    DB_POOL_TIMEOUT        seconds to wait for a free connection (10)
+    DB_POOL_RECYCLE        seconds before a connection is replaced (1800)
+    DB_POOL_PRE_PING       test connections before use (on)
+    DB_STATEMENT_TIMEOUT   per-request statement limit, in ms (off)
+    DB_PGBOUNCER           running behind a transaction pooler (off)
+
+With N gunicorn workers, each process may open up to DB_POOL_SIZE +
+DB_MAX_OVERFLOW connections, so keep N * (size + overflow) under the
+server's max_connections (or the pooler's pool size).
+
+The statement timeout is set with SET LOCAL at the start of each
+transaction run inside a request, so CLI maintenance commands aren't cut
+short and the setting never outlives the transaction -- which is also what
+makes it safe behind PgBouncer in transaction mode. In that mode each
+transaction may land on a different server connection, so nothing is set
+per connection; psycopg2 never uses server-side prepared statements, so
+there are none to disable. App-side pooling is turned off (NullPool) and
+left to the pooler.
+
+Checkouts from the app-side pool are timed. With QUERY_STATS on,
+responses get an X-DB-Pool-Wait header, waits over DB_POOL_WAIT_WARNING ms
+are logged, and /_status/pool reports this process's pool as JSON.
+"""
+
+import time
+from threading import Lock
+
+from flask import g, has_request_context, jsonify, abort
+from sqlalchemy import event
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.exc import TimeoutError
+from sqlalchemy.pool import NullPool, QueuePool
+
+DEFAULTS = {
+    'DB_POOL_SIZE': 5,
+    'DB_MAX_OVERFLOW': 10,
+    'DB_POOL_TIMEOUT': 10,
+    'DB_POOL_RECYCLE': 1800,
+    'DB_POOL_PRE_PING': True,
+    'DB_STATEMENT_TIMEOUT': None,
+    'DB_PGBOUNCER': False,
+    'DB_POOL_WAIT_WARNING': 100,
+}
+
+
+class PoolStats:
+    """Checkout counts and wait times for one engine's pool."""
+
+    def __init__(self):
+        self._lock = Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def record(self, wait, timed_out=False):
+        with self._lock:
+            self.checkouts += 1
+            self.timeouts += timed_out
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+
+        if has_request_context():
+            g.pool_wait = g.get('pool_wait', 0.0) + wait
+
+    def snapshot(self, pool):
+        """Current pool occupancy plus totals since startup."""
+
+        status = {
+            'checkouts': self.checkouts,
+            'timeouts': self.timeouts,
+            'mean_wait_ms': round(self.total_wait * 1000
+                                  / (self.checkouts or 1), 3),
+            'max_wait_ms': round(self.max_wait * 1000, 3),
+        }
+
+        if isinstance(pool, QueuePool):
+            status.update(size=pool.size(),
+                          checked_out=pool.checkedout(),
+                          overflow=max(0, pool.overflow()),
+                          idle=pool.checkedin())
+
+        return status
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that records how long each checkout waits.
+
+    Subclassed per engine (see `engine_options`) so the stats survive the
+    pool being recreated on dispose().
+    """
+
+    stats = None
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            conn = super()._do_get()
+        except TimeoutError:
+            self.stats.record(time.perf_counter() - start, timed_out=True)
+            raise
+        self.stats.record(time.perf_counter() - start)
+        return conn
+
+
+def is_postgres(uri):
+    return make_url(uri).get_backend_name() in ('postgres', 'postgresql')
+
+
+def engine_options(config, stats):
+    """create_engine() options for the app's database."""
+
+    for key, value in DEFAULTS.items():
+        config.setdefault(key, value)
+
+    if not is_postgres(config['SQLALCHEMY_DATABASE_URI']):
+        # SQLite and friends: Flask-SQLAlchemy picks a suitable pool
+        return {}
+
+    if config['DB_PGBOUNCER']:
+        return {'poolclass': NullPool}
+
+    return {
+        'poolclass': type('TimedQueuePool', (TimedQueuePool,),
+                          {'stats': stats}),
+        'pool_size': config['DB_POOL_SIZE'],
+        'max_overflow': config['DB_MAX_OVERFLOW'],
+        'pool_timeout': config['DB_POOL_TIMEOUT'],
+        'pool_recycle': config['DB_POOL_RECYCLE'],
+        'pool_pre_ping': config['DB_POOL_PRE_PING'],
+    }
+
+
+def watch_statement_timeout(app, engine):
+    """Apply DB_STATEMENT_TIMEOUT to `engine`'s transactions in requests."""
+
+    timeout = app.config['DB_STATEMENT_TIMEOUT']
+
+    if timeout and engine.dialect.name == 'postgresql':
+        @event.listens_for(engine, 'begin')
+        def set_statement_timeout(conn):
+            if has_request_context():
+                conn.execute(f"SET LOCAL statement_timeout = {int(timeout)}")
+
+
+def init_pool(app, engine, stats):
+    """Hook statement timeouts and pool metrics into `app`."""
+
+    watch_statement_timeout(app, engine)
+    app.extensions['pool_stats'] = stats
+
+    @app.after_request
+    def report_pool_wait(resp):
+        wait = g.get('pool_wait')
+
+        if wait is None or not app.config.get('QUERY_STATS'):
+            return resp
+
+        resp.headers['X-DB-Pool-Wait'] = f"{wait * 1000:.1f}ms"
+
+        if wait * 1000 > app.config['DB_POOL_WAIT_WARNING']:
+            app.logger.warning("waited %.1fms for a database connection; "
+                               "pool: %s", wait * 1000,
+                               stats.snapshot(engine.pool))
+        return resp
+
+    @app.route('/_status/pool')
+    def pool_status():
+        """This process's pool occupancy and wait times (QUERY_STATS only)."""
+
+        if not app.config.get('QUERY_STATS'):
+            abort(404)
+
+        return jsonify(stats.snapshot(engine.pool))
@@ -0,0 +1,127 @@
+"""Per-request SQL statement counting and N+1 detection.
+
+Opt in with `app.config['QUERY_STATS'] = True` (or QUERY_STATS=1 in the
+environment). Every request then gets X-Query-Count / X-Query-Time response
+headers and a log line, statements repeated QUERY_REPEAT_THRESHOLD times or
+more are logged as likely N+1s, and a request issuing more than QUERY_BUDGET
+statements is logged -- or, with QUERY_BUDGET_STRICT, raises
+QueryBudgetExceeded so tests fail loudly.
+"""
+
+import re
+import time
+from collections import Counter
+
+from flask import g, request, has_request_context
+from sqlalchemy import event
+
+DEFAULT_REPEAT_THRESHOLD = 5
+
+# Bound parameters, literals and IN lists vary between otherwise identical
+# statements; strip them so repeats share one fingerprint.
+_PARAMS = re.compile(r"%\(\w+\)s|\?|:\w+|'(?:[^']|'')*'|\b\d+\b")
+_IN_LISTS = re.compile(r"\bIN \((?:\s*\?\s*,?)+\)", re.IGNORECASE)
+_WHITESPACE = re.compile(r"\s+")
+
+
+class QueryBudgetExceeded(Exception):
+    """A request issued more SQL statements than QUERY_BUDGET allows."""
+
+
+class QueryStats:
+    """Statements issued while handling one request."""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.fingerprints = Counter()
+
+    def record(self, statement, duration):
+        self.count += 1
+        self.duration += duration
+        self.fingerprints[fingerprint(statement)] += 1
+
+    def repeated(self, threshold=DEFAULT_REPEAT_THRESHOLD):
+        """Fingerprints issued at least `threshold` times, most common first."""
+
+        return [(statement, n)
+                for statement, n in self.fingerprints.most_common()
+                if n >= threshold]
+
+
+def fingerprint(statement):
+    """Normalize a SQL statement so repeats with different values match."""
+
+    statement = _PARAMS.sub('?', statement)
+    statement = _IN_LISTS.sub('IN (?)', statement)
+    return _WHITESPACE.sub(' ', statement).strip()
+
+
+def current_stats():
+    """QueryStats for the current request, or None if not collecting."""
+
+    if has_request_context():
+        return g.get('query_stats')
+
+
+def watch_queries(engine):
+    """Count `engine`'s statements towards the current request's stats."""
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def start_timer(conn, cursor, statement, parameters, context, many):
+        if current_stats() is not None:
+            conn.info.setdefault('query_stats_start', []).append(
+                time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def stop_timer(conn, cursor, statement, parameters, context, many):
+        stats = current_stats()
+        starts = conn.info.get('query_stats_start')
+
+        if stats is not None and starts:
+            stats.record(statement, time.perf_counter() - starts.pop())
+
+
+def init_query_stats(app, engine):
+    """Hook statement counting into `engine` and `app`'s request cycle."""
+
+    app.config.setdefault('QUERY_STATS', False)
+    app.config.setdefault('QUERY_BUDGET', None)
+    app.config.setdefault('QUERY_BUDGET_STRICT', False)
+    app.config.setdefault('QUERY_REPEAT_THRESHOLD', DEFAULT_REPEAT_THRESHOLD)
+
+    watch_queries(engine)
+
+    @app.before_request
+    def start_query_stats():
+        if app.config['QUERY_STATS']:
+            g.query_stats = QueryStats()
+
+    @app.after_request
+    def report_query_stats(resp):
+        stats = current_stats()
+
+        if stats is None:
+            return resp
+
+        resp.headers['X-Query-Count'] = str(stats.count)
+        resp.headers['X-Query-Time'] = f"{stats.duration * 1000:.1f}ms"
+
+        app.logger.info("%s %s: %d queries in %.1fms",
+                        request.method, request.path,
+                        stats.count, stats.duration * 1000)
+
+        threshold = app.config['QUERY_REPEAT_THRESHOLD']
+        for statement, n in stats.repeated(threshold):
+            app.logger.warning("possible N+1 on %s: %d x %s",
+                               request.path, n, statement)
+
+        budget = app.config['QUERY_BUDGET']
+        if budget is not None and stats.count > budget:
+            message = (f"{request.method} {request.path} issued "
+                       f"{stats.count} queries (budget {budget})")
+            if app.config['QUERY_BUDGET_STRICT']:
+                raise QueryBudgetExceeded(message)
+            app.logger.warning(message)
+
+        return resp
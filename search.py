@@ -0,0 +1,511 @@
+"""Ranked user and message search.
+
+User search (/users) has two interchangeable backends:
+
+* TrigramUserSearch -- Postgres with pg_trgm. GIN trigram indexes on
+  username, bio and location (`flask create-search-indexes`) serve the
+  ILIKE '%q%' filters and similarity ranking without a table scan.
+* NgramUserSearch -- a pure-Python trigram inverted index held in memory,
+  for SQLite, test databases and Postgres without pg_trgm. It's built on
+  first use, kept current by the signup / profile / delete views, and
+  rebuilt after `max_age` seconds to pick up other processes' writes.
+
+Message search (/messages/search) likewise has:
+
+* TsvectorMessageSearch -- Postgres full-text search over a GIN index on
+  to_tsvector('english', text), which Postgres maintains itself.
+* InvertedMessageSearch -- a pure-Python inverted index for SQLite and
+  local testing, updated incrementally by the message add / delete views.
+
+`get_user_search()` / `get_message_search()` pick the backend for the
+connected database. `flask create-search-indexes` creates the indexes.
+"""
+
+import heapq
+import math
+import re
+import time
+from bisect import bisect_left, insort
+from collections import namedtuple, Counter
+from threading import Lock
+
+from flask import abort
+from sqlalchemy.dialects.postgresql import DOUBLE_PRECISION
+
+from models import db, User, Message
+from pagination import (Page, PER_PAGE, paginate_ranked, encode_rank_cursor,
+                        decode_rank_cursor)
+
+# Username matches count double when ranking.
+USERNAME_WEIGHT = 2.0
+
+# Like pg_trgm's similarity_threshold: usernames at least this similar to
+# the query match even without containing it (typos).
+SIMILARITY_THRESHOLD = 0.3
+
+TEXT_SEARCH_CONFIG = 'english'
+
+FULL_TEXT_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS ix_messages_text_fts "
+    f"ON messages USING gin (to_tsvector('{TEXT_SEARCH_CONFIG}', text))",
+]
+
+TRIGRAM_INDEXES = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS ix_users_username_trgm "
+    "ON users USING gin (username gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS ix_users_bio_trgm "
+    "ON users USING gin (bio gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS ix_users_location_trgm "
+    "ON users USING gin (location gin_trgm_ops)",
+]
+
+
+def escape_like(text):
+    """Escape LIKE wildcards in user input (use with escape='\\\\')."""
+
+    return (text.replace('\\', '\\\\')
+                .replace('%', '\\%')
+                .replace('_', '\\_'))
+
+
+def trigrams(text):
+    """Set of three-character substrings of lower-cased `text`."""
+
+    text = text.lower()
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def similarity(a, b):
+    """Share of trigrams two strings have in common (0 to 1)."""
+
+    a, b = trigrams(a), trigrams(b)
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+class TrigramUserSearch:
+    """User search using Postgres pg_trgm indexes."""
+
+    def search(self, query, limit, offset=0):
+        """Users matching `query`, best first."""
+
+        return self.matching(query).offset(offset).limit(limit).all()
+
+    def matching(self, query):
+        """Query for every user matching `query`, best first."""
+
+        pattern = f"%{escape_like(query)}%"
+        rank = db.func.greatest(
+            db.func.similarity(User.username, query) * USERNAME_WEIGHT,
+            db.func.similarity(User.location, query),
+            db.func.word_similarity(query, User.bio))
+
+        # pg_trgm's `%` (similar enough) operator, which the trigram index
+        # serves; doubled because psycopg2 treats a bare % as a placeholder.
+        return (User
+                .query
+                .filter(User.deleted_at.is_(None))
+                .filter(db.or_(User.username.ilike(pattern, escape='\\'),
+                               User.bio.ilike(pattern, escape='\\'),
+                               User.location.ilike(pattern, escape='\\'),
+                               User.username.op('%%')(query)))
+                .order_by(rank.desc(), User.id))
+
+    def autocomplete(self, prefix, limit):
+        """Users whose username starts with `prefix`, alphabetically."""
+
+        pattern = f"{escape_like(prefix)}%"
+
+        return (User
+                .query
+                .filter(User.username.ilike(pattern, escape='\\'),
+                        User.deleted_at.is_(None))
+                .order_by(User.username)
+                .limit(limit)
+                .all())
+
+    # The database indexes keep themselves current, and the queries skip
+    # deleted accounts.
+
+    def add(self, user):
+        pass
+
+    def remove(self, user_id):
+        pass
+
+
+SearchDoc = namedtuple('SearchDoc', ['username', 'bio', 'location'])
+
+
+class NgramUserSearch:
+    """User search over an in-memory trigram inverted index."""
+
+    def __init__(self, max_age=300, clock=time.monotonic):
+        self.max_age = max_age
+        self.clock = clock
+        self._lock = Lock()
+        self._built_at = None
+        self._docs = {}
+        self._postings = {}
+        self._usernames = []
+
+    def build(self):
+        """(Re)load every user from the database."""
+
+        rows = (db.session
+                .query(User.id, User.username, User.bio, User.location)
+                .filter(User.deleted_at.is_(None)))
+
+        with self._lock:
+            self._docs = {}
+            self._postings = {}
+            self._usernames = []
+
+            for id, username, bio, location in rows:
+                self._add(id, username, bio, location)
+
+            self._built_at = self.clock()
+
+    def _ensure_built(self):
+        if (self._built_at is None
+                or self.clock() - self._built_at > self.max_age):
+            self.build()
+
+    def add(self, user):
+        """Index `user`, replacing any earlier entry for the same id."""
+
+        if self._built_at is None:
+            return
+
+        with self._lock:
+            self._remove(user.id)
+            self._add(user.id, user.username, user.bio, user.location)
+
+    def remove(self, user_id):
+        with self._lock:
+            self._remove(user_id)
+
+    def _add(self, id, username, bio, location):
+        doc = SearchDoc(username.lower(),
+                        (bio or '').lower(),
+                        (location or '').lower())
+        self._docs[id] = doc
+
+        for field in doc:
+            for gram in trigrams(field):
+                self._postings.setdefault(gram, set()).add(id)
+
+        insort(self._usernames, (doc.username, id))
+
+    def _remove(self, id):
+        doc = self._docs.pop(id, None)
+
+        if doc is None:
+            return
+
+        for field in doc:
+            for gram in trigrams(field):
+                self._postings.get(gram, set()).discard(id)
+
+        self._usernames.remove((doc.username, id))
+
+    def _score(self, query, doc):
+        """Rank of `doc` for `query`, or None if it doesn't match."""
+
+        contains = any(query in field for field in doc)
+        username_similarity = similarity(query, doc.username)
+
+        if not contains and username_similarity < SIMILARITY_THRESHOLD:
+            return None
+
+        return max(username_similarity * USERNAME_WEIGHT,
+                   similarity(query, doc.location),
+                   similarity(query, doc.bio),
+                   # a bare substring hit still beats no overlap at all
+                   0.01 if contains else 0)
+
+    def search(self, query, limit, offset=0):
+        """Users matching `query`, best first."""
+
+        self._ensure_built()
+        query = query.lower()
+
+        with self._lock:
+            grams = trigrams(query)
+
+            if grams:
+                candidates = set().union(*(self._postings.get(gram, ())
+                                           for gram in grams))
+            else:
+                # too short to have trigrams; check every user
+                candidates = self._docs.keys()
+
+            scored = []
+            for id in candidates:
+                score = self._score(query, self._docs[id])
+                if score is not None:
+                    scored.append((-score, id))
+
+        ids = [id for _, id in sorted(scored)[offset:offset + limit]]
+        return self._load(ids)
+
+    def autocomplete(self, prefix, limit):
+        """Users whose username starts with `prefix`, alphabetically."""
+
+        self._ensure_built()
+        prefix = prefix.lower()
+
+        with self._lock:
+            start = bisect_left(self._usernames, (prefix,))
+            ids = []
+            for username, id in self._usernames[start:start + limit]:
+                if not username.startswith(prefix):
+                    break
+                ids.append(id)
+
+        return self._load(ids)
+
+    @staticmethod
+    def _load(ids):
+        """User rows for `ids`, in the same order."""
+
+        # other processes' indexes may still list a deleted account
+        users = {user.id: user
+                 for user in User.query.filter(User.id.in_(ids),
+                                               User.deleted_at.is_(None))
+                 } if ids else {}
+        return [users[id] for id in ids if id in users]
+
+
+def trigram_available():
+    """Is the connected database Postgres with pg_trgm installed?"""
+
+    if db.engine.dialect.name != 'postgresql':
+        return False
+
+    found = db.session.execute(
+        "SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'").first()
+    return found is not None
+
+
+def create_search_indexes():
+    """Create the full-text and (pg_trgm) trigram search indexes."""
+
+    for statement in FULL_TEXT_INDEXES + TRIGRAM_INDEXES:
+        db.session.execute(statement)
+
+
+class TsvectorMessageSearch:
+    """Message search using Postgres full-text search."""
+
+    def search(self, query, before=None, per_page=PER_PAGE):
+        """Page of messages matching every word of `query`, best first."""
+
+        document = db.func.to_tsvector(TEXT_SEARCH_CONFIG, Message.text)
+        terms = db.func.plainto_tsquery(TEXT_SEARCH_CONFIG, query)
+        # ts_rank is a float4; as float8 it survives the cursor's round
+        # trip exactly, so rows tied on rank aren't skipped between pages.
+        rank = db.cast(db.func.ts_rank(document, terms), DOUBLE_PRECISION)
+
+        return paginate_ranked(Message
+                               .query
+                               .join(User, User.id == Message.user_id)
+                               .filter(document.op('@@')(terms),
+                                       User.deleted_at.is_(None))
+                               .options(db.contains_eager(Message.user)),
+                               rank,
+                               Message.id,
+                               before=before,
+                               per_page=per_page)
+
+    # The GIN index keeps itself current, and the query skips deleted
+    # accounts' messages.
+
+    def add(self, message):
+        pass
+
+    def remove(self, message_id):
+        pass
+
+    def remove_author(self, user_id):
+        pass
+
+
+WORD = re.compile(r"\w+")
+
+STOP_WORDS = frozenset("""
+    a an and are as at be but by for from has have i in is it its of on or
+    so that the this to was we were will with you your
+""".split())
+
+
+def tokenize(text):
+    """Lower-cased words of `text`, minus stop words."""
+
+    return [word for word in WORD.findall(text.lower())
+            if word not in STOP_WORDS]
+
+
+class InvertedMessageSearch:
+    """Message search over an in-memory inverted index.
+
+    Postings map each word to {message id: occurrences}. A query matches
+    messages containing all of its words, ranked by tf-idf.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._built = False
+        self._postings = {}
+        self._lengths = {}
+        self._words = {}
+
+    def build(self, messages=None):
+        """(Re)index `messages`, or every message in the database."""
+
+        if messages is None:
+            messages = (db.session
+                        .query(Message.id, Message.text)
+                        .join(User, User.id == Message.user_id)
+                        .filter(User.deleted_at.is_(None)))
+
+        with self._lock:
+            self._postings = {}
+            self._lengths = {}
+            self._words = {}
+
+            for message in messages:
+                self._add(message.id, message.text)
+
+            self._built = True
+
+    def add(self, message):
+        if not self._built:
+            return
+
+        with self._lock:
+            self._remove(message.id)
+            self._add(message.id, message.text)
+
+    def remove(self, message_id):
+        with self._lock:
+            self._remove(message_id)
+
+    def remove_author(self, user_id):
+        """Drop every message by `user_id` (their account was deleted)."""
+
+        if not self._built:
+            return
+
+        ids = [id for (id,) in (db.session
+                                .query(Message.id)
+                                .filter(Message.user_id == user_id))]
+
+        with self._lock:
+            for id in ids:
+                self._remove(id)
+
+    def _add(self, id, text):
+        counts = Counter(tokenize(text))
+        self._lengths[id] = sum(counts.values()) or 1
+        self._words[id] = list(counts)
+
+        for word, count in counts.items():
+            self._postings.setdefault(word, {})[id] = count
+
+    def _remove(self, id):
+        self._lengths.pop(id, None)
+
+        for word in self._words.pop(id, ()):
+            self._postings[word].pop(id, None)
+
+    def rank(self, query):
+        """[(rank, message id)] for every message matching `query`."""
+
+        if not self._built:
+            self.build()
+
+        words = set(tokenize(query))
+
+        with self._lock:
+            postings = [self._postings.get(word, {}) for word in words]
+
+            if not postings or not all(postings):
+                return []
+
+            total = len(self._lengths)
+            postings.sort(key=len)
+            ids = set(postings[0]).intersection(*postings[1:])
+
+            return [(sum(hits[id] / self._lengths[id]
+                         * math.log(1 + total / len(hits))
+                         for hits in postings), id)
+                    for id in ids]
+
+    def ranked_page(self, query, before=None, per_page=PER_PAGE):
+        """One page of (rank, message id) best first, plus the next cursor."""
+
+        ranked = self.rank(query)
+
+        if before:
+            try:
+                before_key = decode_rank_cursor(before)
+            except ValueError:
+                abort(400)
+
+            ranked = [key for key in ranked if key < before_key]
+
+        page = heapq.nlargest(per_page + 1, ranked)
+        cursor = (encode_rank_cursor(*page[per_page - 1])
+                  if len(page) > per_page else None)
+
+        return page[:per_page], cursor
+
+    def search(self, query, before=None, per_page=PER_PAGE):
+        """Page of messages matching every word of `query`, best first."""
+
+        keys, cursor = self.ranked_page(query, before, per_page)
+        ids = [id for _, id in keys]
+
+        # other processes' indexes may still list a deleted account's
+        messages = {msg.id: msg
+                    for msg in (Message
+                                .query
+                                .join(User, User.id == Message.user_id)
+                                .filter(Message.id.in_(ids),
+                                        User.deleted_at.is_(None))
+                                .options(db.contains_eager(Message.user)))}
+
+        return Page([messages[id] for id in ids if id in messages],
+                    before=cursor)
+
+
+_user_search = None
+_message_search = None
+
+
+def get_user_search():
+    """The user search backend for this process, chosen on first use."""
+
+    global _user_search
+
+    if _user_search is None:
+        _user_search = (TrigramUserSearch() if trigram_available()
+                        else NgramUserSearch())
+
+    return _user_search
+
+
+def get_message_search():
+    """The message search backend for this process, chosen on first use."""
+
+    global _message_search
+
+    if _message_search is None:
+        _message_search = (TsvectorMessageSearch()
+                           if db.engine.dialect.name == 'postgresql'
+                           else InvertedMessageSearch())
+
+    return _message_search
@@ -1,20 +1,38 @@
-"""Seed database with sample data from CSV Files."""
+"""Seed database with sample data from CSV Files.
+
+    python seed.py [--dir generator] [--chunk-size 50000]
+
+Drops and recreates every table, streams the CSVs in (see bulkload.py),
+then builds the timelines and counters.
+"""
+
+import argparse
+import time
 
-from csv import DictReader
 from app import db
-from models import User, Message, FollowersFollowee
+from bulkload import load_all, DEFAULT_CHUNK_SIZE
+from models import Timeline, repair_counters
+
+
+def seed(directory='generator', chunk_size=DEFAULT_CHUNK_SIZE):
+    db.drop_all()
+    db.create_all()
 
+    load_all(directory, chunk_size)
 
-db.drop_all()
-db.create_all()
+    for step in (Timeline.rebuild, repair_counters):
+        start = time.perf_counter()
+        step()
+        print(f"{step.__name__} in {time.perf_counter() - start:.1f}s")
 
-with open('generator/users.csv') as users:
-    db.session.bulk_insert_mappings(User, DictReader(users))
+    db.session.commit()
 
-with open('generator/messages.csv') as messages:
-    db.session.bulk_insert_mappings(Message, DictReader(messages))
 
-with open('generator/follows.csv') as follows:
-    db.session.bulk_insert_mappings(FollowersFollowee, DictReader(follows))
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--dir', default='generator',
+                        help="directory holding users.csv, messages.csv, ...")
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+    args = parser.parse_args()
 
-db.session.commit()
+    seed(args.dir, args.chunk_size)
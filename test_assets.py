@@ -0,0 +1,114 @@
+"""Static asset pipeline tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_assets.py
+
+
+import gzip
+import os
+import tempfile
+from unittest import TestCase
+
+from assets import AssetManifest, IMMUTABLE
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, assets
+
+
+class AssetManifestTestCase(TestCase):
+    """Tests fingerprinting a static folder."""
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+
+        os.makedirs(os.path.join(self.folder.name, 'images'))
+        self.write('images/bg.png', b'\x89PNG fake image')
+        self.write('site.css',
+                   b'body { background: url("/static/images/bg.png"); }\n'
+                   + b'p { color: black; }\n' * 50)
+
+        self.manifest = AssetManifest()
+        self.manifest.build(self.folder.name)
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def write(self, filename, body):
+        with open(os.path.join(self.folder.name, filename), 'wb') as f:
+            f.write(body)
+
+    def test_hashed_names(self):
+        """do files get stable, content-hashed names?"""
+
+        hashed = self.manifest.urls['images/bg.png']
+
+        self.assertRegex(hashed, r'^images/bg\.[0-9a-f]{12}\.png$')
+        self.assertEqual(hashed, AssetManifest.hashed_name(
+            'images/bg.png', b'\x89PNG fake image'))
+
+    def test_css_urls_rewritten(self):
+        """do stylesheet url()s point at hashed files?"""
+
+        css = self.manifest.assets[self.manifest.urls['site.css']].body
+
+        self.assertIn(f'/assets/{self.manifest.urls["images/bg.png"]}'.encode(),
+                      css)
+        self.assertNotIn(b'/static/', css)
+
+    def test_css_hash_follows_images(self):
+        """does changing an image change the hash of CSS that uses it?"""
+
+        before = self.manifest.urls['site.css']
+
+        self.write('images/bg.png', b'\x89PNG another image')
+        self.manifest.build(self.folder.name)
+
+        self.assertNotEqual(self.manifest.urls['site.css'], before)
+
+    def test_precompressed(self):
+        """are compressible files gzipped, and tiny or binary ones not?"""
+
+        css = self.manifest.assets[self.manifest.urls['site.css']]
+        png = self.manifest.assets[self.manifest.urls['images/bg.png']]
+
+        self.assertEqual(gzip.decompress(css.encodings['gzip']), css.body)
+        self.assertEqual(png.encodings, {})
+
+
+class AssetViewTestCase(TestCase):
+    """Tests serving assets and caching headers."""
+
+    def setUp(self):
+        self.client = app.test_client()
+
+    def test_serves_immutable_asset(self):
+        """is a hashed asset served with year-long immutable caching?"""
+
+        with app.test_request_context():
+            url = assets.static_url('stylesheets/style.css')
+
+        resp = self.client.get(url, headers={'Accept-Encoding': 'gzip'})
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.headers['Cache-Control'], IMMUTABLE)
+        self.assertEqual(resp.headers['Content-Encoding'], 'gzip')
+        self.assertIn(b'/assets/images/',
+                      gzip.decompress(resp.get_data()))
+
+    def test_unknown_asset(self):
+        """is an unknown hashed name a 404?"""
+
+        resp = self.client.get('/assets/stylesheets/style.nope.css')
+
+        self.assertEqual(resp.status_code, 404)
+
+    def test_base_template_links_hashed_assets(self):
+        """does the layout link fingerprinted assets?"""
+
+        resp = self.client.get('/login')
+        html = resp.get_data(as_text=True)
+
+        self.assertRegex(html, r'/assets/stylesheets/style\.[0-9a-f]{12}\.css')
+        self.assertEqual(resp.headers['Cache-Control'], 'no-cache')
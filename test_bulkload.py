@@ -0,0 +1,86 @@
+"""Bulk loader tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_bulkload.py
+
+
+import io
+import os
+from unittest import TestCase
+
+from models import db, User, Message, FollowersFollowee
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app
+from bulkload import BulkLoader
+
+db.create_all()
+
+USERS_CSV = """\
+email,username,image_url,password,bio,header_image_url,location
+a@test.com,alpha,/a.png,HASHED,"Hi, I'm alpha",/h.png,Oakland
+b@test.com,beta,/b.png,HASHED,"Two
+lines",/h.png,Berkeley
+c@test.com,gamma,/c.png,HASHED,,/h.png,
+"""
+
+
+class BulkLoaderTestCase(TestCase):
+    """Tests streaming CSVs into tables."""
+
+    def setUp(self):
+        User.query.delete()
+        Message.query.delete()
+        FollowersFollowee.query.delete()
+        db.session.commit()
+
+        self.reports = []
+        self.loader = BulkLoader(db.session.connection(), chunk_size=2,
+                                 report=self.reports.append)
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def test_load_in_chunks(self):
+        """are all rows loaded, a chunk at a time, with progress reports?"""
+
+        total = self.loader.load(User.__table__, io.StringIO(USERS_CSV))
+        db.session.commit()
+
+        self.assertEqual(total, 3)
+        self.assertEqual(len(self.reports), 2)
+        self.assertIn("rows/sec", self.reports[-1])
+
+        beta = User.query.filter_by(username="beta").one()
+        self.assertEqual(beta.bio, "Two\nlines")
+        self.assertEqual(beta.time_zone, "GMT-0")
+        self.assertEqual(beta.message_count, 0)
+
+    def test_reset_sequences(self):
+        """do new rows get ids past the loaded ones?"""
+
+        csv = "id,email,username,password\n50000,z@test.com,zed,HASHED\n"
+
+        self.loader.load(User.__table__, io.StringIO(csv))
+        self.loader.reset_sequences([User.__table__])
+
+        user = User(email="new@test.com", username="new", password="HASHED")
+        db.session.add(user)
+        db.session.commit()
+
+        self.assertGreater(user.id, 50000)
+
+    def test_defer_indexes(self):
+        """are secondary indexes dropped during the load and rebuilt after?"""
+
+        def index_names():
+            return {name for name, in db.session.execute(
+                "SELECT indexname FROM pg_indexes WHERE tablename = 'messages'")}
+
+        restore = self.loader.defer_indexes([Message.__table__])
+        self.assertNotIn('ix_messages_user_timestamp', index_names())
+
+        restore()
+        self.assertIn('ix_messages_user_timestamp', index_names())
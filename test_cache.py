@@ -0,0 +1,71 @@
+"""Cache tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_cache.py
+
+
+from unittest import TestCase
+
+from cache import LRUCache
+
+
+class FakeClock:
+    """Clock the tests can move forward by hand."""
+
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class LRUCacheTestCase(TestCase):
+    """Tests the in-process LRU cache."""
+
+    def test_get_and_set(self):
+        """does a cached value come back, and a missing one give the default?"""
+
+        cache = LRUCache()
+        cache.set(1, 'one')
+
+        self.assertEqual(cache.get(1), 'one')
+        self.assertEqual(cache.get(2, 'missing'), 'missing')
+
+    def test_evicts_least_recently_used(self):
+        """is the entry touched longest ago evicted first?"""
+
+        cache = LRUCache(maxsize=2)
+        cache.set(1, 'one')
+        cache.set(2, 'two')
+        cache.get(1)
+        cache.set(3, 'three')
+
+        self.assertEqual(cache.get(1), 'one')
+        self.assertIsNone(cache.get(2))
+        self.assertEqual(len(cache), 2)
+
+    def test_ttl(self):
+        """do entries expire after ttl seconds?"""
+
+        clock = FakeClock()
+        cache = LRUCache(ttl=10, clock=clock)
+        cache.set(1, 'one')
+
+        clock.now = 9
+        self.assertEqual(cache.get(1), 'one')
+
+        clock.now = 10
+        self.assertIsNone(cache.get(1))
+
+    def test_delete(self):
+        """does delete drop just that key?"""
+
+        cache = LRUCache()
+        cache.set(1, 'one')
+        cache.set(2, 'two')
+        cache.delete(1)
+        cache.delete(3)
+
+        self.assertIsNone(cache.get(1))
+        self.assertEqual(cache.get(2), 'two')
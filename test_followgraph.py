@@ -0,0 +1,80 @@
+"""Follow graph cache tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_followgraph.py
+
+
+from array import array
+from unittest import TestCase
+
+from followgraph import FollowGraph, contains
+
+
+class FollowGraphTestCase(TestCase):
+    """Tests cached followee arrays and membership checks."""
+
+    def setUp(self):
+        self.follows = {1: [2, 5, 9], 2: []}
+        self.loads = []
+
+        def load(user_id):
+            self.loads.append(user_id)
+            return self.follows.get(user_id, [])
+
+        self.load = load
+        self.graph = FollowGraph(load)
+
+    def test_contains(self):
+        """does binary search find exactly the ids present?"""
+
+        ids = array('i', [2, 5, 9])
+
+        self.assertEqual([id for id in range(11) if contains(ids, id)],
+                         [2, 5, 9])
+        self.assertFalse(contains(array('i'), 1))
+
+    def test_is_following_caches(self):
+        """is each user's array loaded once and then reused?"""
+
+        self.assertTrue(self.graph.is_following(1, 5))
+        self.assertFalse(self.graph.is_following(1, 6))
+        self.assertFalse(self.graph.is_following(2, 1))
+
+        self.assertEqual(self.loads, [1, 2])
+        self.assertEqual(self.graph.following(1).typecode, 'i')
+
+    def test_invalidate(self):
+        """does invalidating reload the user's followees?"""
+
+        self.graph.is_following(1, 6)
+        self.follows[1] = [2, 5, 6, 9]
+        self.graph.invalidate(1)
+
+        self.assertTrue(self.graph.is_following(1, 6))
+        self.assertEqual(self.loads, [1, 1])
+
+    def test_shared_cache(self):
+        """do processes share arrays, as bytes, and their invalidation?"""
+
+        shared = {}
+
+        class Shared:
+            get = shared.get
+            set = shared.__setitem__
+
+            def delete(self, key):
+                shared.pop(key, None)
+
+        one = FollowGraph(self.load, shared=Shared())
+        other = FollowGraph(self.load, shared=Shared())
+
+        one.is_following(1, 5)
+
+        self.assertIsInstance(shared[FollowGraph.key(1)], bytes)
+        self.assertTrue(other.is_following(1, 9))
+        self.assertEqual(self.loads, [1])
+
+        one.invalidate(1)
+
+        self.assertNotIn(FollowGraph.key(1), shared)
@@ -0,0 +1,93 @@
+"""Message fragment cache tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_fragments.py
+
+
+import os
+from datetime import datetime
+from unittest import TestCase
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app
+from cache import LRUCache
+from fragments import FragmentCache
+from models import User, Message
+
+
+class FragmentCacheTestCase(TestCase):
+    """Tests caching of rendered feed messages."""
+
+    def setUp(self):
+        """Make an unsaved message and author to render."""
+
+        self.author = User(id=10000,
+                           username="testuser",
+                           image_url="/static/images/default-pic.png",
+                           updated_at=datetime(2019, 1, 1))
+        self.msg = Message(id=10000, text="Hello", user=self.author)
+
+        self.fragments = FragmentCache()
+        self.context = app.test_request_context()
+        self.context.push()
+
+    def tearDown(self):
+        self.context.pop()
+
+    def test_render_fills_viewer_parts(self):
+        """are the time and like form filled into the cached fragment?"""
+
+        html = self.fragments.render(self.msg, "01 January 2019 <noon>",
+                                     "<form>like</form>")
+
+        self.assertIn("@testuser", html)
+        self.assertIn("Hello", html)
+        self.assertIn("01 January 2019 &lt;noon&gt;", html)
+        self.assertIn("<form>like</form>", html)
+
+    def test_fragment_is_reused(self):
+        """is a second render served from the cache?"""
+
+        self.fragments.render(self.msg, "now")
+        self.msg.text = "Changed behind the cache's back"
+
+        self.assertIn("Hello", self.fragments.render(self.msg, "now"))
+
+    def test_profile_edit_changes_key(self):
+        """does bumping the author's updated_at re-render the fragment?"""
+
+        self.fragments.render(self.msg, "now")
+        self.author.username = "renamed"
+        self.author.updated_at = datetime(2019, 1, 2)
+
+        self.assertIn("@renamed", self.fragments.render(self.msg, "now"))
+
+    def test_invalidate(self):
+        """does invalidate drop the cached render?"""
+
+        self.fragments.render(self.msg, "now")
+        self.fragments.invalidate(self.msg)
+        self.msg.text = "Re-rendered"
+
+        self.assertIn("Re-rendered", self.fragments.render(self.msg, "now"))
+
+    def test_shared_backend(self):
+        """can one process's render be reused by another through `shared`?"""
+
+        shared = LRUCache()
+        FragmentCache(shared=shared).render(self.msg, "now")
+        self.msg.text = "Not rendered again"
+
+        other = FragmentCache(shared=shared)
+
+        self.assertIn("Hello", other.render(self.msg, "now"))
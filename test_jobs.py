@@ -0,0 +1,191 @@
+"""Background job tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_jobs.py
+
+
+import os
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+from models import (db, User, Message, FollowersFollowee, Like, Timeline, Job,
+                    repair_counters, follow_graph)
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY, user_cache
+import jobs
+from jobs import enqueue, handler, run_next, work
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+calls = []
+
+
+@handler('test_flaky')
+def flaky(fail):
+    calls.append(fail)
+    if fail:
+        raise ValueError("boom")
+
+
+class JobQueueTestCase(TestCase):
+    """Tests queueing, running and retrying jobs."""
+
+    def setUp(self):
+        Job.query.delete()
+        db.session.commit()
+        calls.clear()
+
+        self.ctx = app.app_context()
+        self.ctx.push()
+
+    def tearDown(self):
+        db.session.rollback()
+        self.ctx.pop()
+
+    def test_run_and_delete(self):
+        """are due jobs run once, and removed when they succeed?"""
+
+        enqueue('test_flaky', fail=False)
+        enqueue('test_flaky', fail=False, delay=60)
+        db.session.commit()
+
+        self.assertEqual(work(burst=True), 1)
+        self.assertEqual(calls, [False])
+        self.assertEqual(Job.query.count(), 1)
+
+    def test_unknown_kind(self):
+        """is queueing a job nothing handles an error?"""
+
+        with self.assertRaises(ValueError):
+            enqueue('no_such_job')
+
+    def test_retry_with_backoff(self):
+        """is a failing job rescheduled, later each time, then given up?"""
+
+        app.config['JOB_MAX_ATTEMPTS'] = 3
+        job = enqueue('test_flaky', fail=True)
+        db.session.commit()
+        job_id = job.id
+
+        delays = []
+        try:
+            for _ in range(3):
+                started = datetime.utcnow()
+                run_next()
+                job = Job.query.get(job_id)
+                delays.append(job.run_at - started)
+                job.run_at = started
+                db.session.commit()
+        finally:
+            del app.config['JOB_MAX_ATTEMPTS']
+
+        job = Job.query.get(job_id)
+
+        self.assertEqual(len(calls), 3)
+        self.assertEqual(job.status, 'failed')
+        self.assertEqual(job.attempts, 3)
+        self.assertIn("ValueError: boom", job.last_error)
+        self.assertGreaterEqual(delays[1], delays[0])
+        self.assertGreaterEqual(delays[0],
+                                timedelta(seconds=jobs.BACKOFF / 2))
+        self.assertIsNone(run_next())
+
+
+class AccountJobsTestCase(TestCase):
+    """Tests account deletion and fan-out, a batch at a time."""
+
+    def setUp(self):
+        User.query.delete()
+        Message.query.delete()
+        Job.query.delete()
+        db.session.commit()
+        user_cache.clear()
+        follow_graph.clear()
+
+        users = [User(id=i, username=f"user{i}", email=f"user{i}@test.com",
+                      password="HASHED")
+                 for i in range(1, 6)]
+        db.session.add_all(users)
+        db.session.flush()
+
+        # users 2-5 follow user 1, who follows them back and likes their
+        # messages; they like user 1's messages
+        for i in range(2, 6):
+            db.session.add_all([
+                FollowersFollowee(followee_id=i, follower_id=1),
+                FollowersFollowee(followee_id=1, follower_id=i),
+                Message(id=i, text=f"message {i}", user_id=i),
+                Message(id=10 + i, text=f"own message {i}", user_id=1),
+            ])
+        db.session.flush()
+        for i in range(2, 6):
+            db.session.add_all([Like(user_id=1, message_id=i),
+                                Like(user_id=i, message_id=10 + i)])
+        db.session.commit()
+        repair_counters()
+        db.session.commit()
+
+        app.config['JOB_BATCH_SIZE'] = 2
+        self.client = app.test_client()
+
+    def tearDown(self):
+        db.session.rollback()
+        del app.config['JOB_BATCH_SIZE']
+
+    def test_delete_account(self):
+        """is a deleted account hidden at once and purged by the worker?"""
+
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = 1
+
+        # user 1's four messages are on each follower's timeline
+        for i in range(2, 6):
+            Timeline.backfill(i, 1)
+        db.session.commit()
+
+        self.client.post('/users/delete')
+
+        self.assertIsNotNone(User.query.get(1).deleted_at)
+        self.assertEqual(self.client.get('/users/1').status_code, 404)
+        self.assertFalse(User.authenticate("user1", "HASHED"))
+
+        with app.app_context():
+            runs = work(burst=True)
+
+        # retract counters, eight batches of followers' timeline entries,
+        # two batches each of likes, follows either way and messages, then
+        # the user
+        self.assertEqual(runs, 1 + 8 + 2 * 4 + 1)
+        self.assertEqual(Timeline.query.count(), 0)
+        self.assertIsNone(User.query.get(1))
+        self.assertEqual(Message.query.count(), 4)
+        self.assertEqual(FollowersFollowee.query.count(), 0)
+        self.assertEqual(Like.query.count(), 0)
+        self.assertEqual(User.query.get(2).follower_count, 0)
+        self.assertEqual(User.query.get(2).likes_count, 0)
+        self.assertEqual(Message.query.get(2).like_count, 0)
+
+    def test_fan_out_in_batches(self):
+        """does fan-out reach every follower, skipping ones that have it?"""
+
+        message = Message(id=100, text="news", user_id=1)
+        db.session.add(message)
+        db.session.flush()
+        Timeline.post(message)
+        Timeline.backfill(3, 1)
+        enqueue('fan_out', message_id=100)
+        db.session.commit()
+
+        with app.app_context():
+            runs = work(burst=True)
+
+        timeline_users = {entry.user_id for entry
+                          in Timeline.query.filter_by(message_id=100)}
+
+        self.assertEqual(runs, 3)
+        self.assertEqual(timeline_users, {1, 2, 3, 4, 5})
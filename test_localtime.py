@@ -0,0 +1,54 @@
+"""Timestamp localization tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_localtime.py
+
+
+from datetime import datetime
+from unittest import TestCase
+
+from localtime import localize, get_zone
+
+
+class FakeMessage:
+    """Just enough of a Message to localize."""
+
+    def __init__(self, timestamp):
+        self.timestamp = timestamp
+
+
+class LocalizeTestCase(TestCase):
+    """Tests converting message timestamps to a viewer's zone."""
+
+    def setUp(self):
+        self.msg = FakeMessage(datetime(2019, 7, 1, 18, 30))
+
+    def test_no_zone_is_utc(self):
+        """without a zone, are timestamps shown as UTC?"""
+
+        self.assertEqual(localize([self.msg]),
+                         [(self.msg, '01 July 2019 06:30 PM')])
+
+    def test_fixed_offset_zone(self):
+        """are fixed-offset zones converted by their offset?"""
+
+        # Etc/GMT-10 is ten hours *ahead* of UTC
+        self.assertEqual(localize([self.msg], 'Etc/GMT-10'),
+                         [(self.msg, '02 July 2019 04:30 AM')])
+        self.assertIsNotNone(get_zone('Etc/GMT-10')[1])
+
+    def test_dst_zone(self):
+        """are zones with daylight saving converted per timestamp?"""
+
+        winter = FakeMessage(datetime(2019, 1, 1, 18, 30))
+
+        self.assertEqual(localize([self.msg, winter], 'America/New_York'),
+                         [(self.msg, '01 July 2019 02:30 PM'),
+                          (winter, '01 January 2019 01:30 PM')])
+
+    def test_unknown_zone_is_utc(self):
+        """do unknown zone names fall back to UTC?"""
+
+        self.assertEqual(localize([self.msg], 'Nowhere/Special'),
+                         [(self.msg, '01 July 2019 06:30 PM')])
@@ -6,9 +6,10 @@
 
 
 import os
+from datetime import datetime
 from unittest import TestCase
 
-from models import db, User, Message, FollowersFollowee
+from models import db, User, Message, FollowersFollowee, Timeline
 
 # BEFORE we import our app, let's set an environmental variable
 # to use a different database for tests (we need to do this
@@ -150,4 +151,64 @@ class MessageModelTestCase(TestCase):
         self.assertIn(u, message.liked_by)
         self.assertNotIn(u1, message.liked_by)
 
+    def test_timeline_rebuild(self):
+        """checks rebuilt timelines hold own and followed users' messages"""
 
+        u = User(
+            email="test@test.com",
+            username="testuser",
+            password="HASHED_PASSWORD",
+            id=10000
+        )
+
+        u1 = User(
+            email="test1@test.com",
+            username="testuser1",
+            password="HASHED_PASSWORD",
+            id=10001
+        )
+
+        db.session.add_all([u, u1])
+        u.following.append(u1)
+
+        own = Message(text="own", user_id=10000)
+        followed = Message(text="followed", user_id=10001)
+
+        db.session.add_all([own, followed])
+        db.session.commit()
+
+        Timeline.rebuild()
+        db.session.commit()
+
+        self.assertEqual(Timeline.feed_for(10000).all(), [followed, own])
+        self.assertEqual(Timeline.feed_for(10001).all(), [followed])
+    def test_timeline_backfill_keeps_newest(self):
+        """checks following copies only the newest BACKFILL messages"""
+
+        db.session.add_all([
+            User(email="test@test.com", username="testuser",
+                 password="HASHED_PASSWORD", id=10000),
+            User(email="test1@test.com", username="testuser1",
+                 password="HASHED_PASSWORD", id=10001),
+        ])
+        db.session.flush()
+        db.session.add_all(Message(text=f"message {i}", user_id=10001,
+                                   timestamp=datetime(2026, 1, 1, i))
+                           for i in range(5))
+        db.session.add(FollowersFollowee(followee_id=10000,
+                                         follower_id=10001))
+        db.session.commit()
+
+        def texts():
+            return [m.text for m in Timeline.feed_for(10000)]
+
+        backfill = Timeline.BACKFILL
+        Timeline.BACKFILL = 2
+        try:
+            Timeline.backfill(10000, 10001)
+            self.assertEqual(texts(), ["message 4", "message 3"])
+
+            Timeline.rebuild()
+            self.assertEqual(texts(), ["message 4", "message 3"])
+        finally:
+            Timeline.BACKFILL = backfill
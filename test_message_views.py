@@ -8,7 +8,8 @@
 import os
 from unittest import TestCase
 
-from models import db, connect_db, Message, User, Like
+from models import (db, connect_db, Message, User, Like, Timeline, Job,
+                    repair_counters, follow_graph)
 
 # BEFORE we import our app, let's set an environmental variable
 # to use a different database for tests (we need to do this
@@ -20,7 +21,8 @@ os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
 
 # Now we can import app
 
-from app import app, CURR_USER_KEY
+from app import app, CURR_USER_KEY, user_cache
+from jobs import work
 
 # Create our tables (we do this here, so we only create the tables
 # once for all tests --- in each test, we'll delete the data
@@ -32,6 +34,12 @@ db.create_all()
 
 app.config['WTF_CSRF_ENABLED'] = False
 
+# Count SQL statements per request and fail any view that blows the budget
+
+app.config['QUERY_STATS'] = True
+app.config['QUERY_BUDGET'] = 20
+app.config['QUERY_BUDGET_STRICT'] = True
+
 
 class MessageViewTestCase(TestCase):
     """Test views for messages."""
@@ -41,6 +49,9 @@ class MessageViewTestCase(TestCase):
 
         User.query.delete()
         Message.query.delete()
+        Job.query.delete()
+        user_cache.clear()
+        follow_graph.clear()
 
         self.client = app.test_client()
 
@@ -75,6 +86,30 @@ class MessageViewTestCase(TestCase):
             msg = Message.query.one()
             self.assertEqual(msg.text, "Hello")
 
+    def test_add_message_fans_out_to_followers(self):
+        """Is a new message added to the author's and followers' timelines?"""
+
+        follower = User(username="follower",
+                        email="follower@test.com",
+                        password="testuser",
+                        id=10000)
+
+        db.session.add(follower)
+        follower.following.append(self.testuser)
+        db.session.commit()
+
+        self.client.post("/login", data={"username": "testuser",
+                                         "password": "testuser"})
+        self.client.post("/messages/new", data={"text": "Hello"})
+        with app.app_context():
+            work(burst=True)
+
+        msg = Message.query.one()
+        timeline_users = {entry.user_id for entry
+                          in Timeline.query.filter_by(message_id=msg.id)}
+
+        self.assertEqual(timeline_users, {10000, msg.user_id})
+
     def test_unauthorized_new_message_when_logged_out(self):
         """trying to create new message when logged out should redirect to homepage"""
 
@@ -168,6 +203,194 @@ class MessageViewTestCase(TestCase):
 
     
 
+    def test_message_and_like_counters(self):
+        """do posting, liking and deleting keep the counters in step?"""
 
+        u = User(username="other_user",
+                 email="other_user@test.com",
+                 password="testuser",
+                 id=10000)
+
+        db.session.add(u)
+        db.session.commit()
+
+        self.client.post("/login", data={"username": "testuser",
+                                         "password": "testuser"})
+        self.client.post("/messages/new", data={"text": "Hello"})
+
+        msg = Message.query.one()
+        msg_id, author_id = msg.id, msg.user_id
+
+        self.assertEqual(msg.user.message_count, 1)
+
+        liker = User.query.get(10000)
+        liker.liked_messages.append(msg)
+        db.session.commit()
+        repair_counters()
+        db.session.commit()
+
+        self.assertEqual(Message.query.get(msg_id).like_count, 1)
+
+        self.client.post(f"/messages/{msg_id}/delete")
+
+        self.assertEqual(User.query.get(author_id).message_count, 0)
+        self.assertEqual(User.query.get(10000).likes_count, 0)
+
+    def test_toggle_like_counters(self):
+        """does toggling a like move both counters up and back down?"""
+
+        u = User(username="other_user",
+                 email="other_user@test.com",
+                 password="testuser",
+                 id=10000)
+
+        message = Message(text="text",
+                          user_id=10000,
+                          id=10000)
+
+        db.session.add_all([u, message])
+        db.session.commit()
+
+        self.client.post("/login", data={"username": "testuser",
+                                         "password": "testuser"})
+
+        data = {"message_id": 10000, "return_url": "/"}
+        self.client.post("/toggle_like_status", data=data)
+
+        liker = User.query.filter(User.username == "testuser").first()
+
+        self.assertEqual(liker.likes_count, 1)
+        self.assertEqual(Message.query.get(10000).like_count, 1)
+
+        self.client.post("/toggle_like_status", data=data)
+
+        liker = User.query.filter(User.username == "testuser").first()
+
+        self.assertEqual(liker.likes_count, 0)
+        self.assertEqual(Message.query.get(10000).like_count, 0)
+
+    def test_like_and_unlike_are_idempotent(self):
+        """do repeated likes and unlikes leave one like and right counts?"""
+
+        user_id = self.testuser.id
+        db.session.add_all([
+            User(username="other_user", email="other_user@test.com",
+                 password="testuser", id=10000),
+            Message(text="text", user_id=10000, id=10000),
+        ])
+        db.session.commit()
+
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+
+        for _ in range(2):
+            resp = self.client.post("/messages/10000/like",
+                                    data={"return_url": "/"})
+            self.assertEqual(resp.status_code, 302)
+
+        self.assertEqual(Like.query.filter_by(message_id=10000).count(), 1)
+        self.assertEqual(Message.query.get(10000).like_count, 1)
+        self.assertEqual(User.query.get(user_id).likes_count, 1)
+
+        for _ in range(2):
+            resp = self.client.post("/messages/10000/unlike",
+                                    headers={"Accept": "application/json"})
+            self.assertEqual(resp.json, {"message_id": 10000,
+                                         "liked": False,
+                                         "like_count": 0})
+
+        self.assertEqual(Like.query.count(), 0)
+        self.assertEqual(User.query.get(user_id).likes_count, 0)
+
+    def test_like_missing_message(self):
+        """is liking a message that doesn't exist a 404, also as JSON?"""
+
+        user_id = self.testuser.id
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+
+        for path in ("/messages/99999/like", "/messages/99999/unlike"):
+            resp = self.client.post(path,
+                                    headers={"Accept": "application/json"})
+            self.assertEqual(resp.status_code, 404)
+
+        resp = self.client.post("/messages/99999/like",
+                                data={"return_url": "/"})
+        self.assertEqual(resp.status_code, 404)
+        self.assertEqual(Like.query.count(), 0)
+
+    def test_toggle_like_status(self):
+        """does the old toggle flip the like, and reject bad ids?"""
+
+        user_id = self.testuser.id
+        db.session.add_all([
+            User(username="other_user", email="other_user@test.com",
+                 password="testuser", id=10000),
+            Message(text="text", user_id=10000, id=10000),
+        ])
+        db.session.commit()
+
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+
+        states = [self.client.post("/toggle_like_status",
+                                   data={"message_id": "10000"},
+                                   headers={"Accept": "application/json"})
+                  .json["liked"]
+                  for _ in range(3)]
+
+        self.assertEqual(states, [True, False, True])
+        self.assertEqual(Message.query.get(10000).like_count, 1)
+        self.assertEqual(User.query.get(user_id).likes_count, 1)
+
+        for data in ({"message_id": "abc"}, {}):
+            resp = self.client.post("/toggle_like_status",
+                                    data=dict(data, return_url="/"))
+            self.assertEqual(resp.status_code, 400)
+
+        resp = self.client.post("/toggle_like_status",
+                                data={"message_id": "99999",
+                                      "return_url": "/"})
+        self.assertEqual(resp.status_code, 404)
+
+    def test_search_messages(self):
+        """does /messages/search find matching messages, best first?"""
+
+        db.session.add_all([
+            Message(text="Saw a warbler in the park", id=10000,
+                    user_id=self.testuser.id),
+            Message(text="Warbler warbler warbler!", id=20000,
+                    user_id=self.testuser.id),
+            Message(text="Quiet day", id=30000, user_id=self.testuser.id),
+        ])
+        db.session.commit()
+
+        resp = self.client.get("/messages/search?q=warbler")
+        html = resp.get_data(as_text=True)
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn("Saw a warbler", html)
+        self.assertNotIn("Quiet day", html)
+        self.assertLess(html.index("Warbler warbler"),
+                        html.index("Saw a warbler"))
+
+    def test_search_messages_bad_cursor(self):
+        """does a malformed search cursor give a 400?"""
+
+        resp = self.client.get("/messages/search?q=warbler&before=nope")
+
+        self.assertEqual(resp.status_code, 400)
+
+    def test_show_message_not_modified(self):
+        """does a message page answer a matching If-None-Match with 304?"""
+
+        db.session.add(Message(text="text", id=10000,
+                               user_id=self.testuser.id))
+        db.session.commit()
 
+        etag = self.client.get("/messages/10000").headers['ETag']
+        resp = self.client.get("/messages/10000",
+                               headers={'If-None-Match': etag})
 
+        self.assertEqual(resp.status_code, 304)
+        self.assertEqual(self.client.get("/messages/20000").status_code, 404)
@@ -0,0 +1,156 @@
+"""Keyset pagination tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_pagination.py
+
+
+import os
+from datetime import datetime
+from unittest import TestCase
+
+from models import db, User, Message, FollowersFollowee
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app
+from pagination import (paginate, paginate_by_id, encode_cursor,
+                        decode_cursor)
+from werkzeug.exceptions import BadRequest
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.create_all()
+
+
+class PaginationTestCase(TestCase):
+    """Tests cursor pagination over messages."""
+
+    def setUp(self):
+        """Create a user with five messages, two sharing a timestamp."""
+
+        User.query.delete()
+        Message.query.delete()
+
+        u = User(
+            email="test@test.com",
+            username="testuser",
+            password="HASHED_PASSWORD",
+            id=10000
+        )
+
+        db.session.add(u)
+
+        timestamps = [datetime(2019, 1, day) for day in (1, 2, 3, 3, 4)]
+
+        for i, timestamp in enumerate(timestamps):
+            db.session.add(Message(id=10000 + i,
+                                   text=f"message {i}",
+                                   timestamp=timestamp,
+                                   user_id=10000))
+
+        db.session.commit()
+
+        self.query = Message.query.filter(Message.user_id == 10000)
+
+    def test_cursor_round_trip(self):
+        """does decode_cursor undo encode_cursor?"""
+
+        key = (datetime(2019, 1, 2, 3, 4, 5, 6), 42)
+
+        self.assertEqual(decode_cursor(encode_cursor(*key)), key)
+
+    def test_walk_older_pages(self):
+        """following `before` cursors visits every message once, newest first"""
+
+        seen = []
+        page = paginate(self.query, Message.timestamp, Message.id, per_page=2)
+        seen.extend(m.id for m in page)
+
+        while page.before:
+            page = paginate(self.query, Message.timestamp, Message.id,
+                            before=page.before, per_page=2)
+            seen.extend(m.id for m in page)
+
+        self.assertEqual(seen, [10004, 10003, 10002, 10001, 10000])
+
+    def test_after_cursor_returns_newer_page(self):
+        """an `after` cursor from page two leads back to page one"""
+
+        first = paginate(self.query, Message.timestamp, Message.id, per_page=2)
+        second = paginate(self.query, Message.timestamp, Message.id,
+                          before=first.before, per_page=2)
+        back = paginate(self.query, Message.timestamp, Message.id,
+                        after=second.after, per_page=2)
+
+        self.assertIsNone(first.after)
+        self.assertEqual([m.id for m in back], [m.id for m in first])
+        self.assertIsNone(back.after)
+
+    def test_malformed_cursor(self):
+        """a garbage cursor is a bad request"""
+
+        with self.assertRaises(BadRequest):
+            paginate(self.query, Message.timestamp, Message.id,
+                     before="garbage")
+
+
+class IdPaginationTestCase(TestCase):
+    """Tests id-cursor pagination over a follower list."""
+
+    def setUp(self):
+        """Create a user followed by five others."""
+
+        User.query.delete()
+
+        db.session.add_all(User(email=f"user{i}@test.com",
+                                username=f"user{i}",
+                                password="HASHED_PASSWORD",
+                                id=10000 + i)
+                           for i in range(6))
+        db.session.flush()
+        db.session.add_all(FollowersFollowee(followee_id=10000 + i,
+                                             follower_id=10000)
+                           for i in range(1, 6))
+        db.session.commit()
+
+        self.query = (User
+                      .query
+                      .join(FollowersFollowee,
+                            FollowersFollowee.followee_id == User.id)
+                      .filter(FollowersFollowee.follower_id == 10000))
+
+    def test_walk_pages(self):
+        """do `before` cursors visit every follower, and `after` lead back?"""
+
+        col = FollowersFollowee.followee_id
+        pages = [paginate_by_id(self.query, col, per_page=2)]
+
+        while pages[-1].before:
+            pages.append(paginate_by_id(self.query, col,
+                                        before=pages[-1].before, per_page=2))
+
+        back = paginate_by_id(self.query, col, after=pages[1].after,
+                              per_page=2)
+
+        self.assertEqual([[u.id for u in page] for page in pages],
+                         [[10005, 10004], [10003, 10002], [10001]])
+        self.assertEqual([u.id for u in back], [10005, 10004])
+        self.assertIsNone(back.after)
+
+    def test_malformed_cursor(self):
+        """a non-numeric cursor is a bad request"""
+
+        with self.assertRaises(BadRequest):
+            paginate_by_id(self.query, FollowersFollowee.followee_id,
+                           after="garbage")
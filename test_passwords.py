@@ -0,0 +1,64 @@
+"""Password hasher tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_passwords.py
+
+
+from threading import Event, Thread
+from unittest import TestCase
+
+from passwords import PasswordHasher, PasswordHasherBusy
+
+
+class PasswordHasherTestCase(TestCase):
+    """Tests the pooled bcrypt hasher."""
+
+    def setUp(self):
+        self.hasher = PasswordHasher()
+        self.hasher.configure(rounds=4, workers=1, queue=1)
+
+    def test_hash_and_verify(self):
+        """does a hash verify its own password and no other?"""
+
+        hashed = self.hasher.hash("secret")
+
+        self.assertTrue(hashed.startswith("$2b$04$"))
+        self.assertTrue(self.hasher.verify(hashed, "secret"))
+        self.assertFalse(self.hasher.verify(hashed, "guess"))
+
+    def test_needs_rehash(self):
+        """are hashes at another cost flagged for re-hashing?"""
+
+        hashed = self.hasher.hash("secret")
+        self.assertFalse(self.hasher.needs_rehash(hashed))
+
+        self.hasher.configure(rounds=5)
+        self.assertTrue(self.hasher.needs_rehash(hashed))
+        self.assertTrue(self.hasher.verify(hashed, "secret"))
+
+    def test_busy_when_pool_is_full(self):
+        """is a hash refused once every worker and queue slot is taken?"""
+
+        release = Event()
+        started = Event()
+
+        def block():
+            started.set()
+            release.wait(5)
+
+        # one job running on the only worker, and the queue slot taken
+        waiter = Thread(target=self.hasher._run, args=(block,))
+        waiter.start()
+        started.wait(5)
+        self.hasher._slots.acquire()
+
+        try:
+            with self.assertRaises(PasswordHasherBusy):
+                self.hasher.hash("secret")
+        finally:
+            self.hasher._slots.release()
+            release.set()
+            waiter.join(5)
+
+        self.assertTrue(self.hasher.verify(self.hasher.hash("ok"), "ok"))
@@ -0,0 +1,136 @@
+"""Connection pool configuration tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_pool.py
+
+
+import os
+from unittest import TestCase
+
+from flask import Flask
+from sqlalchemy import create_engine
+from sqlalchemy.exc import TimeoutError
+from sqlalchemy.pool import NullPool
+
+from pool import PoolStats, TimedQueuePool, engine_options, init_pool
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app
+
+
+def make_config(**config):
+    config.setdefault('SQLALCHEMY_DATABASE_URI', "postgresql:///warbler-test")
+    return config
+
+
+class EngineOptionsTestCase(TestCase):
+    """Tests building engine options from config."""
+
+    def test_postgres_pool(self):
+        """are pool settings passed through for Postgres?"""
+
+        options = engine_options(make_config(DB_POOL_SIZE=3), PoolStats())
+
+        self.assertEqual(options['pool_size'], 3)
+        self.assertEqual(options['max_overflow'], 10)
+        self.assertTrue(options['pool_pre_ping'])
+        self.assertTrue(issubclass(options['poolclass'], TimedQueuePool))
+
+    def test_sqlite(self):
+        """is SQLite left to Flask-SQLAlchemy's pool choice?"""
+
+        options = engine_options(
+            make_config(SQLALCHEMY_DATABASE_URI="sqlite://"), PoolStats())
+
+        self.assertEqual(options, {})
+
+    def test_pgbouncer(self):
+        """does PgBouncer mode leave pooling to the pooler?"""
+
+        options = engine_options(make_config(DB_PGBOUNCER=True), PoolStats())
+
+        self.assertEqual(options, {'poolclass': NullPool})
+
+
+class PoolMetricsTestCase(TestCase):
+    """Tests timing checkouts and per-request timeouts."""
+
+    def make_engine(self, stats, **config):
+        options = engine_options(make_config(**config), stats)
+        return create_engine("postgresql:///warbler-test", **options)
+
+    def test_checkouts_recorded(self):
+        """are checkouts counted and occupancy reported?"""
+
+        stats = PoolStats()
+        engine = self.make_engine(stats, DB_POOL_SIZE=2)
+
+        conn = engine.connect()
+        status = stats.snapshot(engine.pool)
+        conn.close()
+        engine.dispose()
+
+        self.assertEqual(status['checkouts'], 1)
+        self.assertEqual(status['checked_out'], 1)
+        self.assertEqual(status['size'], 2)
+
+    def test_timeout_recorded(self):
+        """is a checkout that times out on a full pool counted?"""
+
+        stats = PoolStats()
+        engine = self.make_engine(stats, DB_POOL_SIZE=1, DB_MAX_OVERFLOW=0,
+                                  DB_POOL_TIMEOUT=0.05)
+
+        conn = engine.connect()
+        try:
+            with self.assertRaises(TimeoutError):
+                engine.connect()
+        finally:
+            conn.close()
+            engine.dispose()
+
+        self.assertEqual(stats.timeouts, 1)
+        self.assertGreaterEqual(stats.max_wait, 0.05)
+
+    def test_statement_timeout_per_request(self):
+        """is the statement timeout set inside requests only?"""
+
+        test_app = Flask(__name__)
+        test_app.config.update(make_config(DB_STATEMENT_TIMEOUT=1234))
+        stats = PoolStats()
+        engine = self.make_engine(stats)
+        init_pool(test_app, engine, stats)
+
+        def current_timeout():
+            with engine.begin() as conn:
+                return conn.execute("SHOW statement_timeout").scalar()
+
+        with test_app.test_request_context():
+            in_request = current_timeout()
+        outside = current_timeout()
+        engine.dispose()
+
+        self.assertEqual(in_request, '1234ms')
+        self.assertNotEqual(outside, '1234ms')
+
+
+class PoolStatusViewTestCase(TestCase):
+    """Tests the pool status endpoint."""
+
+    def test_pool_status(self):
+        """does /_status/pool report the pool when QUERY_STATS is on?"""
+
+        query_stats = app.config['QUERY_STATS']
+        app.config['QUERY_STATS'] = True
+
+        try:
+            resp = app.test_client().get('/_status/pool')
+        finally:
+            app.config['QUERY_STATS'] = query_stats
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn('checked_out', resp.json)
+        self.assertEqual(app.test_client().get('/_status/pool').status_code,
+                         200 if query_stats else 404)
@@ -0,0 +1,43 @@
+"""Query statistics tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_querystats.py
+
+
+from unittest import TestCase
+
+from querystats import QueryStats, fingerprint
+
+
+class QueryStatsTestCase(TestCase):
+    """Tests statement fingerprinting and repeat detection."""
+
+    def test_fingerprint_ignores_values(self):
+        """do statements differing only in values share a fingerprint?"""
+
+        a = "SELECT * FROM users WHERE users.id = %(param_1)s"
+        b = "SELECT *  FROM users\nWHERE users.id = 42"
+
+        self.assertEqual(fingerprint(a), fingerprint(b))
+
+    def test_fingerprint_collapses_in_lists(self):
+        """do IN lists of any length share a fingerprint?"""
+
+        a = "SELECT * FROM likes WHERE message_id IN (%(m_1)s, %(m_2)s)"
+        b = "SELECT * FROM likes WHERE message_id IN (%(m_1)s)"
+
+        self.assertEqual(fingerprint(a), fingerprint(b))
+
+    def test_repeated(self):
+        """are only statements issued threshold times reported?"""
+
+        stats = QueryStats()
+
+        for n in range(5):
+            stats.record(f"SELECT * FROM users WHERE id = {n}", 0.001)
+        stats.record("SELECT * FROM messages", 0.001)
+
+        self.assertEqual(stats.count, 6)
+        self.assertEqual(stats.repeated(threshold=5),
+                         [("SELECT * FROM users WHERE id = ?", 5)])
@@ -0,0 +1,124 @@
+"""Read replica routing tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_replicas.py
+
+
+import os
+import tempfile
+import time
+from unittest import TestCase
+
+from models import (db, User, Message, FollowersFollowee, PRIMARY_UNTIL_KEY,
+                    choose_replica)
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, user_cache
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class ReplicaRoutingTestCase(TestCase):
+    """Tests sending read-only views to a replica.
+
+    The "replica" is a SQLite database holding a copy of the primary's user
+    under another username, so each page shows which database it read.
+    """
+
+    def setUp(self):
+        User.query.delete()
+        Message.query.delete()
+        FollowersFollowee.query.delete()
+        db.session.commit()
+        user_cache.clear()
+
+        user = User.signup("primary", "primary@test.com", "password", None)
+        db.session.add(user)
+        db.session.commit()
+        self.user_id = user.id
+
+        self.directory = tempfile.TemporaryDirectory()
+        url = f"sqlite:///{self.directory.name}/replica.db"
+
+        self.binds = app.config['SQLALCHEMY_BINDS']
+        app.config['DATABASE_REPLICA_URLS'] = [url]
+        app.config['SQLALCHEMY_BINDS'] = {**self.binds, 'replica_0': url}
+
+        self.replica = db.get_engine(app, bind='replica_0')
+        db.Model.metadata.create_all(self.replica)
+        self.replica.execute(User.__table__.insert(), {
+            'id': self.user_id,
+            'username': "replica",
+            'email': "replica@test.com",
+            'password': "HASHED",
+        })
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+        db.session.rollback()
+
+        self.replica.dispose()
+        app.extensions['sqlalchemy'].connectors.pop('replica_0')
+        app.config['DATABASE_REPLICA_URLS'] = []
+        app.config['SQLALCHEMY_BINDS'] = self.binds
+        self.directory.cleanup()
+
+    def test_reads_from_replica(self):
+        """do read-only views query the replica?"""
+
+        resp = self.client.get(f"/users/{self.user_id}")
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn("@replica", resp.get_data(as_text=True))
+
+    def test_other_views_use_primary(self):
+        """do undecorated views still query the primary?"""
+
+        resp = self.client.get("/users/autocomplete?q=pri")
+
+        self.assertEqual([user['username'] for user in resp.json],
+                         ["primary"])
+
+    def test_primary_after_write(self):
+        """after a POST, does the browser read its own writes for a while?"""
+
+        self.client.post("/login", data={"username": "nobody",
+                                         "password": "wrong"})
+        resp = self.client.get(f"/users/{self.user_id}")
+
+        self.assertIn("@primary", resp.get_data(as_text=True))
+
+        with self.client.session_transaction() as sess:
+            sess[PRIMARY_UNTIL_KEY] = time.time() - 1
+
+        resp = self.client.get(f"/users/{self.user_id}")
+
+        self.assertIn("@replica", resp.get_data(as_text=True))
+
+    def test_writes_use_primary(self):
+        """are flushes and UPDATEs kept off the replica?"""
+
+        with app.test_request_context():
+            session = db.session()
+            session.replica = choose_replica()
+
+            try:
+                self.assertIs(session.get_bind(clause=User.__table__.select()),
+                              self.replica)
+                self.assertIsNot(
+                    session.get_bind(clause=User.__table__.update()),
+                    self.replica)
+                self.assertIsNot(session.get_bind(), self.replica)
+            finally:
+                session.replica = None
+
+    def test_no_replica_for_posts(self):
+        """are non-GET requests never routed to a replica?"""
+
+        with app.test_request_context(method="POST"):
+            self.assertIsNone(choose_replica())
@@ -0,0 +1,272 @@
+"""User and message search tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_search.py
+
+
+import os
+from collections import namedtuple
+from datetime import datetime
+from unittest import TestCase
+
+from models import db, User, Message
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app
+from search import (NgramUserSearch, TrigramUserSearch, TsvectorMessageSearch,
+                    InvertedMessageSearch,
+                    escape_like, similarity, tokenize, trigrams,
+                    trigram_available)
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.create_all()
+
+
+class NgramUserSearchTestCase(TestCase):
+    """Tests the in-memory trigram user search."""
+
+    def setUp(self):
+        """Create a few users and index them."""
+
+        User.query.delete()
+        Message.query.delete()
+
+        db.session.add_all([
+            User(id=10000, username="birdwatcher", email="a@test.com",
+                 password="HASHED_PASSWORD", bio="I love warblers",
+                 location="Oakland"),
+            User(id=20000, username="warbler_fan", email="b@test.com",
+                 password="HASHED_PASSWORD", bio="Nothing here",
+                 location="Berkeley"),
+            User(id=30000, username="sparrow", email="c@test.com",
+                 password="HASHED_PASSWORD", bio="Tweet tweet",
+                 location="Warbleton"),
+        ])
+        db.session.commit()
+
+        self.search = NgramUserSearch()
+        self.search.build()
+
+    def test_trigrams_and_similarity(self):
+        """do the trigram helpers behave like pg_trgm's basics?"""
+
+        self.assertEqual(trigrams("Abcd"), {"abc", "bcd"})
+        self.assertEqual(similarity("warbler", "warbler"), 1.0)
+        self.assertEqual(similarity("warbler", "xyz"), 0.0)
+
+    def test_escape_like(self):
+        """are LIKE wildcards escaped?"""
+
+        self.assertEqual(escape_like("50%_off"), "50\\%\\_off")
+
+    def test_search_ranks_username_matches_first(self):
+        """are username matches ranked ahead of bio and location matches?"""
+
+        ids = [user.id for user in self.search.search("warble", limit=10)]
+
+        self.assertEqual(ids[0], 20000)
+        self.assertEqual(set(ids), {10000, 20000, 30000})
+
+    def test_search_tolerates_typos(self):
+        """does a near-miss username still match?"""
+
+        ids = [user.id for user in self.search.search("sparow", limit=10)]
+
+        self.assertEqual(ids, [30000])
+
+    def test_search_limit_and_offset(self):
+        """do limit and offset page through the ranked results?"""
+
+        everything = self.search.search("warbl", limit=10)
+        pages = (self.search.search("warbl", limit=2) +
+                 self.search.search("warbl", limit=2, offset=2))
+
+        self.assertEqual(pages, everything)
+
+    def test_autocomplete(self):
+        """are usernames with the prefix returned alphabetically?"""
+
+        db.session.add(User(id=40000, username="warbling", email="d@test.com",
+                            password="HASHED_PASSWORD"))
+        db.session.commit()
+        self.search.add(User.query.get(40000))
+
+        names = [user.username for user in self.search.autocomplete("WAR", 10)]
+
+        self.assertEqual(names, ["warbler_fan", "warbling"])
+
+    def test_remove(self):
+        """is a removed user no longer found?"""
+
+        self.search.remove(30000)
+
+        self.assertEqual(self.search.search("sparrow", limit=10), [])
+        self.assertEqual(self.search.autocomplete("spa", 10), [])
+
+
+class TrigramUserSearchTestCase(TestCase):
+    """Tests the pg_trgm user search."""
+
+    def setUp(self):
+        User.query.delete()
+        db.session.add(User(id=10000, username="sparrow", email="a@test.com",
+                            password="HASHED_PASSWORD", bio="Tweet tweet",
+                            location="Oakland"))
+        db.session.commit()
+
+        self.search = TrigramUserSearch()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def test_statement_binds(self):
+        """does the driver accept the statement's parameters?"""
+
+        compiled = (self.search.matching("sparow").statement
+                    .compile(dialect=db.engine.dialect))
+        connection = db.engine.raw_connection()
+
+        try:
+            sql = (connection.cursor()
+                   .mogrify(str(compiled), compiled.params)
+                   .decode())
+        finally:
+            connection.close()
+
+        self.assertIn("users.username % 'sparow'", sql)
+
+    def test_search(self):
+        """do substring and near-miss usernames both match?"""
+
+        if not trigram_available():
+            self.skipTest("pg_trgm is not installed")
+
+        self.assertEqual([user.id for user in self.search.search("arro", 10)],
+                         [10000])
+        self.assertEqual([user.id for user in self.search.search("sparow", 10)],
+                         [10000])
+
+
+class TsvectorMessageSearchTestCase(TestCase):
+    """Tests Postgres full-text message search."""
+
+    def setUp(self):
+        User.query.delete()
+        Message.query.delete()
+        db.session.add(User(id=10000, username="birdwatcher", email="a@test.com",
+                            password="HASHED_PASSWORD"))
+        db.session.flush()
+        # every fourth message ranks higher; the rest tie with each other
+        db.session.add_all(Message(id=id, user_id=10000,
+                                   text=("warbler warbler" if id % 4 == 3
+                                         else "a warbler in the park"))
+                           for id in range(1, 41))
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def test_cursor_pages_through_ties(self):
+        """does paging visit every match once when many share a rank?"""
+
+        search = TsvectorMessageSearch()
+        ids, cursor = [], None
+
+        while True:
+            page = search.search("warbler", before=cursor, per_page=5)
+            ids.extend(msg.id for msg in page)
+            cursor = page.before
+            if cursor is None:
+                break
+
+        self.assertEqual(len(ids), 40)
+        self.assertEqual(ids[:10], list(range(39, 0, -4)))
+        self.assertEqual(ids[10:], [id for id in range(40, 0, -1)
+                                    if id % 4 != 3])
+
+    def test_skips_deleted_authors(self):
+        """are a deleted account's messages left out, in both backends?"""
+
+        inverted = InvertedMessageSearch()
+        inverted.build()
+
+        User.query.get(10000).deleted_at = datetime.utcnow()
+        db.session.commit()
+        inverted.remove_author(10000)
+
+        self.assertEqual(list(TsvectorMessageSearch().search("warbler")), [])
+        self.assertEqual(inverted.rank("warbler"), [])
+
+
+class InvertedMessageSearchTestCase(TestCase):
+    """Tests the in-memory message inverted index."""
+
+    def setUp(self):
+        """Index a handful of messages (no database needed)."""
+
+        Doc = namedtuple('Doc', ['id', 'text'])
+        self.Doc = Doc
+
+        self.search = InvertedMessageSearch()
+        self.search.build([
+            Doc(1, "Saw a warbler in the park"),
+            Doc(2, "Warbler warbler warbler!"),
+            Doc(3, "The park was quiet today"),
+            Doc(4, "A yellow warbler in the park at dawn"),
+        ])
+
+    def test_tokenize(self):
+        """are words lower-cased and stop words dropped?"""
+
+        self.assertEqual(tokenize("The Warbler, in a TREE"),
+                         ["warbler", "tree"])
+
+    def test_rank_requires_every_word(self):
+        """does a query only match messages containing all its words?"""
+
+        ids = {id for _, id in self.search.rank("park warbler")}
+
+        self.assertEqual(ids, {1, 4})
+        self.assertEqual(self.search.rank("warbler owl"), [])
+        self.assertEqual(self.search.rank("the"), [])
+
+    def test_ranked_best_first(self):
+        """do denser matches rank higher?"""
+
+        keys, cursor = self.search.ranked_page("warbler")
+
+        self.assertEqual([id for _, id in keys][0], 2)
+        self.assertIsNone(cursor)
+
+    def test_ranked_page_cursor(self):
+        """do cursors page through every match exactly once?"""
+
+        everything, _ = self.search.ranked_page("warbler")
+        first, cursor = self.search.ranked_page("warbler", per_page=2)
+        rest, last = self.search.ranked_page("warbler", before=cursor,
+                                             per_page=2)
+
+        self.assertEqual(first + rest, everything)
+        self.assertIsNone(last)
+
+    def test_add_and_remove(self):
+        """is the index updated incrementally?"""
+
+        self.search.add(self.Doc(5, "An owl at dusk"))
+        self.search.remove(2)
+
+        self.assertEqual([id for _, id in self.search.rank("owl")], [5])
+        self.assertNotIn(2, {id for _, id in self.search.rank("warbler")})
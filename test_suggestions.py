@@ -0,0 +1,194 @@
+"""Who-to-follow suggestion tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_suggestions.py
+
+
+import os
+from unittest import TestCase
+
+from models import (db, User, Message, FollowersFollowee, Suggestion, Job,
+                    follow_graph)
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY, user_cache
+from jobs import work
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+# who follows whom: user 1 follows 2 and 3, and so on
+FOLLOWS = {1: [2, 3], 2: [4, 5], 3: [1, 4], 4: [], 5: [2]}
+
+
+class SuggestionTestCase(TestCase):
+    """Tests computing and serving friends-of-friends suggestions."""
+
+    def setUp(self):
+        User.query.delete()
+        Message.query.delete()
+        Job.query.delete()
+        db.session.commit()
+        user_cache.clear()
+        follow_graph.clear()
+
+        db.session.add_all(User(id=i, username=f"user{i}",
+                                email=f"user{i}@test.com", password="HASHED")
+                           for i in FOLLOWS)
+        db.session.flush()
+        # follows.followee_id is the follower; see FollowersFollowee
+        db.session.add_all(FollowersFollowee(followee_id=user_id,
+                                             follower_id=other_id)
+                           for user_id, others in FOLLOWS.items()
+                           for other_id in others)
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def suggestions(self):
+        return {(s.user_id, s.suggested_id): s.mutuals
+                for s in Suggestion.query}
+
+    def test_rebuild(self):
+        """are friends of friends ranked by mutual follows?"""
+
+        Suggestion.rebuild()
+        db.session.commit()
+
+        self.assertEqual(self.suggestions(), {
+            (1, 4): 2,      # via 2 and 3
+            (1, 5): 1,      # via 2
+            (3, 2): 1,      # via 1
+            (5, 4): 1,      # via 2
+        })
+        self.assertEqual([u.id for u in Suggestion.for_user(1)], [4, 5])
+
+    def test_rebuild_keeps_top_n(self):
+        """is each user's list cut to the best PER_USER?"""
+
+        per_user = Suggestion.PER_USER
+        Suggestion.PER_USER = 1
+        try:
+            Suggestion.rebuild()
+        finally:
+            Suggestion.PER_USER = per_user
+
+        self.assertEqual(Suggestion.query.filter_by(user_id=1).one()
+                         .suggested_id, 4)
+
+    def test_refresh_matches_rebuild(self):
+        """does the per-user refresh agree with the batch rebuild?"""
+
+        Suggestion.rebuild()
+        rebuilt = self.suggestions()
+        Suggestion.query.delete()
+
+        for user_id in FOLLOWS:
+            Suggestion.refresh(user_id)
+
+        self.assertEqual(self.suggestions(), rebuilt)
+
+    def test_follow_updates_suggestions(self):
+        """does following someone drop and then refresh suggestions?"""
+
+        Suggestion.rebuild()
+        db.session.commit()
+
+        with self.client_for(1) as client:
+            resp = client.get('/')
+            self.assertIn(b'Who to follow', resp.data)
+            self.assertIn(b'@user4', resp.data)
+
+            client.post('/users/follow/4')
+            self.assertNotIn(b'@user4', client.get('/').data)
+
+        with app.app_context():
+            work(burst=True)
+
+        # user 4 follows nobody, so only user 5 is left
+        self.assertEqual(self.suggestions()[(1, 5)], 1)
+        self.assertNotIn((1, 4), self.suggestions())
+
+    def test_follow_updates_followers_suggestions(self):
+        """do a user's followers get suggested who the user now follows?"""
+
+        Suggestion.rebuild()
+        db.session.commit()
+        self.assertNotIn((3, 5), self.suggestions())
+
+        with self.client_for(1) as client:
+            client.post('/users/follow/5')
+
+        app.config['JOB_BATCH_SIZE'] = 1
+        try:
+            with app.app_context():
+                runs = work(burst=True)
+        finally:
+            del app.config['JOB_BATCH_SIZE']
+
+        # user 1's own list, then user 3 (1's only follower), then no more
+        self.assertEqual(runs, 3)
+        self.assertEqual(self.suggestions()[(3, 5)], 1)
+
+    def follow(self, user_id, followed_id, change):
+        """(Un)follow, then adjust the suggestions as the jobs would."""
+
+        if change > 0:
+            db.session.add(FollowersFollowee(followee_id=user_id,
+                                             follower_id=followed_id))
+        else:
+            FollowersFollowee.query.filter_by(
+                followee_id=user_id, follower_id=followed_id).delete()
+
+        Suggestion.refresh(user_id)
+        last = 0
+        while last is not None:
+            last = Suggestion.adjust_followers(user_id, followed_id, change,
+                                               after=last, limit=1)
+
+    def test_adjust_followers_matches_rebuild(self):
+        """do per-follow adjustments agree with a rebuild?"""
+
+        Suggestion.rebuild()
+
+        self.follow(2, 1, 1)        # 5 follows 2: gains 1
+        self.follow(4, 2, 1)        # 3 follows 4: (3, 2) via 1 and now 4
+        self.assertEqual(self.suggestions()[(5, 1)], 1)
+        self.assertEqual(self.suggestions()[(3, 2)], 2)
+        adjusted = self.suggestions()
+        Suggestion.rebuild()
+        self.assertEqual(self.suggestions(), adjusted)
+
+        self.follow(2, 1, -1)
+        self.follow(4, 2, -1)
+        self.assertNotIn((5, 1), self.suggestions())
+        self.assertEqual(self.suggestions()[(3, 2)], 1)
+        adjusted = self.suggestions()
+        Suggestion.rebuild()
+        self.assertEqual(self.suggestions(), adjusted)
+
+    def test_adjust_followers_keeps_top_n(self):
+        """is a follower's list cut back to PER_USER after a new entry?"""
+
+        Suggestion.rebuild()
+
+        per_user = Suggestion.PER_USER
+        Suggestion.PER_USER = 1
+        try:
+            self.follow(1, 5, 1)    # 3 follows 1: 5 ties with 2, loses
+        finally:
+            Suggestion.PER_USER = per_user
+
+        self.assertEqual([s.suggested_id
+                          for s in Suggestion.query.filter_by(user_id=3)],
+                         [2])
+
+    def client_for(self, user_id):
+        client = app.test_client()
+        with client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+        return client
@@ -0,0 +1,163 @@
+"""Trending message tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_trending.py
+
+
+import os
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+from models import (db, User, Message, LikeBucket, TrendingMessage,
+                    TrendingRefresh, Job)
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY, user_cache
+import trending
+from jobs import work
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+NOW = datetime(2026, 10, 18, 12, 30)
+
+
+class TrendingTestCase(TestCase):
+    """Tests like buckets, decayed ranking and the trending page."""
+
+    def setUp(self):
+        User.query.delete()
+        Message.query.delete()
+        Job.query.delete()
+        TrendingRefresh.query.delete()
+        db.session.commit()
+        user_cache.clear()
+
+        db.session.add_all(User(id=i, username=f"user{i}",
+                                email=f"user{i}@test.com", password="HASHED")
+                           for i in range(1, 4))
+        db.session.flush()
+        db.session.add_all(Message(id=i, text=f"message {i}", user_id=1)
+                           for i in range(1, 5))
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def like(self, message_id, hours_ago, count=1):
+        for _ in range(abs(count)):
+            trending.record_like(message_id, 1 if count > 0 else -1,
+                                 now=NOW - timedelta(hours=hours_ago))
+
+    def ranking(self, window):
+        return [(entry.message_id, entry.likes)
+                for entry in trending.top(window)]
+
+    def test_record_like(self):
+        """do likes and unlikes in one hour share one counter row?"""
+
+        self.like(1, 0, 3)
+        self.like(1, 0, -1)
+        self.like(1, 2)
+
+        self.assertEqual(
+            sorted((b.bucket, b.count) for b in LikeBucket.query),
+            [(datetime(2026, 10, 18, 10), 1), (datetime(2026, 10, 18, 12), 2)])
+
+    def test_bucket_weights(self):
+        """do weights decay with age and cover exactly the window?"""
+
+        weights = trending.bucket_weights(timedelta(hours=24), NOW)
+
+        self.assertEqual(len(weights), 25)
+        self.assertEqual(min(weights), datetime(2026, 10, 17, 12))
+        # half of each end bucket is inside the window; half-life is 6h
+        self.assertAlmostEqual(weights[datetime(2026, 10, 17, 12)],
+                               0.5 * 0.5 ** (23.75 / 6))
+        self.assertAlmostEqual(weights[datetime(2026, 10, 18, 12)],
+                               0.5 * 0.5 ** (0.25 / 6))
+        ordered = [weights[bucket] for bucket in sorted(weights)[1:-1]]
+        self.assertEqual(ordered, sorted(ordered))
+
+    def test_refresh_ranks_by_decayed_likes(self):
+        """do recent likes outrank older ones, per window?"""
+
+        self.like(1, 0, 2)      # 2 now
+        self.like(2, 20, 3)     # 3 most of a day ago
+        self.like(3, 100, 5)    # 5 four days ago
+        self.like(4, 0, 1)
+        self.like(4, 0, -1)     # liked, then unliked
+        trending.refresh(now=NOW)
+
+        self.assertEqual(self.ranking('1h'), [(1, 2)])
+        self.assertEqual(self.ranking('24h'), [(1, 2), (2, 3)])
+        # half-life 42h: 3 * 0.5 ** (20 / 42) > 2 > 5 * 0.5 ** (100 / 42)
+        self.assertEqual(self.ranking('7d'), [(2, 3), (1, 2), (3, 5)])
+
+    def test_refresh_prunes_old_buckets(self):
+        """are buckets older than the longest window dropped?"""
+
+        self.like(1, 0)
+        self.like(2, 24 * 8)
+        trending.refresh(now=NOW)
+
+        self.assertEqual([b.message_id for b in LikeBucket.query], [1])
+
+    def test_top_k(self):
+        """is only each window's TOP_K stored?"""
+
+        for message_id in range(1, 5):
+            self.like(message_id, 0, message_id)
+
+        top_k = trending.TOP_K
+        trending.TOP_K = 2
+        try:
+            trending.refresh(now=NOW)
+        finally:
+            trending.TOP_K = top_k
+
+        self.assertEqual(self.ranking('24h'), [(4, 4), (3, 3)])
+
+    def test_claim_refresh(self):
+        """is a refresh claimed once per interval, with or without likes?"""
+
+        with app.app_context():
+            claims = [trending.claim_refresh(now=NOW + timedelta(seconds=s))
+                      for s in (0, 1, 59, 60, 61, 119, 130)]
+
+        self.assertEqual(claims, [True, False, False, True, False, False,
+                                  True])
+
+    def test_trending_page(self):
+        """does liking queue a refresh that shows up on the page?"""
+
+        client = app.test_client()
+        with client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = 2
+
+        client.post('/toggle_like_status',
+                    data={'message_id': 3, 'return_url': '/'})
+
+        resp = client.get('/trending')
+        self.assertIn(b'Nothing is trending yet', resp.data)
+        self.assertEqual(Job.query.filter_by(kind='refresh_trending').count(),
+                         1)
+
+        # no second job while one is queued
+        client.get('/trending?window=1h')
+        self.assertEqual(Job.query.count(), 1)
+
+        with app.app_context():
+            work(burst=True)
+
+        resp = client.get('/trending?window=1h')
+        self.assertIn(b'message 3', resp.data)
+        self.assertIn(b'1 likes', resp.data)
+        self.assertEqual(Job.query.count(), 0)
+        self.assertEqual(TrendingMessage.query.filter_by(window='7d').count(),
+                         1)
+
+        self.assertEqual(client.get('/trending?window=2y').status_code, 404)
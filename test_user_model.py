@@ -8,7 +8,8 @@
 import os
 from unittest import TestCase
 
-from models import db, User, Message, FollowersFollowee
+from models import (db, User, Message, FollowersFollowee, repair_counters,
+                    passwords, follow_graph)
 
 # BEFORE we import our app, let's set an environmental variable
 # to use a different database for tests (we need to do this
@@ -39,6 +40,7 @@ class UserModelTestCase(TestCase):
         User.query.delete()
         Message.query.delete()
         FollowersFollowee.query.delete()
+        follow_graph.clear()
 
     def test_user_model(self):
         """Does basic model work?"""
@@ -258,4 +260,106 @@ class UserModelTestCase(TestCase):
 
         result2 = User.authenticate("testuser", "wrong_pswd")
 
-        self.assertFalse(result2)
\ No newline at end of file
+        self.assertFalse(result2)
+
+    def test_repair_counters(self):
+        ''' check that repair_counters recomputes every counter from the tables '''
+
+        user1 = User(
+                email="test@test.com",
+                username="testuser",
+                password="HASHED_PASSWORD",
+                id=10000
+                )
+
+        user2 = User(
+                email="test2@test.com",
+                username="testuser2",
+                password="HASHED_PASSWORD",
+                id=20000
+                )
+
+        message = Message(text="test", user_id=20000, id=10000)
+
+        db.session.add_all([user1, user2, message])
+        user1.following.append(user2)
+        user1.liked_messages.append(message)
+        db.session.commit()
+
+        repair_counters()
+        db.session.commit()
+
+        self.assertEqual((user1.following_count, user1.follower_count,
+                          user1.message_count, user1.likes_count),
+                         (1, 0, 0, 1))
+        self.assertEqual((user2.following_count, user2.follower_count,
+                          user2.message_count, user2.likes_count),
+                         (0, 1, 1, 0))
+        self.assertEqual(message.like_count, 1)
+
+    def test_lookup_answers_follow_and_like_state(self):
+        ''' check the batched viewer lookup agrees with the follows and likes tables '''
+
+        user1 = User(
+                email="test@test.com",
+                username="testuser",
+                password="HASHED_PASSWORD",
+                id=10000
+                )
+
+        user2 = User(
+                email="test2@test.com",
+                username="testuser2",
+                password="HASHED_PASSWORD",
+                id=20000
+                )
+
+        liked = Message(text="liked", user_id=20000, id=10000)
+        not_liked = Message(text="not liked", user_id=20000, id=20000)
+
+        db.session.add_all([user1, user2, liked, not_liked])
+        user1.following.append(user2)
+        user1.liked_messages.append(liked)
+        db.session.commit()
+
+        # start from unloaded relationships, as a fresh request would
+        db.session.expunge_all()
+        user1 = User.query.get(10000)
+        user2 = User.query.get(20000)
+        liked, not_liked = Message.query.get(10000), Message.query.get(20000)
+
+        user1.lookup.prime(messages=[liked, not_liked], users=[user2])
+
+        self.assertTrue(user1.is_following(user2))
+        self.assertFalse(user2.is_following(user1))
+        self.assertTrue(user2.is_followed_by(user1))
+        self.assertFalse(user1.is_followed_by(user2))
+        self.assertTrue(user1.likes_msg(liked))
+        self.assertFalse(user1.likes_msg(not_liked))
+
+    def test_authenticate_rehashes_outdated_cost(self):
+        ''' check that logging in re-hashes a password made at an old cost '''
+
+        rounds = passwords.rounds
+        passwords.configure(rounds=4)
+
+        try:
+            user = User.signup(
+                    email="test@test.com",
+                    username="testuser",
+                    password="HASHED_PASSWORD",
+                    image_url="url"
+                    )
+
+            db.session.add(user)
+            db.session.commit()
+
+            passwords.configure(rounds=5)
+            result = User.authenticate("testuser", "HASHED_PASSWORD")
+            db.session.commit()
+
+            self.assertIs(result, user)
+            self.assertTrue(user.password.startswith("$2b$05$"))
+            self.assertTrue(User.authenticate("testuser", "HASHED_PASSWORD"))
+        finally:
+            passwords.configure(rounds=rounds)
@@ -6,9 +6,12 @@
 
 
 import os
+from datetime import datetime
 from unittest import TestCase
 
-from models import db, connect_db, Message, User, FollowersFollowee
+from models import (db, connect_db, Message, User, CurrentUser,
+                    FollowersFollowee, Timeline, Like, Job, repair_counters,
+                    passwords, follow_graph)
 
 # BEFORE we import our app, let's set an environmental variable
 # to use a different database for tests (we need to do this
@@ -20,7 +23,9 @@ os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
 
 # Now we can import app
 
-from app import app, CURR_USER_KEY
+from app import app, CURR_USER_KEY, user_cache
+from search import get_user_search
+from jobs import work, run_next
 
 # Create our tables (we do this here, so we only create the tables
 # once for all tests --- in each test, we'll delete the data
@@ -32,6 +37,12 @@ db.create_all()
 
 app.config['WTF_CSRF_ENABLED'] = False
 
+# Count SQL statements per request and fail any view that blows the budget
+
+app.config['QUERY_STATS'] = True
+app.config['QUERY_BUDGET'] = 20
+app.config['QUERY_BUDGET_STRICT'] = True
+
 
 class UserViewTestCase(TestCase):
     """Test views for users."""
@@ -41,6 +52,9 @@ class UserViewTestCase(TestCase):
 
         User.query.delete()
         Message.query.delete()
+        Job.query.delete()
+        user_cache.clear()
+        follow_graph.clear()
 
         self.client = app.test_client()
 
@@ -147,7 +161,8 @@ class UserViewTestCase(TestCase):
         current_user = User.query.filter(User.username == "testuser").first()
 
         current_user.following.append(followed_u)
-        
+        Timeline.backfill(current_user.id, followed_u.id)
+
         db.session.commit()
 
         self.client.post("/login",
@@ -192,4 +207,505 @@ class UserViewTestCase(TestCase):
         self.assertIn(b'Edit Profile</a>', resp.data)
         self.assertIn(b'Delete Profile</button>', resp.data)
 
+    def test_follow_backfills_and_unfollow_prunes_timeline(self):
+        '''following copies old messages onto the timeline, unfollowing removes them'''
+
+        followed_u = User(username='followed',
+                          password='password',
+                          email='followed@test.com',
+                          id=999)
+
+        followed_message = Message(text='Followed (message)',
+                                   user_id=999)
+
+        db.session.add_all([followed_u, followed_message])
+        db.session.commit()
+
+        self.client.post("/login",
+                         data={"username": "testuser",
+                               "password": "testuser"})
+
+        self.client.post('/users/follow/999')
+        resp_following = self.client.get('/')
+
+        self.client.post('/users/stop-following/999')
+        resp_unfollowed = self.client.get('/')
+
+        self.assertIn(b'Followed (message)', resp_following.data)
+        self.assertNotIn(b'Followed (message)', resp_unfollowed.data)
+        self.assertEqual(Timeline.query.filter_by(author_id=999).count(), 0)
+
+    def test_follow_counters(self):
+        '''following and unfollowing keep both users' counters in step'''
+
+        followed_u = User(username='followed',
+                          password='password',
+                          email='followed@test.com',
+                          id=999)
+
+        db.session.add(followed_u)
+        db.session.commit()
+
+        self.client.post("/login",
+                         data={"username": "testuser",
+                               "password": "testuser"})
+
+        self.client.post('/users/follow/999')
+        self.client.post('/users/follow/999')
+
+        current_user = User.query.filter(User.username == "testuser").first()
+
+        self.assertEqual(current_user.following_count, 1)
+        self.assertEqual(User.query.get(999).follower_count, 1)
+
+        self.client.post('/users/stop-following/999')
+
+        current_user = User.query.filter(User.username == "testuser").first()
+
+        self.assertEqual(current_user.following_count, 0)
+        self.assertEqual(User.query.get(999).follower_count, 0)
+
+    def test_delete_user_retracts_counters(self):
+        '''deleting an account decrements counters on everyone it touched'''
+
+        other = User(username='other',
+                     password='password',
+                     email='other@test.com',
+                     id=999)
+
+        other_message = Message(text='other message', user_id=999, id=999)
+
+        current_user = User.query.filter(User.username == "testuser").first()
+        own_message = Message(text='own message', user_id=current_user.id)
+
+        db.session.add_all([other, other_message, own_message])
+        current_user.following.append(other)
+        other.following.append(current_user)
+        current_user.liked_messages.append(other_message)
+        other.liked_messages.append(own_message)
+        db.session.commit()
+
+        repair_counters()
+        db.session.commit()
+
+        self.client.post("/login",
+                         data={"username": "testuser",
+                               "password": "testuser"})
+        self.client.post('/users/delete')
+        with app.app_context():
+            work(burst=True)
+
+        other = User.query.get(999)
+
+        self.assertEqual(other.follower_count, 0)
+        self.assertEqual(other.following_count, 0)
+        self.assertEqual(other.likes_count, 0)
+        self.assertEqual(Message.query.get(999).like_count, 0)
+
+    def test_deleted_user_hidden_before_purge(self):
+        '''is a deleted account gone from lists, search and its messages
+        before the worker purges it'''
+
+        user_id = self.testuser.id
+        db.session.add_all([
+            User(username='other', password='password',
+                 email='other@test.com', id=999),
+            Message(text='doomed message', user_id=user_id, id=999),
+        ])
+        db.session.flush()
+        # user 999 and the doomed account follow each other, and 999 likes
+        # its message
+        db.session.add_all([
+            FollowersFollowee(followee_id=999, follower_id=user_id),
+            FollowersFollowee(followee_id=user_id, follower_id=999),
+            Like(user_id=999, message_id=999),
+        ])
+        Timeline.post(Message.query.get(999))
+        Timeline.backfill(999, user_id)
+        db.session.commit()
+
+        pages = ['/', '/users/999/liked', '/messages/search?q=doomed']
+
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = 999
+        for page in pages:
+            self.assertIn(b'doomed message', self.client.get(page).data)
+        for page in ['/users/999/following', '/users/999/followers']:
+            self.assertIn(b'@testuser', self.client.get(page).data)
+
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+        self.client.post('/users/delete')
+
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = 999
+
+        for page in pages:
+            self.assertNotIn(b'doomed message', self.client.get(page).data)
+        for page in ['/users/999/following', '/users/999/followers']:
+            self.assertNotIn(b'@testuser', self.client.get(page).data)
+
+        self.assertNotIn(b'@testuser', self.client.get('/users').data)
+        self.assertNotIn(b'@testuser',
+                         self.client.get('/users?q=testuser').data)
+        self.assertEqual(self.client.get('/users/autocomplete?q=test').json,
+                         [])
+        self.assertEqual(self.client.get('/messages/999').status_code, 404)
+        self.assertEqual(
+            self.client.post('/messages/999/like',
+                             data={'return_url': '/'}).status_code,
+            404)
+        self.assertEqual(Message.query.get(999).like_count, 0)
+
+    def test_unfollow_deleted_user(self):
+        '''unfollowing a deleted account before its purge doesn't retract
+        the follow's counters twice'''
+
+        user_id = self.testuser.id
+        db.session.add(User(username='other', password='password',
+                            email='other@test.com', id=999))
+        db.session.flush()
+        db.session.add(FollowersFollowee(followee_id=user_id, follower_id=999))
+        db.session.commit()
+        repair_counters()
+        db.session.commit()
+
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = 999
+        self.client.post('/users/delete')
+        with app.app_context():
+            run_next()      # retracts counters; follows are purged later
+
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+        resp = self.client.post('/users/stop-following/999')
+
+        self.assertEqual(resp.status_code, 404)
+        self.assertEqual(User.query.get(user_id).following_count, 0)
+
+    def test_account_deleted_mid_session(self):
+        '''a request from a session whose account was just deleted logs it
+        out instead of failing'''
+
+        user_id = self.testuser.id
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+        self.client.get('/messages/new')    # caches the profile
+
+        User.query.filter_by(id=user_id).update(
+            {User.deleted_at: datetime.utcnow()})
+        db.session.commit()
+
+        resp = self.client.post('/messages/new', data={'text': 'hi'})
+
+        self.assertEqual(resp.status_code, 302)
+        self.assertTrue(resp.location.endswith('/login'))
+        with self.client.session_transaction() as sess:
+            self.assertNotIn(CURR_USER_KEY, sess)
+        self.assertEqual(Message.query.filter_by(text='hi').count(), 0)
+
+    def count_queries(self, url):
+        '''GET `url` and return how many SQL statements it issued'''
+
+        resp = self.client.get(url)
+
+        self.assertEqual(resp.status_code, 200)
+        return int(resp.headers['X-Query-Count'])
+
+    def test_feed_query_count_is_bounded(self):
+        '''feed pages load message authors in bulk, not one query per message'''
+
+        self.client.post("/login",
+                         data={"username": "testuser",
+                               "password": "testuser"})
+
+        def add_followed_author(n):
+            author = User(username=f'author{n}',
+                          password='password',
+                          email=f'author{n}@test.com',
+                          id=1000 + n)
+            db.session.add(author)
+            db.session.add(Message(text=f'message {n}', user_id=1000 + n))
+            db.session.commit()
+            self.client.post(f'/users/follow/{1000 + n}')
+
+        add_followed_author(1)
+        few = self.count_queries('/')
+
+        for n in range(2, 7):
+            add_followed_author(n)
+        many = self.count_queries('/')
+
+        self.assertEqual(few, many)
+
+    def test_query_budget_exceeded(self):
+        '''a view issuing more statements than the budget fails the request'''
+
+        app.config['QUERY_BUDGET'] = 0
+        try:
+            resp = self.client.get('/users')
+        finally:
+            app.config['QUERY_BUDGET'] = 20
+
+        self.assertEqual(resp.status_code, 500)
+
+    def test_current_user_is_cached_between_requests(self):
+        '''a page that only needs the profile snapshot doesn't load the user'''
+
+        self.client.post("/login",
+                         data={"username": "testuser",
+                               "password": "testuser"})
+        self.client.get('/messages/new')
+
+        self.assertEqual(self.count_queries('/messages/new'), 0)
+
+    def test_edit_profile_refreshes_cached_user(self):
+        '''a profile edit shows up on the next page, not after the cache expires'''
+
+        self.client.post("/login",
+                         data={"username": "testuser",
+                               "password": "testuser"})
+        self.client.get('/messages/new')
+
+        self.client.post('/users/profile',
+                         data={"username": "renamed",
+                               "email": "test@test.com",
+                               "password": "testuser",
+                               "time_zone": "Etc/GMT-0"})
+        resp = self.client.get('/messages/new')
+
+        self.assertIn(b'alt="renamed"', resp.data)
+
+    def test_cached_profile_of_removed_user(self):
+        '''a cached profile whose row is gone yields no user, and logs out'''
+
+        user_id = self.testuser.id
+        self.client.post("/login",
+                         data={"username": "testuser",
+                               "password": "testuser"})
+        self.client.get('/messages/new')
+
+        User.query.filter(User.id == user_id).delete()
+        db.session.commit()
+
+        with app.test_request_context():
+            self.assertIsNone(CurrentUser.load(user_id, user_cache).user)
+        self.assertIsNone(user_cache.get(user_id))
+
+        self.client.get('/')
+        with self.client.session_transaction() as sess:
+            self.assertNotIn(CURR_USER_KEY, sess)
+
+    def test_is_following_current_user(self):
+        '''loaded follow lists match a CurrentUser by id'''
+
+        other = User(username='other', password='password',
+                     email='other@test.com', id=999)
+        db.session.add(other)
+        db.session.flush()
+        other.following.append(self.testuser)
+        db.session.commit()
+
+        with app.test_request_context():
+            current = CurrentUser.load(self.testuser.id, user_cache)
+
+            self.assertEqual(len(other.following), 1)
+            self.assertTrue(other.is_following(current))
+            self.assertEqual(len(current.user.followers), 1)
+            self.assertTrue(current.user.is_followed_by(
+                CurrentUser.load(999, user_cache)))
+
+    def test_search_users(self):
+        '''searching /users matches bios and returns autocomplete suggestions'''
+
+        u = User(username="other_user",
+                 email="other_user@test.com",
+                 password="testuser",
+                 bio="Lover of warblers",
+                 id=10000)
+
+        db.session.add(u)
+        db.session.commit()
+        get_user_search().build()
+
+        resp = self.client.get('/users?q=warbler')
+        resp_none = self.client.get('/users?q=nobody-like-this')
+        resp_autocomplete = self.client.get('/users/autocomplete?q=oth')
+
+        self.assertIn(b'@other_user', resp.data)
+        self.assertNotIn(b'@testuser', resp.data)
+        self.assertIn(b'Sorry, no users found', resp_none.data)
+        self.assertEqual(resp_autocomplete.json,
+                         [{'id': 10000,
+                           'username': 'other_user',
+                           'image_url': '/static/images/default-pic.png'}])
+
+    def test_login_busy(self):
+        """does a login get a 503 when the hashing pool is full?"""
+
+        slots = passwords._slots
+        while slots.acquire(blocking=False):
+            pass
+
+        try:
+            resp = self.client.post("/login", data={"username": "testuser",
+                                                    "password": "testuser"})
+        finally:
+            passwords.configure()
+
+        self.assertEqual(resp.status_code, 503)
+        self.assertEqual(resp.headers['Retry-After'], '5')
+
+    def test_logged_in_html_not_stored(self):
+        """are pages for a logged-in user marked no-store?"""
+
+        user_id = self.testuser.id
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = user_id
+
+            resp = c.get("/")
+
+        self.assertIn('no-store', resp.headers['Cache-Control'])
+
+    def test_profile_not_modified(self):
+        '''a repeat profile request with a matching ETag gets a bare 304'''
+
+        user = User.query.filter(User.username == "testuser").first()
+        user.id = 10000
+        db.session.commit()
+
+        self.client.post("/login",
+                         data={"username": "testuser",
+                               "password": "testuser"},
+                         follow_redirects=True)
+
+        first = self.client.get('/users/10000')
+        etag = first.headers['ETag']
+
+        again = self.client.get('/users/10000',
+                                headers={'If-None-Match': etag})
+
+        self.assertEqual(again.status_code, 304)
+        self.assertEqual(again.data, b'')
+        self.assertEqual(again.headers['ETag'], etag)
+        self.assertIn('Last-Modified', first.headers)
+        self.assertEqual(first.headers['Cache-Control'], 'private, no-cache')
+        self.assertLess(int(again.headers['X-Query-Count']),
+                        int(first.headers['X-Query-Count']))
+
+        self.client.post("/messages/new", data={"text": "Hello"})
+
+        changed = self.client.get('/users/10000',
+                                  headers={'If-None-Match': etag})
+
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed.headers['ETag'], etag)
+
+    def test_followers_etag_follows_profile_edits(self):
+        '''editing a listed follower's profile changes the followers ETag'''
+
+        u = User(username="other_user",
+                 email="other_user@test.com",
+                 password="testuser",
+                 id=10000)
+        db.session.add(u)
+        u.following.append(User.query.filter_by(username="testuser").one())
+        db.session.commit()
+        user_id = User.query.filter_by(username="testuser").one().id
+
+        self.client.post("/login",
+                         data={"username": "testuser",
+                               "password": "testuser"},
+                         follow_redirects=True)
+
+        etag = self.client.get(f'/users/{user_id}/followers').headers['ETag']
+        resp = self.client.get(f'/users/{user_id}/followers',
+                               headers={'If-None-Match': etag})
+
+        self.assertEqual(resp.status_code, 304)
+
+        User.query.get(10000).bio = "new bio"
+        User.query.get(10000).updated_at = datetime.utcnow()
+        db.session.commit()
+
+        resp = self.client.get(f'/users/{user_id}/followers',
+                               headers={'If-None-Match': etag})
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn(b'new bio', resp.data)
+
+    def test_followers_paginated(self):
+        '''follower lists show one page at a time, with the counter total'''
+
+        testuser = User.query.filter_by(username="testuser").one()
+        user_id = testuser.id
+
+        followers = [User(username=f"fan{i}",
+                          email=f"fan{i}@test.com",
+                          password="testuser",
+                          id=20000 + i)
+                     for i in range(30)]
+        db.session.add_all(followers)
+        testuser.followers.extend(followers)
+        db.session.commit()
+        repair_counters()
+        db.session.commit()
+
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+
+        first = self.client.get(f'/users/{user_id}/followers')
+        second = self.client.get(f'/users/{user_id}/followers?before=20006')
+
+        self.assertIn(b'30 followers', first.data)
+        self.assertEqual(first.data.count(b'@fan'), 24)
+        self.assertIn(b'@fan29', first.data)
+        self.assertIn(b'before=20006', first.data)
+        self.assertEqual(second.data.count(b'@fan'), 6)
+        self.assertIn(b'@fan0<', second.data)
+
+    def test_follow_updates_follow_graph(self):
+        '''following / unfollowing shows at once, despite the cached graph'''
+
+        followed_u = User(username='followed',
+                          password='password',
+                          email='followed@test.com',
+                          id=999)
+        db.session.add(followed_u)
+        db.session.commit()
+
+        self.client.post("/login",
+                         data={"username": "testuser",
+                               "password": "testuser"},
+                         follow_redirects=True)
+
+        before = self.client.get('/users/999')
+        self.client.post('/users/follow/999')
+        following = self.client.get('/users/999')
+        self.client.post('/users/stop-following/999')
+        after = self.client.get('/users/999')
+
+        self.assertNotIn(b'Unfollow', before.data)
+        self.assertIn(b'Unfollow', following.data)
+        self.assertNotIn(b'Unfollow', after.data)
+
+    def test_follow_shows_despite_stale_cache(self):
+        '''does a follower see their own follow even if this process's
+        cached graph predates it (as another worker's would)'''
+
+        db.session.add(User(username='followed', password='password',
+                            email='followed@test.com', id=999))
+        db.session.commit()
+        user_id = self.testuser.id
+
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+
+        self.client.get('/users/999')
+        stale = follow_graph.following(user_id)
+        self.client.post('/users/follow/999')
+        follow_graph.local.set(follow_graph.key(user_id), stale)
 
+        self.assertIn(b'Unfollow', self.client.get('/users/999').data)
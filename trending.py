@@ -0,0 +1,187 @@
+"""Trending messages: the most-liked messages of the last hour, day and week.
+
+Likes aren't counted from `likes` at read time -- that's a scan of every
+like in the window. Instead each like or unlike adds +1/-1 to its
+message's counter for the current hour in `like_buckets`, so a message
+has at most one row per hour it was liked in, and a window's counts are a
+sum over a few rows per message.
+
+Messages are ranked by their likes with exponential decay -- a like
+counts half as much every quarter of the window -- so a burst of likes
+now beats the same likes at the start of the window. The hour straddling
+the start of a window counts for the part of it inside the window.
+
+Ranking is too slow to do per request, so `refresh()` stores each
+window's TOP_K in `trending`, and the /trending page reads that. The page
+queues a 'refresh_trending' job at most once per TRENDING_REFRESH_SECONDS
+(see `claim_refresh`); `flask refresh-trending` runs one directly.
+"""
+
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy.dialects.postgresql import insert
+
+from models import (db, LikeBucket, TrendingMessage, TrendingRefresh, Message,
+                    User)
+
+WINDOWS = {
+    '1h': timedelta(hours=1),
+    '24h': timedelta(hours=24),
+    '7d': timedelta(days=7),
+}
+DEFAULT_WINDOW = '24h'
+BUCKET = timedelta(hours=1)
+TOP_K = 100
+REFRESH_SECONDS = 60
+
+
+def bucket_start(when):
+    """Start of the bucket (hour) `when` falls in."""
+
+    return when.replace(minute=0, second=0, microsecond=0)
+
+
+def record_like(message_id, change, now=None):
+    """Add `change` (+1 for a like, -1 for an unlike) to this hour's count.
+
+    Runs in the caller's transaction.
+    """
+
+    bucket = bucket_start(now or datetime.utcnow())
+
+    if db.engine.dialect.name == 'postgresql':
+        stmt = insert(LikeBucket.__table__).values(
+            message_id=message_id, bucket=bucket, count=change)
+        db.session.execute(stmt.on_conflict_do_update(
+            index_elements=['message_id', 'bucket'],
+            set_={'count': LikeBucket.__table__.c.count + stmt.excluded.count}))
+        return
+
+    updated = (LikeBucket
+               .query
+               .filter_by(message_id=message_id, bucket=bucket)
+               .update({LikeBucket.count: LikeBucket.count + change},
+                       synchronize_session=False))
+    if not updated:
+        db.session.add(LikeBucket(message_id=message_id, bucket=bucket,
+                                  count=change))
+
+
+def bucket_weights(window, now):
+    """{bucket start: weight} for the buckets overlapping `window` before `now`.
+
+    A bucket's weight is the fraction of it inside the window times the
+    decay at its midpoint; the half-life is a quarter of the window.
+    """
+
+    start = now - window
+    half_life = window / 4
+    weights = {}
+
+    bucket = bucket_start(start)
+    while bucket < now:
+        lo, hi = max(bucket, start), min(bucket + BUCKET, now)
+        if hi > lo:
+            age = now - (lo + (hi - lo) / 2)
+            weights[bucket] = (hi - lo) / BUCKET * 0.5 ** (age / half_life)
+        bucket += BUCKET
+
+    return weights
+
+
+def rank(window, now):
+    """(message_id, score, likes) of the TOP_K messages in `window`."""
+
+    weights = bucket_weights(window, now)
+    weight = db.case([(LikeBucket.bucket == bucket, weight)
+                      for bucket, weight in weights.items()],
+                     else_=0)
+    score = db.func.sum(LikeBucket.count * weight)
+
+    return (db.session
+            .query(LikeBucket.message_id, score, db.func.sum(LikeBucket.count))
+            .filter(LikeBucket.bucket >= min(weights))
+            .group_by(LikeBucket.message_id)
+            .having(score > 0)
+            .order_by(score.desc(), LikeBucket.message_id.desc())
+            .limit(TOP_K)
+            .all())
+
+
+def refresh(now=None):
+    """Recompute every window's top messages and prune expired buckets.
+
+    Runs in the caller's transaction.
+    """
+
+    now = now or datetime.utcnow()
+
+    for name, window in WINDOWS.items():
+        ranked = rank(window, now)
+
+        TrendingMessage.query.filter_by(window=name).delete()
+        db.session.add_all(
+            TrendingMessage(window=name,
+                            rank=position,
+                            message_id=message_id,
+                            score=score,
+                            likes=likes,
+                            computed_at=now)
+            for position, (message_id, score, likes) in enumerate(ranked, 1))
+
+    oldest = bucket_start(now - max(WINDOWS.values()))
+    LikeBucket.query.filter(LikeBucket.bucket < oldest).delete()
+
+
+def top(window, limit=TOP_K):
+    """The stored ranking for `window`, as TrendingMessage rows."""
+
+    return (TrendingMessage
+            .query
+            .filter_by(window=window)
+            .join(Message)
+            .join(User, Message.user_id == User.id)
+            .filter(User.deleted_at.is_(None))
+            .options(db.contains_eager(TrendingMessage.message)
+                     .contains_eager(Message.user))
+            .order_by(TrendingMessage.rank)
+            .limit(limit)
+            .all())
+
+
+def claim_refresh(now=None):
+    """Should this request queue a refresh? At most one per interval does.
+
+    A single upsert on the one-row `trending_refresh` table moves its due
+    time TRENDING_REFRESH_SECONDS ahead if it has passed, and reports
+    whether it did -- so deciding touches neither the rankings nor the job
+    queue, and runs on the primary even in views reading from a replica.
+    Runs in the caller's transaction.
+    """
+
+    now = now or datetime.utcnow()
+    due_at = now + timedelta(seconds=current_app.config.get(
+        'TRENDING_REFRESH_SECONDS', REFRESH_SECONDS))
+    table = TrendingRefresh.__table__
+
+    if db.engine.dialect.name == 'postgresql':
+        stmt = insert(table).values(id=1, due_at=due_at)
+        return bool(db.session.execute(stmt.on_conflict_do_update(
+            index_elements=['id'],
+            set_={'due_at': due_at},
+            where=table.c.due_at <= now)).rowcount)
+
+    claimed = (TrendingRefresh
+               .query
+               .filter(TrendingRefresh.id == 1, TrendingRefresh.due_at <= now)
+               .update({TrendingRefresh.due_at: due_at},
+                       synchronize_session=False))
+    if claimed:
+        return True
+
+    if TrendingRefresh.query.get(1) is None:
+        db.session.add(TrendingRefresh(id=1, due_at=due_at))
+        return True
+
+    return False